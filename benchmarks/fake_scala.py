@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""A scriptable stand-in for the Scala REPL, used by the benchmarks.
+
+It prints the ``scala> `` and ``     | `` prompts, supports paste mode, and
+answers the code that the kernel generates for the ``ScalaTionKernelIO``
+helper and for its text fallbacks. The size of the synthetic data is encoded
+in the names used in a cell:
+
+* ``vec_N``     - a vector of ``N`` doubles
+* ``mat_RxC``   - an ``R`` by ``C`` matrix of doubles
+* ``rel_RxC``   - a relation with ``R`` rows and ``C`` columns
+* ``spam_N``    - a statement that prints ``N`` lines
+
+Data can also be exported to and imported from NPY and CSV files using the
+helper, which also reports made-up JVM resources (for ``::resources``). When
+it is started with ``ScalaTionKernelBridge`` as an argument, it stands in for
+the bridge engine's interpreter server instead, evaluating the same
+statements but speaking the bridge's protocol over a socket.
+``Thread.sleep(N)`` sleeps for ``N`` milliseconds, and everything else is
+treated as an ordinary statement; ``val x = ...`` prints ``x: Int = ...``,
+like the real REPL. With ``FAKE_SCALA_HELPER=0``, the
+helper fails to load, so the kernel falls back to moving data as text, and
+``FAKE_SCALA_DELAY`` adds a fixed delay (in seconds) to every statement.
+"""
+
+import json
+import os
+import random
+import re
+import socket
+import struct
+import sys
+import time
+
+PROMPT_MAIN = 'scala> '
+PROMPT_CONT = '     | '
+PASTE_ENTER = '// Entering paste mode (ctrl-D to finish)'
+PASTE_EXIT  = '// Exiting paste mode, now interpreting.'
+
+HELPER = os.environ.get('FAKE_SCALA_HELPER', '1') != '0'
+DELAY  = float(os.environ.get('FAKE_SCALA_DELAY', 0))
+START  = time.time()
+
+SPAM   = re.compile(r'^spam_(\d+)$')
+SLEEP  = re.compile(r'^Thread\.sleep\((\d+)\)$')
+VALUE  = re.compile(r'^va[lr]\s+(\w+)\s*(?::\s*[\w\[\]]+)?\s*=\s*(.*)$')
+STRING = re.compile(r'^println\(("(?:[^"\\]|\\.)*")(?: \+ ("(?:[^"\\]|\\.)*"))?\)$')
+
+WRITE_DOUBLES = re.compile(r'^println\(ScalaTionKernelIO\.writeDoubles\(vec_(\d+)\(\), "(.*)"\)\)$')
+WRITE_MATRIX  = re.compile(r'^println\(ScalaTionKernelIO\.writeMatrix\(mat_(\d+)x(\d+)\(\), "(.*)", '
+                           r'(\d+), (\d+), (\d+), (\d+), (\d+), (\d+), (\d+)\)\)$')
+WRITE_ROWS    = re.compile(r'^println\(ScalaTionKernelIO\.writeRows\(\((\d+) until (\d+)\)\.map\(rel_\d+x\d+\.row\(_\)\), '
+                           r'Array\[Int\]\(([\d,]*)\), "(.*)"\)\)$')
+TEXT_VECTOR   = re.compile(r'^println\(vec_(\d+)\(\)\.mkString')
+TEXT_MATRIX   = re.compile(r'^println\(mat_(\d+)x(\d+)\(\)\.map')
+TEXT_ROWS     = re.compile(r'^println\(\((\d+) until (\d+)\)\.map\(rel_\d+x(\d+)\.row')
+REL_INFO      = re.compile(r'^println\(Seq\(rel_(\d+)x(\d+)\.name')
+ANY_INFO      = re.compile(r'^println\(Seq\((\w+)\.name')
+CLASS_NAME    = re.compile(r'^println\((\w+)\.getClass\.getName\)$')
+WRITE_NPY     = re.compile(r'^println\(ScalaTionKernelIO\.writeNPY\((vec|mat)_(\d+)(?:x(\d+))?\(\), "(.*)"\)\)$')
+WRITE_CSV     = re.compile(r'^println\(ScalaTionKernelIO\.writeCSV\(.*?(vec|mat|rel)_(\d+)(?:x(\d+))?.*, "(.*)"\)\)$')
+READ_DATA     = re.compile(r'^lazy val (\w+) = new scalation\.linalgebra\.(VectorD|MatrixD)\((\d+), (?:(\d+), )?'
+                           r'ScalaTionKernelIO\.read\w+\("(.*)", (\d+)L')
+READ_REL      = re.compile(r'^lazy val (\w+) = scalation\.columnar_db\.Relation\("(.*?)"')
+DIMENSION     = re.compile(r'^println\((\w+)\.(dim|dim1|rows)\)$')
+ATTACH        = re.compile(r'^ScalaTionKernelIO\.attachDoubles\(vec_(\d+)\(\)\)$')
+
+BRIDGE_NAME  = 'ScalaTionKernelBridge'
+BRIDGE_READY = '<scalation_kernel>:bridge:'
+
+CLASSES  = {'vec': 'scalation.linalgebra.VectorD', 'mat': 'scalation.linalgebra.MatrixD', 'rel': 'scalation.columnar_db.Relation'}
+imported = {}                                           # name -> rows
+attached = None                                         # bridge payloads
+
+def out(text):
+    """Write ``text`` to the terminal."""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+def doubles(n):
+    """Return ``n`` synthetic doubles."""
+    return [i + random.random() for i in range(n)]
+
+def cell(i, j):
+    """Return the synthetic value of a relation cell."""
+    return 'r{}c{}'.format(i, j) if j % 2 == 0 else str(i * j)
+
+def write_matrix(match):
+    """Answer ``ScalaTionKernelIO.writeMatrix`` for a slice of a matrix."""
+    rows, cols, path = int(match.group(1)), int(match.group(2)), match.group(3)
+    r0, r1, rs, c0, c1, cs, max_rows = (int(g) for g in match.groups()[3:])
+    nrows = len(range(r0, min(r1, rows), rs))
+    ncols = len(range(c0, min(c1, cols), cs))
+    if max_rows > 0 and nrows > max_rows:
+        rs    = rs * -(-nrows // max_rows)
+        nrows = len(range(r0, min(r1, rows), rs))
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<{}d'.format(nrows * ncols), *doubles(nrows * ncols)))
+    return '{} {} {} {}'.format(nrows, ncols, r0, rs)
+
+def npy_header(shape):
+    """Return the NPY header that the helper writes for an array of doubles."""
+    text = "{{'descr': '<f8', 'fortran_order': False, 'shape': {}, }}".format(shape)
+    text = text + ' ' * ((64 - (10 + len(text) + 1) % 64) % 64) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(text)) + text.encode('ascii')
+
+def write_npy(match):
+    """Answer ``ScalaTionKernelIO.writeNPY`` for a vector or matrix."""
+    kind, rows, cols, path = match.group(1), int(match.group(2)), int(match.group(3) or 1), match.group(4)
+    with open(path, 'wb') as f:
+        f.write(npy_header('({},)'.format(rows) if kind == 'vec' else '({}, {})'.format(rows, cols)))
+        for start in range(0, rows, 65536):
+            count = min(65536, rows - start) * cols
+            f.write(struct.pack('<{}d'.format(count), *doubles(count)))
+    return str(rows) if kind == 'vec' else '{} {}'.format(rows, cols)
+
+def write_csv(match):
+    """Answer ``ScalaTionKernelIO.writeCSV`` for a vector, matrix or relation."""
+    kind, rows, cols, path = match.group(1), int(match.group(2)), int(match.group(3) or 1), match.group(4)
+    with open(path, 'w') as f:
+        if kind == 'rel':
+            f.write(','.join('c{}'.format(j) for j in range(cols)) + '\n')
+        for i in range(rows):
+            values = [cell(i, j) for j in range(cols)] if kind == 'rel' else [repr(x) for x in doubles(cols)]
+            f.write(','.join(values) + '\n')
+    return str(rows)
+
+def read_data(match):
+    """Answer the ``lazy val`` that ``::import`` uses for a vector or matrix."""
+    name, kind, rows, path, offset = match.group(1), match.group(2), int(match.group(3)), match.group(5), int(match.group(6))
+    cols = int(match.group(4) or 1)
+    if os.path.getsize(path) < offset + 8 * rows * cols:
+        return 'java.io.EOFException: not enough data'
+    imported[name] = rows
+    return '{}: scalation.linalgebra.{} = <lazy>'.format(name, kind)
+
+def write_rows(match):
+    """Answer ``ScalaTionKernelIO.writeRows`` for rows of a relation."""
+    start, stop, path = int(match.group(1)), int(match.group(2)), match.group(4)
+    cols = [int(col) for col in match.group(3).split(',') if col != '']
+    with open(path, 'wb') as f:
+        for i in range(start, stop):
+            for j in cols:
+                data = cell(i, j).encode('utf-8')
+                f.write(struct.pack('>i', len(data)) + data)
+    return str(stop - start)
+
+def resources():
+    """Answer ``ScalaTionKernelIO.resources``, using this process's CPU time
+       and made-up memory figures.
+    """
+    times = os.times()
+    return json.dumps({ 'heap_used': 96 << 20, 'heap_committed': 256 << 20, 'heap_max': 4 << 30,
+                        'heap_peak': 180 << 20, 'non_heap_used': 40 << 20, 'non_heap_committed': 48 << 20,
+                        'gc': [['G1 Young Generation', 12, 85], ['G1 Old Generation', 0, 0]],
+                        'cpu_time': int((times.user + times.system) * 1e9), 'cpu_load': 0.02,
+                        'processors': os.cpu_count(), 'threads': 17, 'uptime': int(1000 * (time.time() - START)),
+                        'arguments': sys.argv[1:] })
+
+def evaluate(line):
+    """Evaluate one (fake) Scala statement and print its output."""
+    line = line.strip()
+    if line == '':
+        return
+    if DELAY > 0:
+        time.sleep(DELAY)
+    if line == ':reset':
+        out('Resetting interpreter state.\n')
+        imported.clear()
+        return
+    if line.startswith(':require '):
+        out("Added '{}' to classpath.\n".format(line[len(':require '):]))
+        return
+    if line.startswith(':paste '):
+        out('Pasting file {}...\n'.format(line[len(':paste '):]))
+        if HELPER and line.endswith('ScalaTionKernelIO.scala'):
+            out('defined object ScalaTionKernelIO\n')
+        return
+    if line == 'println(util.Properties.versionNumberString)':
+        out('2.12.8\n')
+        return
+    match = STRING.match(line)
+    if match:
+        out(''.join(eval(group) for group in match.groups() if group) + '\n')
+        return
+    if line.startswith('println(ScalaTionKernelIO.') and not HELPER:
+        out('<console>:12: error: not found: value ScalaTionKernelIO\n')
+        return
+    for pattern, answer in [(WRITE_MATRIX, write_matrix), (WRITE_ROWS, write_rows)]:
+        match = pattern.match(line)
+        if match:
+            out(answer(match) + '\n')
+            return
+    match = CLASS_NAME.match(line)
+    if match:
+        name = match.group(1)
+        out((CLASSES.get(name.split('_')[0]) or ('scalation.linalgebra.VectorD' if name in imported else 'java.lang.Integer')) + '\n')
+        return
+    for pattern, answer in [(WRITE_NPY, write_npy), (WRITE_CSV, write_csv), (READ_DATA, read_data)]:
+        match = pattern.match(line)
+        if match:
+            out(answer(match) + '\n')
+            return
+    match = READ_REL.match(line)
+    if match:
+        with open(match.group(2)) as f:
+            imported[match.group(1)] = sum(1 for row in f) - 1
+        out('{}: scalation.columnar_db.Relation = <lazy>\n'.format(match.group(1)))
+        return
+    match = DIMENSION.match(line)
+    if match and match.group(1) in imported:
+        out('{}\n'.format(imported[match.group(1)]))
+        return
+    if line == 'println(ScalaTionKernelIO.resources())':
+        out(resources() + '\n')
+        return
+    match = ATTACH.match(line)
+    if match and HELPER and attached != None:
+        size = int(match.group(1))
+        attached.append(struct.pack('<{}d'.format(size), *doubles(size)))
+        out('res0: Int = {}\n'.format(size))
+        return
+    match = WRITE_DOUBLES.match(line)
+    if match:
+        size = int(match.group(1))
+        with open(match.group(2), 'wb') as f:
+            f.write(struct.pack('<{}d'.format(size), *doubles(size)))
+        out('{}\n'.format(size))
+        return
+    match = TEXT_VECTOR.match(line)
+    if match:
+        out('[{}]\n'.format(','.join(repr(x) for x in doubles(int(match.group(1))))))
+        return
+    match = TEXT_MATRIX.match(line)
+    if match:
+        rows, cols = int(match.group(1)), int(match.group(2))
+        out('[{}]\n'.format(','.join('[{}]'.format(','.join(repr(x) for x in doubles(cols))) for i in range(rows))))
+        return
+    match = REL_INFO.match(line)
+    if match:
+        rows, cols = int(match.group(1)), int(match.group(2))
+        out('rel\n{}\n{}\n'.format(rows, '\t'.join('c{}'.format(j) for j in range(cols))))
+        return
+    match = ANY_INFO.match(line)
+    if match:
+        out('<console>:12: error: not found: value {}\n'.format(match.group(1)))
+        return
+    match = TEXT_ROWS.match(line)
+    if match:
+        start, stop, cols = (int(g) for g in match.groups())
+        rows = ("['{}']".format("','".join(cell(i, j) for j in range(cols))) for i in range(start, stop))
+        out('[{}]\n'.format(','.join(rows)))
+        return
+    match = SLEEP.match(line)
+    if match:
+        time.sleep(int(match.group(1)) / 1000)
+        return
+    match = SPAM.match(line)
+    if match:
+        for i in range(int(match.group(1))):
+            out('line {} of synthetic output\n'.format(i))
+        return
+    match = VALUE.match(line)
+    if match:
+        out('{}: Int = {}\n'.format(match.group(1), match.group(2)))
+        return
+    if line.startswith(('def ', 'import ', 'class ', 'object ')):
+        words = line.split()
+        out('defined {} {}\n'.format(words[0], words[1].split('(')[0]) if words[0] in ('class', 'object') else '')
+        return
+    out('res0: Unit = ()\n')
+
+def main():
+    out('Welcome to Scala 2.12.8 (fake).\nType in expressions for evaluation. Or try :help.\n\n' + PROMPT_MAIN)
+    pending = []                                        # incomplete statement
+    while True:
+        line = sys.stdin.readline()
+        if line == '':
+            break
+        line = line.rstrip('\n')
+        if len(pending) > 0 or line.count('{') > line.count('}'):
+            pending.append(line)
+            text = '\n'.join(pending)
+            if text.count('{') > text.count('}'):
+                out(PROMPT_CONT)                        # continue the statement
+                continue
+            evaluate(pending[0])
+            pending = []
+        elif line.strip() == ':paste':
+            out(PASTE_ENTER + '\n\n')
+            block = []
+            while True:                                 # until ctrl-D
+                line = sys.stdin.readline()
+                if line == '':
+                    break
+                block.append(line.rstrip('\n'))
+            out('\n' + PASTE_EXIT + '\n\n')
+            for line in block:
+                evaluate(line)
+        else:
+            evaluate(line)
+        out('\n' + PROMPT_MAIN)
+
+class BridgeOutput(object):
+    """A stand-in for ``sys.stdout`` that sends what is written to it as
+    ``stdout`` responses to the running request of the bridge.
+    """
+
+    def __init__(self, conn):
+        """Construct the output for the connection ``conn``."""
+        self.conn    = conn
+        self.id      = -1
+        self.written = []
+
+    def write(self, text):
+        """Send ``text`` right away."""
+        self.written.append(text)
+        send_response(self.conn, {'id': self.id, 'kind': 'stdout'}, [text.encode('utf-8')])
+
+    def flush(self):
+        """Do nothing, since nothing is buffered."""
+
+def send_response(conn, header, frames=()):
+    """Send a response of the bridge, with its ``frames``."""
+    header = dict(header, frames=len(frames))
+    data   = [json.dumps(header).encode('utf-8')] + list(frames)
+    conn.sendall(b''.join(struct.pack('>I', len(frame)) + frame for frame in data))
+
+def read_request(stream):
+    """Read a request of the bridge, or return ``None`` at the end."""
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    return stream.read(struct.unpack('>I', header)[0]).decode('utf-8')
+
+def serve_bridge():
+    """Stand in for the bridge's interpreter server."""
+    global attached
+    server = socket.create_server(('127.0.0.1', 0))
+    out('{}{}\n'.format(BRIDGE_READY, server.getsockname()[1]))
+    conn, addr = server.accept()
+    server.close()
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    stream = conn.makefile('rb')
+    if read_request(stream) != os.environ.get('SCALATION_KERNEL_BRIDGE_TOKEN'):
+        sys.exit(1)
+    sys.stdout = output = BridgeOutput(conn)
+    pending = []                                        # incomplete line
+    while True:
+        request = read_request(stream)
+        if request == None or request.startswith('quit '):
+            break
+        header, sep, code = request.partition('\n')
+        op, id = header.split()
+        if op == 'interrupt':
+            continue                                    # nothing runs in the background
+        output.id, output.written, attached = int(id), [], []
+        status = 'ok'
+        if op == 'reset':
+            imported.clear()
+        elif op == 'eval' and 'object ScalaTionKernelIO' in code:
+            out('defined object ScalaTionKernelIO\n' if HELPER else '<console>:12: error: fake\n')
+        elif op == 'line' and (len(pending) > 0 or code.count('{') > code.count('}')):
+            pending.append(code)
+            text = '\n'.join(pending)
+            if text.count('{') > text.count('}'):
+                status = 'incomplete'
+            else:
+                evaluate(pending[0])
+                pending = []
+        else:
+            for line in code.split('\n'):
+                evaluate(line)
+        if 'error: ' in ''.join(output.written):
+            status = 'error'
+        send_response(conn, {'id': int(id), 'kind': 'result', 'status': status, 'name': '', 'type': ''}, attached)
+        attached = None
+
+if __name__ == '__main__':
+    if BRIDGE_NAME in sys.argv:
+        serve_bridge()
+    else:
+        main()
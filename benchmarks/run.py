@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""Benchmarks for the hot paths of ScalaTion Kernel.
+
+Each benchmark drives a ``ScalaTionKernel`` against ``fake_scala.py``, a local
+stand-in for the Scala REPL, in a fresh process (so that its peak RSS is its
+own) and reports:
+
+* ``latency``  - median and 95th percentile time per operation (e.g., cell)
+* ``pty``      - bytes read from the REPL's terminal
+* ``bulk``     - bytes moved through the bulk data side channel
+* ``iopub``    - bytes of the messages sent to the notebook
+* ``rss``      - peak resident set size of the kernel's process
+* ``render``   - time spent rendering figures
+
+Run all of the benchmarks from the root of the repository with::
+
+    python3 benchmarks/run.py
+
+Use ``--scale`` to make the synthetic data bigger or smaller, ``--no-helper``
+to measure the text fallbacks, ``--engine bridge`` to measure the bridge
+engine instead of the REPL's terminal (``pty`` is then zero), ``--json`` to save the results and
+``--baseline`` to compare them with saved results, in which case the exit
+status is non-zero if any benchmark regressed by more than ``--tolerance``.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT       = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_SCALA = os.path.join(ROOT, 'benchmarks', 'fake_scala.py')
+TOLERANCE  = 0.25                         # allowed slowdown before a regression
+COMPARED   = ['total', 'median', 'p95', 'render', 'rss']
+
+class ByteCounter(object):
+    """A file-like object that counts the bytes written to it."""
+
+    def __init__(self):
+        """Construct the counter."""
+        self.count = 0
+
+    def write(self, data):
+        """Count the bytes of ``data``."""
+        self.count += len(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def flush(self):
+        """Do nothing, since nothing is buffered."""
+
+class Harness(object):
+    """A ``ScalaTionKernel`` connected to ``fake_scala.py``, with counters for
+    the bytes it moves and the time it spends rendering figures.
+    """
+
+    def __init__(self, engine='pexpect'):
+        """Start the kernel, using ``engine``, and hook up the counters."""
+        os.environ.setdefault('SCALATION_JARS', '')
+        os.environ['SCALATION_KERNEL_POOL'] = os.path.join(tempfile.gettempdir(), 'no_pool.sock')
+        sys.path.insert(0, ROOT)
+        from scalation_kernel import kernel
+        kernel.SCALA_EXEC    = sys.executable
+        kernel.SCALA_OPTIONS = [FAKE_SCALA]
+        if engine == 'bridge':
+            kernel.BRIDGE_ENGINE = engine
+            kernel.SCALA_EXEC    = FAKE_SCALA         # started as "SCALA_EXEC -cp JAR ..."
+            kernel.bridge_jar    = lambda: FAKE_SCALA
+        self.render = 0.0
+        self.loop   = asyncio.new_event_loop()
+        self.kernel = kernel.ScalaTionKernel()
+        self.kernel.renderer.render = self.timed(self.kernel.renderer.render)
+        self.pty    = ByteCounter()
+        self.iopub  = ByteCounter()
+        self.bulk   = 0
+        self.kernel.child.logfile_read = self.pty
+        self.kernel.send_response = self.send_response
+        read, read_rows = self.kernel.bulk.read, self.kernel.bulk.read_rows
+        self.kernel.bulk.read      = lambda path, *args: self.count_bulk(path) and read(path, *args)
+        self.kernel.bulk.read_rows = lambda path, *args: self.count_bulk(path) and read_rows(path, *args)
+
+    def timed(self, render):
+        """Return ``render`` wrapped so that its time (including the handoff to
+           a worker process) is added to ``render``.
+        """
+        async def timed_render(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await render(*args, **kwargs)
+            finally:
+                self.render += time.perf_counter() - start
+        return timed_render
+
+    def count_bulk(self, path):
+        """Count the size of a bulk data file before it is read."""
+        self.bulk += os.path.getsize(path)
+        return True
+
+    def send_response(self, stream, msg_type, content=None, *args, **kwargs):
+        """Count the bytes of an iopub message instead of sending it."""
+        self.iopub.write(json.dumps(content, default=str))
+
+    def run(self, coroutine):
+        """Run ``coroutine`` (e.g., one of the kernel's handlers) to completion
+           on the harness's event loop and return its result.
+        """
+        return self.loop.run_until_complete(coroutine)
+
+    def execute(self, code, cached=True):
+        """Execute a cell and fail if it did not succeed. Unless ``cached``,
+           the data cache is cleared first, so that data is fetched again.
+        """
+        if not cached:
+            self.kernel.data_cache.clear()
+        reply = self.run(self.kernel.do_execute(code, False))
+        if reply['status'] != 'ok':
+            raise RuntimeError('{}: {}'.format(reply.get('ename'), reply.get('evalue')))
+
+    def measure(self, operation, count):
+        """Run ``operation`` ``count`` times and return the results."""
+        times, start = [], time.perf_counter()
+        for i in range(count):
+            op_start = time.perf_counter()
+            operation(i)
+            times.append(time.perf_counter() - op_start)
+        times.sort()
+        return { 'ops':    count,
+                 'total':  time.perf_counter() - start,
+                 'median': statistics.median(times),
+                 'p95':    times[min(len(times) - 1, int(0.95 * len(times)))],
+                 'pty':    self.pty.count,
+                 'bulk':   self.bulk,
+                 'iopub':  self.iopub.count,
+                 'render': self.render,
+                 'rss':    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 }
+
+def bench_execute_line(h, scale):
+    """One single-line cell at a time."""
+    return h.measure(lambda i: h.execute('val x{} = {}'.format(i, i)), int(200 * scale) or 1)
+
+def bench_execute_lines(h, scale):
+    """A 100-line cell, one line at a time (i.e., with batch mode off)."""
+    h.kernel.batch_mode = False
+    code = '\n'.join('val x{} = {}'.format(i, i) for i in range(100))
+    return h.measure(lambda i: h.execute(code), 3)
+
+def bench_execute_block(h, scale):
+    """A 1000-line cell in batch (i.e., paste) mode."""
+    code = '\n'.join('val x{} = {}'.format(i, i) for i in range(int(1000 * scale) or 1))
+    return h.measure(lambda i: h.execute(code), 3)
+
+def bench_execute_output(h, scale):
+    """A cell that prints 100000 lines."""
+    return h.measure(lambda i: h.execute('spam_{}'.format(int(100000 * scale) or 1)), 3)
+
+def bench_quick(h, scale):
+    """``do_quick`` with a single line."""
+    return h.measure(lambda i: h.run(h.kernel.do_quick('println("{}")'.format(i))), int(200 * scale) or 1)
+
+def bench_plotv(h, scale):
+    """``::plotv`` of a vector with 1000000 points."""
+    code = '::plotv vec_{}'.format(int(1000000 * scale) or 1)
+    return h.measure(lambda i: h.execute(code, cached=False), 3)
+
+def bench_plotv_lod(h, scale):
+    """``::plotv --interactive`` of a vector with 1000000 points."""
+    code = '::plotv vec_{} --interactive'.format(int(1000000 * scale) or 1)
+    return h.measure(lambda i: h.execute(code, cached=False), 3)
+
+def bench_plotm(h, scale):
+    """``::plotm`` of a 100000 by 10 matrix."""
+    code = '::plotm mat_{}x10'.format(int(100000 * scale) or 1)
+    return h.measure(lambda i: h.execute(code, cached=False), 3)
+
+def bench_plots(h, scale):
+    """A cell with four ``::plotv`` commands, whose figures render at once."""
+    code = '\n'.join('::plotv vec_{} --scatter'.format(int(250000 * scale) + i or 1) for i in range(4))
+    return h.measure(lambda i: h.execute(code, cached=False), 3)
+
+def bench_prettyr(h, scale):
+    """``::relation`` with a 10000-row page of a 100000-row relation."""
+    code = '::relation rel_{}x8 --limit {}'.format(int(100000 * scale) or 1, int(10000 * scale) or 1)
+    return h.measure(lambda i: h.execute(code, cached=False), 3)
+
+BENCHMARKS = { 'execute-line':   bench_execute_line,
+               'execute-lines':  bench_execute_lines,
+               'execute-block':  bench_execute_block,
+               'execute-output': bench_execute_output,
+               'quick':          bench_quick,
+               'plotv':          bench_plotv,
+               'plotv-lod':      bench_plotv_lod,
+               'plotm':          bench_plotm,
+               'plots':          bench_plots,
+               'prettyr':        bench_prettyr }
+
+def run_one(name, scale, engine):
+    """Run the benchmark ``name`` in this process and return its results."""
+    harness = Harness(engine)
+    try:
+        return BENCHMARKS[name](harness, scale)
+    finally:
+        harness.run(harness.kernel.do_shutdown(False))
+        harness.loop.close()
+
+def run_all(names, scale, helper, engine):
+    """Run each benchmark in ``names`` in a fresh process."""
+    env = dict(os.environ, FAKE_SCALA_HELPER='1' if helper else '0')
+    results = {}
+    for name in names:
+        command = [sys.executable, os.path.abspath(__file__), '--child', name, '--scale', str(scale), '--engine', engine]
+        process = subprocess.run(command, env=env, stdout=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            results[name] = {'error': 'exit status {}'.format(process.returncode)}
+        else:
+            results[name] = json.loads(process.stdout.strip().splitlines()[-1])
+        print_result(name, results[name])
+    return results
+
+def size(count):
+    """Return ``count`` bytes in human-readable form."""
+    for unit in ['B', 'KiB', 'MiB']:
+        if count < 1024:
+            return '{:.0f} {}'.format(count, unit)
+        count /= 1024
+    return '{:.1f} GiB'.format(count)
+
+def print_result(name, result):
+    """Print one row of the results table."""
+    if 'error' in result:
+        print('{:<16} {}'.format(name, result['error']))
+        return
+    print('{:<16} {:>5} {:>10.2f} {:>10.2f} {:>10.2f} {:>10} {:>10} {:>10} {:>10}'.format(
+        name, result['ops'], 1000 * result['median'], 1000 * result['p95'], 1000 * result['render'],
+        size(result['pty']), size(result['bulk']), size(result['iopub']), size(result['rss'])))
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of ``results`` relative to ``baseline``."""
+    regressions = []
+    for name, result in results.items():
+        for metric in COMPARED:
+            old, new = baseline.get(name, {}).get(metric), result.get(metric)
+            if old and new and new > old * (1 + tolerance):
+                regressions.append('{} {}: {:.4g} -> {:.4g} (+{:.0%})'.format(name, metric, old, new, new / old - 1))
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Benchmark the hot paths of ScalaTion Kernel.')
+    ap.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+        help="Benchmarks to run (default: all): {}.".format(', '.join(BENCHMARKS)))
+    ap.add_argument('--scale', type=float, default=1.0,
+        help="Multiply the size of the synthetic data and the number of operations.")
+    ap.add_argument('--no-helper', action='store_true',
+        help="Make the helper unavailable, so data is moved as text.")
+    ap.add_argument('--engine', choices=['pexpect', 'bridge'], default='pexpect',
+        help="Run the fake Scala REPL on a terminal (pexpect) or as an interpreter server (bridge).")
+    ap.add_argument('--json', metavar='FILE',
+        help="Save the results to FILE.")
+    ap.add_argument('--baseline', metavar='FILE',
+        help="Compare the results with those saved in FILE.")
+    ap.add_argument('--tolerance', type=float, default=TOLERANCE,
+        help="Relative increase of a metric that counts as a regression.")
+    ap.add_argument('--child', metavar='BENCHMARK', help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child != None:
+        result = run_one(args.child, args.scale, args.engine)
+        print(json.dumps(result))
+        return 0
+
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            ap.error('unknown benchmark: {}'.format(name))
+    print('{:<16} {:>5} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'ops', 'median ms', 'p95 ms', 'render ms', 'pty', 'bulk', 'iopub', 'peak rss'))
+    results = run_all(names, args.scale, not args.no_helper, args.engine)
+    if args.json != None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline != None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression)
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,9 @@
+import sys
+
+if len(sys.argv) > 1 and sys.argv[1] == 'run':                # batch runner
+    from .batch import main
+    sys.exit(main(sys.argv[2:]))
+
 from ipykernel.kernelapp import IPKernelApp
 from . import ScalaTionKernel
 
@@ -0,0 +1,47 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""Argument parsing for the kernel commands (e.g., ``::plotv``, ``::export``
+and ``::relation``), whose arguments follow the command on the same line and
+may end with a Scala comment.
+"""
+
+import argparse
+import shlex
+
+class CommandArgumentParser(argparse.ArgumentParser):
+    """An argument parser that raises ``ValueError`` instead of exiting."""
+
+    def error(self, message):
+        raise ValueError(message)
+
+def strip_comment(text):
+    """Return ``text`` without its trailing Scala comment (i.e., a ``//`` or
+       ``/*`` that follows whitespace), if any. Quoted text is left as is, so
+       a path like ``"/tmp/a //b.npy"`` is kept whole.
+    """
+    quote = None
+    i     = 0
+    while i < len(text):
+        c = text[i]
+        if quote != None:
+            if c == quote:
+                quote = None
+            elif c == '\\' and quote == '"':
+                i += 1
+        elif c in '"\'':
+            quote = c
+        elif c == '\\':
+            i += 1
+        elif text.startswith(('//', '/*'), i) and i > 0 and text[i - 1].isspace():
+            return text[:i]
+        i += 1
+    return text
+
+def parse_command_args(parser, command_args):
+    """Parse ``command_args`` using ``parser``, ignoring any trailing Scala
+       comment.
+    """
+    return parser.parse_args(shlex.split(strip_comment(command_args)))
@@ -0,0 +1,241 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""A headless batch runner for ScalaTion notebooks and Scala scripts.
+
+It executes many notebooks (``.ipynb``) and scripts (``.scala``, which run as
+a single cell) at once, without Jupyter, e.g.::
+
+    python3 -m scalation_kernel run --workers 4 reports/*.ipynb
+
+Each worker is a ``ScalaTionKernel`` with its own REPL, which is reused for
+job after job, so the JVM is only started (and warmed up) once per worker.
+Between jobs, the REPL's session is reset (see ``reset_repl``), so every job
+starts from a clean session. The outputs of each notebook are written back to
+it (or to ``--output-dir``) and the outputs of a script are written to a
+notebook next to it, and the wall time of every job is reported.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+
+BATCH_WORKERS = int(os.environ.get('SCALATION_KERNEL_BATCH_WORKERS', min(4, os.cpu_count() or 1)))
+BATCH_SUFFIX  = ['.ipynb', '.scala']
+
+def batch_kernel_class():
+    """Return the class of the kernels used by the batch runner. The kernel
+       module is only imported when it is needed, since it requires
+       ``SCALATION_JARS`` to be set.
+    """
+    from .kernel import ScalaTionKernel
+
+    class BatchKernel(ScalaTionKernel):
+        """A kernel that records the outputs of the cell that it is executing,
+        as notebook outputs, instead of sending them to a frontend.
+        """
+
+        sigint   = False                  # interrupts are handled by the runner
+        sessions = False                  # jobs neither compile definitions nor
+                                          # replace the user's ::restore session
+
+        def __init__(self, **kwargs):
+            """Construct the kernel with no cell being recorded."""
+            ScalaTionKernel.__init__(self, **kwargs)
+            self.outputs  = []
+            self.displays = {}            # display_id -> outputs
+
+        def send_response(self, stream, msg_type, content=None, *args, **kwargs):
+            """Record an iopub message as an output of the current cell."""
+            record_output(self.outputs, self.displays, msg_type, content or {})
+
+    return BatchKernel
+
+def record_output(outputs, displays, msg_type, content):
+    """Add the iopub message ``msg_type`` with ``content`` to the list of
+       notebook ``outputs`` of a cell, where ``displays`` maps display ids to
+       the outputs that an ``update_display_data`` message updates.
+    """
+    display_id = content.get('transient', {}).get('display_id')
+    if msg_type == 'stream':
+        if len(outputs) > 0 and outputs[-1]['output_type'] == 'stream' and outputs[-1]['name'] == content['name']:
+            outputs[-1]['text'] += content['text']            # merge consecutive streams
+        else:
+            outputs.append({'output_type': 'stream', 'name': content['name'], 'text': content['text']})
+    elif msg_type in ('display_data', 'execute_result'):
+        output = {'output_type': msg_type, 'data': content['data'], 'metadata': content.get('metadata', {})}
+        if msg_type == 'execute_result':
+            output['execution_count'] = content.get('execution_count')
+        outputs.append(output)
+        if display_id != None:
+            displays.setdefault(display_id, []).append(output)
+    elif msg_type == 'update_display_data':
+        for output in displays.get(display_id, []):
+            output['data'], output['metadata'] = content['data'], content.get('metadata', {})
+    elif msg_type == 'error':
+        outputs.append({'output_type': 'error', 'ename': content['ename'], 'evalue': content['evalue'],
+                        'traceback': content.get('traceback', [])})
+    elif msg_type == 'clear_output':
+        del outputs[:]
+
+def load_job(path):
+    """Return the notebook to execute for the job at ``path``: the notebook
+       itself or, for a Scala script, a new notebook with one cell holding
+       the script.
+    """
+    import nbformat
+    if path.endswith('.ipynb'):
+        return nbformat.read(path, as_version=4)
+    with open(path) as f:
+        source = f.read()
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(source)])
+    nb.metadata['kernelspec'] = {'name': 'scalation', 'display_name': 'ScalaTion', 'language': 'scala'}
+    return nb
+
+def output_path(path, output_dir=None):
+    """Return the path of the notebook that the outputs of the job at
+       ``path`` are written to.
+    """
+    name = os.path.splitext(os.path.basename(path))[0] + '.ipynb'
+    return os.path.join(output_dir or os.path.dirname(path), name)
+
+class Job(object):
+    """A notebook or script to execute, along with the result of executing it."""
+
+    def __init__(self, path):
+        """Construct the job for the file at ``path``."""
+        self.path    = path
+        self.status  = 'pending'
+        self.cells   = 0                  # cells executed
+        self.error   = None
+        self.seconds = 0.0
+
+    def result(self):
+        """Return the result of the job as a dictionary."""
+        return { 'path':    self.path,
+                 'status':  self.status,
+                 'cells':   self.cells,
+                 'error':   self.error,
+                 'seconds': self.seconds }
+
+async def run_job(kernel, job, args):
+    """Execute the cells of ``job`` in order using ``kernel``, stopping at the
+       first cell that fails (unless ``args.allow_errors``), and write its
+       outputs.
+    """
+    import nbformat
+    started = time.perf_counter()
+    try:
+        nb = load_job(job.path)
+        job.status = 'ok'
+        for cell in nb.cells:
+            if cell.cell_type != 'code':
+                continue
+            job.cells += 1
+            kernel.execution_count = job.cells
+            kernel.outputs, kernel.displays = [], {}
+            reply = await kernel.do_execute(cell.source, False)
+            cell.outputs         = [nbformat.from_dict(output) for output in kernel.outputs]
+            cell.execution_count = job.cells
+            if reply['status'] != 'ok':
+                job.status = 'error'
+                job.error  = '{}: {}'.format(reply.get('ename'), reply.get('evalue'))
+                if not args.allow_errors:
+                    break
+        nb.metadata['language_info'] = dict(kernel.language_info)
+        nbformat.write(nb, output_path(job.path, args.output_dir))
+    except Exception as e:
+        job.status, job.error = 'error', '{}: {}'.format(type(e).__name__, e)
+    finally:
+        job.seconds = time.perf_counter() - started
+
+async def run_jobs(jobs, args, report):
+    """Execute ``jobs`` on up to ``args.workers`` kernels at once, calling
+       ``report(job)`` as each one finishes. The kernels are started at the
+       same time, on other threads, and each one takes the next job as soon
+       as it is free, resetting its REPL before every job but its first. An
+       interrupt (i.e., ``SIGINT``) interrupts the running cells and skips
+       the jobs that have not started.
+    """
+    loop    = asyncio.get_running_loop()
+    count   = max(1, min(args.workers, len(jobs)))
+    kernel  = batch_kernel_class()
+    kernels = await asyncio.gather(*[loop.run_in_executor(None, kernel) for i in range(count)])
+    pending = asyncio.Queue()
+    for job in jobs:
+        pending.put_nowait(job)
+    for kernel in kernels[1:]:                              # share one render pool
+        kernel.renderer = kernels[0].renderer
+
+    async def work(kernel):
+        fresh = True
+        while not pending.empty():
+            job = pending.get_nowait()
+            if not fresh:
+                await kernel.reset_repl()
+            fresh = False
+            await run_job(kernel, job, args)
+            report(job)
+
+    def interrupt():
+        while not pending.empty():
+            pending.get_nowait()
+        for kernel in kernels:
+            kernel.handle_sigint(signal.SIGINT, None)
+
+    loop.add_signal_handler(signal.SIGINT, interrupt)
+    try:
+        await asyncio.gather(*[work(kernel) for kernel in kernels])
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        for kernel in kernels:
+            await kernel.do_shutdown(False)
+
+def print_job(job):
+    """Print one row of the report."""
+    print('{:<8} {:>9.2f} {:>6}  {}{}'.format(job.status, job.seconds, job.cells, job.path,
+                                              '  ({})'.format(job.error) if job.error != None else ''))
+    sys.stdout.flush()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python3 -m scalation_kernel run',
+        description='Execute ScalaTion notebooks and Scala scripts without Jupyter.')
+    ap.add_argument('paths', nargs='+', metavar='PATH',
+        help="Notebooks (.ipynb) and Scala scripts (.scala) to execute.")
+    ap.add_argument('--workers', type=int, default=BATCH_WORKERS,
+        help="Number of REPLs that execute jobs at the same time.")
+    ap.add_argument('--output-dir', metavar='DIR',
+        help="Write the executed notebooks to DIR instead of next to their sources.")
+    ap.add_argument('--allow-errors', action='store_true',
+        help="Keep executing a notebook after a cell fails.")
+    ap.add_argument('--json', metavar='FILE',
+        help="Save the results of the jobs to FILE.")
+    args = ap.parse_args(argv)
+
+    for path in args.paths:
+        if os.path.splitext(path)[1] not in BATCH_SUFFIX:
+            ap.error('not a notebook or Scala script: {}'.format(path))
+    if args.workers < 1:
+        ap.error('--workers must be at least 1')
+    if args.output_dir != None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs    = [Job(path) for path in args.paths]
+    started = time.perf_counter()
+    print('{:<8} {:>9} {:>6}  {}'.format('status', 'seconds', 'cells', 'path'))
+    asyncio.run(run_jobs(jobs, args, print_job))
+    failed = [job for job in jobs if job.status != 'ok']
+    print('{} jobs, {} failed, {:.2f} seconds'.format(len(jobs), len(failed), time.perf_counter() - started))
+    if args.json != None:
+        with open(args.json, 'w') as f:
+            json.dump([job.result() for job in jobs], f, indent=2)
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""The bridge engine, which runs Scala code in an interpreter server on the
+JVM (``ScalaTionKernelBridge``) instead of in the Scala REPL.
+
+The kernel talks to the REPL through a pseudo-terminal, so it has to scrape
+prompts and echoes out of the output and can only get text back. The bridge
+talks to the server over a loopback socket using length-prefixed frames (see
+``ScalaTionKernelBridge.scala``), so every evaluation gets a structured result
+(its status, the name and type of its result and any binary payloads), with
+its stdout and stderr kept apart and streamed as they arrive. Select it by
+setting the ``SCALATION_KERNEL_ENGINE`` environment variable to ``bridge``; if
+the server cannot be started, the kernel falls back to the REPL.
+
+The server is compiled once, using ``scalac``, into a jar in the kernel's
+cache. The engine is experimental: the server has not yet been compiled and
+tested against every supported Scala version.
+"""
+
+import asyncio
+import codecs
+import hashlib
+import json
+import os
+import queue
+import select
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from .completion import default_cache_dir
+from .restore import RESTORE_SCALAC
+
+BRIDGE_ENGINE  = os.environ.get('SCALATION_KERNEL_ENGINE', 'pexpect')  # or 'bridge'
+BRIDGE_NAME    = 'ScalaTionKernelBridge'
+BRIDGE_SOURCE  = os.path.join(os.path.dirname(__file__), 'scala', BRIDGE_NAME + '.scala')
+BRIDGE_READY   = '<scalation_kernel>:bridge:'  # printed by the server with its port
+BRIDGE_TOKEN   = 'SCALATION_KERNEL_BRIDGE_TOKEN'
+BRIDGE_HEADER  = struct.Struct('>I')           # length of a frame
+BRIDGE_TIMEOUT = 120                           # seconds to compile or start the server
+
+def bridge_jar(scalac=RESTORE_SCALAC, cache_dir=None):
+    """Return the path of the jar of the compiled server, compiling it first
+       if the cache does not have it. Raise ``OSError`` if it cannot be
+       compiled. A failure is remembered, for the same source and ``scalac``,
+       so that later kernels fall back to the REPL right away instead of
+       trying to compile it again.
+    """
+    with open(BRIDGE_SOURCE, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    directory = os.path.join(cache_dir or default_cache_dir(), 'bridge')
+    jar       = os.path.join(directory, '{}-{}.jar'.format(BRIDGE_NAME, digest[:16]))
+    if os.path.exists(jar):
+        return jar
+    failed = os.path.join(directory, '{}-{}.failed'.format(BRIDGE_NAME, compiler_digest(digest, scalac)[:16]))
+    if os.path.exists(failed):
+        with open(failed, encoding='utf-8', errors='replace') as f:
+            raise OSError('{} failed to compile before (remove {} to try again): {}'.format(BRIDGE_NAME, failed, f.read()))
+    os.makedirs(directory, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='scalation_kernel_')
+    try:
+        built  = os.path.join(workdir, BRIDGE_NAME + '.jar')
+        result = subprocess.run([scalac, '-nowarn', '-usejavacp', '-d', built, BRIDGE_SOURCE],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                timeout=BRIDGE_TIMEOUT)
+        if result.returncode != 0 or not os.path.exists(built):
+            raise OSError('could not compile {}: {}'.format(BRIDGE_NAME, result.stdout.decode('utf-8', 'replace')))
+        os.replace(built, jar)
+    except subprocess.TimeoutExpired:
+        remember_failure(failed, 'timed out compiling {}'.format(BRIDGE_NAME))
+        raise OSError('timed out compiling {}'.format(BRIDGE_NAME))
+    except OSError as e:                           # e.g., no scalac
+        remember_failure(failed, str(e))
+        raise
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return jar
+
+def compiler_digest(digest, scalac):
+    """Return a hash of the server's source ``digest`` and of the ``scalac``
+       command (its path and modification time, if it is found), so that a
+       failure is forgotten when either one changes.
+    """
+    path  = shutil.which(scalac) or scalac
+    stamp = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+    return hashlib.sha1(json.dumps([digest, path, stamp]).encode('utf-8')).hexdigest()
+
+def remember_failure(path, message):
+    """Write the failure ``message`` to the marker at ``path``."""
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(message)
+    except OSError:
+        pass
+
+def pack_frame(data):
+    """Return ``data`` (bytes) as a frame."""
+    return BRIDGE_HEADER.pack(len(data)) + data
+
+def read_frame(stream):
+    """Read a frame from the binary file ``stream`` and return its bytes.
+       Raise ``EOFError`` if the stream ends first.
+    """
+    header = stream.read(BRIDGE_HEADER.size)
+    if len(header) < BRIDGE_HEADER.size:
+        raise EOFError('the bridge closed its connection')
+    data = stream.read(BRIDGE_HEADER.unpack(header)[0])
+    if len(data) < BRIDGE_HEADER.unpack(header)[0]:
+        raise EOFError('the bridge closed its connection')
+    return data
+
+class BridgeREPL(object):
+    """A connection to an interpreter server, which stands in for the REPL's
+    ``pexpect`` child (e.g., ``isalive`` and ``terminate``). Responses are read
+    by a thread and handed to whoever made the request, so requests can be made
+    from any thread or event loop.
+    """
+
+    def __init__(self, command, classpath, options=[], timeout=BRIDGE_TIMEOUT):
+        """Start the server using ``command`` (a list, to which the server's
+           arguments are added), with ``classpath`` and the compiler
+           ``options`` for its interpreter, and connect to it. Raise
+           ``OSError`` if it does not start within ``timeout`` seconds.
+        """
+        token        = uuid.uuid4().hex
+        env          = dict(os.environ, **{BRIDGE_TOKEN: token})
+        self.process = subprocess.Popen(command + [BRIDGE_NAME, classpath] + list(options), env=env,
+                                        start_new_session=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        self.pid     = self.process.pid
+        self.lock    = threading.Lock()            # guards the socket's writes and the sinks
+        self.sinks   = {}                          # request id -> callable that takes a response
+        self.ids     = 0
+        self.running = None                        # id of the running evaluation
+        self.queue   = None                        # and the queue of its responses
+        self.closed  = False
+        try:
+            port        = self.handshake(timeout)
+            self.socket = socket.create_connection(('127.0.0.1', port), timeout)
+            self.socket.settimeout(None)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socket.sendall(pack_frame(token.encode('utf-8')))
+        except BaseException:
+            self.process.kill()
+            raise
+        self.reader = threading.Thread(target=self.read_responses, name='scalation-kernel-bridge', daemon=True)
+        self.reader.start()
+
+    def handshake(self, timeout):
+        """Wait for the server to print its port and return it."""
+        deadline = time.monotonic() + timeout
+        output   = b''
+        fd       = self.process.stdout.fileno()
+        while BRIDGE_READY.encode('utf-8') not in output or not output.endswith(b'\n'):
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                raise OSError('timed out waiting for {}'.format(BRIDGE_NAME))
+            if len(select.select([fd], [], [], wait)[0]) > 0:
+                chunk = os.read(fd, 4096)
+                if chunk == b'':
+                    raise OSError('{} exited: {}'.format(BRIDGE_NAME, output.decode('utf-8', 'replace').strip()))
+                output += chunk
+        self.process.stdout.close()                # the server's output comes over the socket
+        line = output.decode('utf-8', 'replace').split(BRIDGE_READY, 1)[1].split('\n', 1)[0]
+        return int(line.strip())
+
+    def read_responses(self):
+        """Read responses, along with their frames, and hand each one to the
+           sink of its request until the connection is closed, and then hand
+           ``None`` to every sink.
+        """
+        stream = self.socket.makefile('rb')
+        try:
+            while True:
+                response = json.loads(read_frame(stream).decode('utf-8'))
+                response['frames'] = [read_frame(stream) for i in range(response.get('frames', 0))]
+                with self.lock:
+                    sink = self.sinks.get(response.get('id'))
+                    if response['kind'] == 'result':
+                        self.sinks.pop(response.get('id'), None)
+                if sink != None:
+                    sink(response)
+        except (OSError, ValueError, EOFError):
+            pass
+        with self.lock:
+            self.closed, sinks, self.sinks = True, list(self.sinks.values()), {}
+        for sink in sinks:
+            sink(None)
+
+    def request(self, op, code='', sink=None):
+        """Send the request ``op`` with ``code`` and return its id. Its
+           responses are handed to ``sink``. Raise ``EOFError`` if the
+           connection is closed.
+        """
+        with self.lock:
+            if self.closed:
+                raise EOFError('the bridge closed its connection')
+            self.ids += 1
+            if sink != None:
+                self.sinks[self.ids] = sink
+            try:
+                self.socket.sendall(pack_frame('{} {}\n{}'.format(op, self.ids, code).encode('utf-8')))
+            except OSError:
+                self.sinks.pop(self.ids, None)
+                raise EOFError('the bridge closed its connection')
+            return self.ids
+
+    async def evaluate(self, code, on_output=None, op='eval'):
+        """Evaluate ``code`` (or, if ``op`` is ``'line'``, a line that may be
+           incomplete) and return its result, a dictionary with its
+           ``status`` (``'ok'``, ``'error'``, ``'incomplete'`` or
+           ``'interrupted'``), the ``name`` and ``type`` of its result and
+           the payloads that it attached (``frames``). Its output is passed to
+           ``on_output(name, text)`` (e.g., ``('stdout', 'x: Int = 1\\n')``) as
+           it arrives. Raise ``EOFError`` if the connection is closed first.
+        """
+        loop      = asyncio.get_running_loop()
+        responses = asyncio.Queue()
+        decoders  = {}                             # of stdout and stderr
+        self.running = self.request(op, code, lambda response: loop.call_soon_threadsafe(responses.put_nowait, response))
+        self.queue   = responses
+        while True:
+            response = await responses.get()
+            if response == None:
+                raise EOFError('the bridge closed its connection')
+            if response['kind'] == 'result':
+                self.running = None
+                return response
+            if on_output != None:
+                decoder = decoders.setdefault(response['kind'], codecs.getincrementaldecoder('utf-8')('replace'))
+                on_output(response['kind'], decoder.decode(b''.join(response['frames'])))
+
+    async def interrupt(self, timeout):
+        """Interrupt the running evaluation, if any, and wait until it is done.
+           Return whether or not it was done within ``timeout`` seconds.
+        """
+        if self.running == None:
+            return True
+        responses = self.queue
+        try:
+            self.request('interrupt')
+            deadline = time.monotonic() + timeout
+            while True:
+                response = await asyncio.wait_for(responses.get(), max(0, deadline - time.monotonic()))
+                if response == None or response['kind'] == 'result':
+                    self.running = None
+                    return response != None
+        except (EOFError, asyncio.TimeoutError):
+            return False
+
+    async def reset(self, timeout=None):
+        """Forget every definition (like the REPL's ``:reset``). Raise
+           ``TimeoutError`` if it takes longer than ``timeout`` seconds.
+        """
+        await asyncio.wait_for(self.evaluate('', op='reset'), timeout)
+
+    def execute(self, code):
+        """Evaluate ``code`` and wait for it, blocking the calling thread, and
+           return its result and its output (stdout and stderr together).
+        """
+        responses = queue.Queue()
+        self.request('eval', code, responses.put)
+        output = []
+        while True:
+            response = responses.get()
+            if response == None:
+                raise EOFError('the bridge closed its connection')
+            if response['kind'] == 'result':
+                return response, b''.join(output).decode('utf-8', 'replace')
+            output.extend(response['frames'])
+
+    def isalive(self):
+        """Return whether or not the server is running and connected."""
+        return not self.closed and self.process.poll() == None
+
+    def terminate(self, force=False):
+        """Stop the server and close the connection."""
+        try:
+            self.request('quit')
+        except EOFError:
+            pass
+        if force:
+            self.process.kill()
+        else:
+            self.process.terminate()
+        try:
+            self.socket.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        return True
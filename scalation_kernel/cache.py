@@ -0,0 +1,118 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""A cache of the data that the kernel fetches from the Scala REPL.
+
+Plot and relation commands fetch ScalaTion vectors, matrices and relations
+into NumPy arrays (or lists of rows). Running such a command again (e.g., to
+change the style of a plot) reuses the cached data instead of fetching it
+through the REPL again. The cache is bounded by the number of bytes it holds
+and evicts the least recently used entries first. An entry is invalidated as
+soon as Scala code that mentions any of the names in its expression is sent
+to the REPL, since that code may rebind or modify the object.
+"""
+
+import collections
+import os
+import re
+import sys
+
+CACHE_SIZE  = float(os.environ.get('SCALATION_KERNEL_DATA_CACHE', 512))  # MiB (0 disables)
+CACHE_NAMES = re.compile(r'[A-Za-z_$][\w$]*')
+
+def cache_names(code):
+    """Return the set of identifiers in the Scala ``code``."""
+    return set(CACHE_NAMES.findall(code))
+
+def data_size(data):
+    """Return the approximate number of bytes held by ``data``, which is a
+       NumPy array, a tuple of them or a list of rows of strings.
+    """
+    if hasattr(data, 'nbytes'):
+        return data.nbytes
+    if isinstance(data, tuple):
+        return sum(data_size(item) for item in data)
+    if isinstance(data, list):
+        return sys.getsizeof(data) + sum(data_size(item) for item in data)
+    return sys.getsizeof(data)
+
+class CacheEntry(object):
+    """A cached value with its size and the names that it depends on."""
+
+    __slots__ = ['value', 'size', 'names', 'hits']
+
+    def __init__(self, value, size, names):
+        """Construct the entry."""
+        self.value = value
+        self.size  = size
+        self.names = names
+        self.hits  = 0
+
+class DataCache(object):
+    """A least recently used cache of fetched data, bounded to ``max_bytes``.
+    Keys are tuples whose first item is the kind of data (e.g., ``'vector'``)
+    and whose second item is the Scala expression that it was fetched from.
+    """
+
+    def __init__(self, max_bytes=int(CACHE_SIZE * 2 ** 20)):
+        """Construct an empty cache."""
+        self.max_bytes = max_bytes
+        self.entries   = collections.OrderedDict()     # key -> CacheEntry, oldest first
+        self.size      = 0
+        self.hits      = 0
+        self.misses    = 0
+
+    def get(self, key):
+        """Return the value cached for ``key``, or ``None``."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        entry.hits += 1
+        self.hits  += 1
+        return entry.value
+
+    def put(self, key, value):
+        """Cache ``value`` for ``key``, evicting the least recently used
+           entries to make room for it, and return ``value``. A value that is
+           larger than the whole cache is not cached.
+        """
+        self.discard(key)
+        size = data_size(value)
+        if size > self.max_bytes:
+            return value
+        while self.size + size > self.max_bytes:
+            self.discard(next(iter(self.entries)))
+        self.entries[key] = CacheEntry(value, size, cache_names(key[1]))
+        self.size += size
+        return value
+
+    def discard(self, key):
+        """Remove the entry for ``key``, if there is one."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def invalidate(self, code):
+        """Remove the entries that depend on any identifier in the Scala
+           ``code`` and return how many were removed.
+        """
+        names = cache_names(code)
+        stale = [key for key, entry in self.entries.items() if not entry.names.isdisjoint(names)]
+        for key in stale:
+            self.discard(key)
+        return len(stale)
+
+    def clear(self, names=None):
+        """Remove every entry or, if ``names`` are given, the entries that
+           were fetched from those expressions.
+        """
+        for key in list(self.entries):
+            if names is None or key[1] in names:
+                self.discard(key)
+
+    def __len__(self):
+        return len(self.entries)
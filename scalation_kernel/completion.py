@@ -0,0 +1,387 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""Tab completion and inspection for ScalaTion Kernel.
+
+Completions are never requested from the Scala REPL, which may be busy running
+a cell. Instead, they come from a symbol index of the packages, classes,
+objects and public members found in the jars in ``SCALATION_JARS``, merged
+with the names that have been defined in the session. The index is built by
+reading the class files directly, which only happens when the jars change;
+otherwise, it is loaded from a cache on disk.
+"""
+
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import zipfile
+
+INDEX_VERSION = 1                         # bump when the index format changes
+INDEX_WAIT    = 0.5                       # seconds to wait for the index to load
+
+SCALA_KEYWORDS = ['abstract', 'case', 'catch', 'class', 'def', 'do', 'else', 'extends',
+                  'false', 'final', 'finally', 'for', 'forSome', 'if', 'implicit',
+                  'import', 'lazy', 'match', 'new', 'null', 'object', 'override',
+                  'package', 'private', 'protected', 'return', 'sealed', 'super',
+                  'this', 'throw', 'trait', 'true', 'try', 'type', 'val', 'var',
+                  'while', 'with', 'yield']
+
+SCALA_OPERATORS = {'$plus': '+', '$minus': '-', '$times': '*', '$div': '/', '$bslash': '\\',
+                   '$eq': '=', '$less': '<', '$greater': '>', '$bang': '!', '$hash': '#',
+                   '$percent': '%', '$up': '^', '$amp': '&', '$bar': '|', '$tilde': '~',
+                   '$qmark': '?', '$colon': ':', '$at': '@'}
+SCALA_OPERATOR  = re.compile('|'.join(re.escape(op) for op in SCALA_OPERATORS))
+
+JVM_TYPES = {'B': 'Byte', 'C': 'Char', 'D': 'Double', 'F': 'Float', 'I': 'Int',
+             'J': 'Long', 'S': 'Short', 'Z': 'Boolean', 'V': 'Unit'}
+
+ACC_PUBLIC    = 0x0001
+ACC_BRIDGE    = 0x0040
+ACC_INTERFACE = 0x0200
+ACC_SYNTHETIC = 0x1000
+
+COMPLETE_TOKEN  = re.compile(r'[\w$.]*$')
+INSPECT_TOKEN   = re.compile(r'\w*')
+SESSION_VALUE   = re.compile(r'^(\w+): (.+?) = ')
+SESSION_METHOD  = re.compile(r'^(\w+): ((?:\[.*?\])?\(.*)$')
+SESSION_DEFINED = re.compile(r'^defined (class|object|trait|type alias) (\w+)')
+
+def default_cache_dir():
+    """Return the directory for ScalaTion Kernel's caches, which may be set
+       using the ``SCALATION_KERNEL_CACHE`` environment variable.
+    """
+    if 'SCALATION_KERNEL_CACHE' in os.environ:
+        return os.environ['SCALATION_KERNEL_CACHE']
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_home, 'scalation_kernel')
+
+def classpath_entries(classpath):
+    """Return the jars and directories on ``classpath``, expanding wildcards."""
+    entries = []
+    for entry in classpath.split(os.pathsep):
+        if entry.endswith('*'):
+            entries.extend(sorted(glob.glob(entry + '.jar') + glob.glob(entry + '.JAR')))
+        elif entry != '':
+            entries.append(entry)
+    return [entry for entry in entries if os.path.exists(entry)]
+
+def class_files(entry):
+    """Yield the ``(path, data)`` of each class file in the jar or directory
+       ``entry``, where ``path`` is relative and uses ``/``.
+    """
+    if os.path.isdir(entry):
+        for root, dirs, files in os.walk(entry):
+            for name in files:
+                if name.endswith('.class'):
+                    path = os.path.join(root, name)
+                    with open(path, 'rb') as f:
+                        yield os.path.relpath(path, entry).replace(os.sep, '/'), f.read()
+    else:
+        with zipfile.ZipFile(entry) as jar:
+            for name in jar.namelist():
+                if name.endswith('.class'):
+                    yield name, jar.read(name)
+
+def decode_name(name):
+    """Return the Scala name for the JVM name ``name`` (e.g., ``+`` for
+       ``$plus``), or ``None`` if it is compiler-generated.
+    """
+    name = SCALA_OPERATOR.sub(lambda m: SCALA_OPERATORS[m.group(0)], name)
+    return None if '$' in name or name.startswith('<') else name
+
+def descriptor_types(descriptor):
+    """Return the Scala-ish names of the types in the JVM field or method
+       ``descriptor`` (e.g., ``['Double', 'VectorD']`` for ``DLVectorD;``).
+    """
+    types, pos = [], 0
+    while pos < len(descriptor):
+        dims = 0
+        while descriptor[pos] == '[':
+            dims, pos = dims + 1, pos + 1
+        if descriptor[pos] == 'L':
+            stop = descriptor.index(';', pos)
+            name = descriptor[pos + 1:stop].rsplit('/', 1)[-1].rstrip('$')
+            pos  = stop + 1
+        else:
+            name = JVM_TYPES.get(descriptor[pos], descriptor[pos])
+            pos  = pos + 1
+        for i in range(dims):
+            name = 'Array[{}]'.format(name)
+        types.append(name)
+    return types
+
+def method_signature(descriptor):
+    """Return a Scala-ish signature for the JVM method ``descriptor``."""
+    params, result = descriptor[1:].split(')', 1)
+    return '({}){}'.format(', '.join(descriptor_types(params)), descriptor_types(result)[0])
+
+def parse_class(data):
+    """Parse the class file ``data`` and return its ``(name, flags, members)``,
+       where ``members`` maps the name of each public member to its
+       signatures.
+    """
+    count, pos = struct.unpack_from('>H', data, 8)[0], 10
+    utf8, classes, index = {}, {}, 1
+    while index < count:                                   # constant pool
+        tag = data[pos]
+        if tag == 1:
+            size, = struct.unpack_from('>H', data, pos + 1)
+            utf8[index] = data[pos + 3:pos + 3 + size].decode('utf-8', 'replace')
+            pos += 3 + size
+        elif tag == 7:
+            classes[index], = struct.unpack_from('>H', data, pos + 1)
+            pos += 3
+        elif tag in (5, 6):
+            pos, index = pos + 9, index + 1                # takes two slots
+        elif tag in (3, 4, 9, 10, 11, 12, 17, 18):
+            pos += 5
+        elif tag == 15:
+            pos += 4
+        elif tag in (8, 16, 19, 20):
+            pos += 3
+        else:
+            raise ValueError('bad constant pool tag: {}'.format(tag))
+        index += 1
+    flags, this = struct.unpack_from('>HH', data, pos)
+    interfaces, = struct.unpack_from('>H', data, pos + 6)
+    pos += 8 + 2 * interfaces
+    members = {}
+    for kind in ('field', 'method'):
+        count, = struct.unpack_from('>H', data, pos)
+        pos += 2
+        for i in range(count):
+            access, name, desc, attrs = struct.unpack_from('>HHHH', data, pos)
+            pos += 8
+            for j in range(attrs):
+                pos += 6 + struct.unpack_from('>I', data, pos + 2)[0]
+            name = decode_name(utf8[name])
+            if name != None and access & ACC_PUBLIC and not access & (ACC_SYNTHETIC | ACC_BRIDGE):
+                desc = utf8[desc]
+                sig  = method_signature(desc) if kind == 'method' else ': ' + descriptor_types(desc)[0]
+                members.setdefault(name, [])
+                if sig not in members[name]:
+                    members[name].append(sig)
+    return utf8[classes[this]], flags, members
+
+def build_index(entries):
+    """Build the symbol index for the jars and directories in ``entries``."""
+    packages, symbols = set(), {}
+    for entry in entries:
+        for path, data in class_files(entry):
+            parts = path[:-len('.class')].split('/')
+            name  = parts[-1]
+            kind  = 'object' if name.endswith('$') else 'class'
+            name  = name[:-1] if kind == 'object' else name
+            if '$' in name or name in ('package', 'module-info') or len(parts) < 2:
+                continue
+            try:
+                cls, flags, members = parse_class(data)
+            except (ValueError, IndexError, KeyError, struct.error):
+                continue
+            if kind == 'class' and flags & ACC_INTERFACE:
+                kind = 'trait'
+            package = '.'.join(parts[:-1])
+            for i in range(1, len(parts)):
+                packages.add('.'.join(parts[:i]))
+            symbol = symbols.setdefault(package + '.' + name, {'kinds': [], 'members': {}})
+            symbol['kinds'].append(kind)
+            if kind == 'object':                           # members of X.
+                symbol['members'] = dict(members, **symbol['members'])
+            else:
+                symbol.setdefault('instance', {}).update(members)
+    return {'version': INDEX_VERSION, 'packages': sorted(packages), 'symbols': symbols}
+
+class SymbolIndex(object):
+    """An index of the packages, classes, objects and public members on a
+    classpath. The index is loaded, in the background, the first time it is
+    needed, from a cache keyed by the paths, sizes and modification times of
+    the class files, and is only rebuilt when those change.
+    """
+
+    def __init__(self, classpath, cache_dir=None):
+        """Construct the (not yet loaded) index for ``classpath``."""
+        self.classpath = classpath
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.packages  = set()
+        self.symbols   = {}
+        self.simple    = {}                                    # simple name -> full names
+        self.thread    = None
+        self.lock      = threading.Lock()
+
+    @property
+    def ready(self):
+        """Return whether or not the index has been loaded."""
+        return self.thread != None and not self.thread.is_alive()
+
+    def cache_key(self, entries):
+        """Return the cache key for the classpath ``entries``."""
+        stamps = []
+        for entry in entries:
+            paths = [entry]
+            if os.path.isdir(entry):
+                paths = sorted(os.path.join(root, name) for root, dirs, files in os.walk(entry) for name in files)
+            for path in paths:
+                stat = os.stat(path)
+                stamps.append([path, stat.st_size, stat.st_mtime_ns])
+        stamps = json.dumps([INDEX_VERSION, stamps]).encode('utf-8')
+        return hashlib.sha1(stamps).hexdigest()
+
+    def load(self):
+        """Load the index from the cache, or build and cache it."""
+        entries = classpath_entries(self.classpath)
+        path    = os.path.join(self.cache_dir, 'symbols-{}.json'.format(self.cache_key(entries)))
+        try:
+            with open(path, encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = build_index(entries)
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(index, f)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                pass
+        simple = {}
+        for name in index['symbols']:
+            simple.setdefault(name.rsplit('.', 1)[-1], []).append(name)
+        self.packages, self.symbols, self.simple = set(index['packages']), index['symbols'], simple
+
+    async def wait(self, timeout=INDEX_WAIT):
+        """Start loading the index, if that has not happened yet, and wait up
+           to ``timeout`` seconds for it. Return whether or not it is ready.
+           The wait happens on an executor thread, so the event loop keeps
+           running, and an index that is not ready yet is simply empty.
+        """
+        with self.lock:
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.load, daemon=True)
+                self.thread.start()
+        if self.thread.is_alive():
+            await asyncio.get_running_loop().run_in_executor(None, self.thread.join, timeout)
+        return self.ready
+
+    def resolve(self, name):
+        """Return the full names of the symbols called ``name``, which may be
+           fully qualified or simple.
+        """
+        if name in self.symbols:
+            return [name]
+        return self.simple.get(name, [])
+
+class SessionNames(object):
+    """The names defined in the session, collected from the REPL's output
+    (e.g., ``x: Int = 1`` or ``defined class Foo``).
+    """
+
+    def __init__(self):
+        """Construct an empty set of session names."""
+        self.names = {}                                        # name -> (kind, type)
+
+    def clear(self):
+        """Forget all of the session names (e.g., when the REPL restarts)."""
+        self.names.clear()
+
+    def define(self, name, kind):
+        """Record ``name`` as a definition of the given ``kind`` (e.g.,
+           ``'class'``) whose type is unknown.
+        """
+        self.names[name] = (kind, None)
+
+    def record(self, line):
+        """Record the name defined by the REPL output ``line``, if any."""
+        match = SESSION_DEFINED.match(line)
+        if match != None:
+            self.names[match.group(2)] = (match.group(1), None)
+            return
+        match = SESSION_METHOD.match(line) or SESSION_VALUE.match(line)
+        if match != None:
+            kind = 'def' if match.re is SESSION_METHOD else 'val'
+            self.names[match.group(1)] = (kind, match.group(2))
+
+class Completer(object):
+    """Complete and inspect Scala code using a ``SymbolIndex`` and the
+    ``SessionNames`` of a session, without involving the REPL.
+    """
+
+    def __init__(self, index, session):
+        """Construct the completer."""
+        self.index   = index
+        self.session = session
+
+    def scopes(self, qualifier):
+        """Return the member tables (i.e., dicts from member names to their
+           signatures) of ``qualifier``, which may be an object, a class or a
+           session value.
+        """
+        index = self.index
+        if qualifier in self.session.names:
+            kind, type_name = self.session.names[qualifier]
+            if kind != 'val' or type_name == None:
+                return []
+            return [index.symbols[name].get('instance', {}) for name in index.resolve(type_name.split('[', 1)[0])]
+        return [index.symbols[name]['members'] for name in index.resolve(qualifier)]
+
+    def members(self, qualifier):
+        """Return the names that may follow ``qualifier.``, which may be a
+           package, an object, a class or a session value.
+        """
+        index = self.index
+        if qualifier in index.packages:
+            prefix = qualifier + '.'
+            names  = {name[len(prefix):].split('.', 1)[0] for name in index.packages if name.startswith(prefix)}
+            names |= {name[len(prefix):] for name in index.symbols if name.startswith(prefix) and '.' not in name[len(prefix):]}
+            return names
+        return set().union(*self.scopes(qualifier))
+
+    async def complete(self, code, cursor_pos):
+        """Return the sorted matches for the token before ``cursor_pos`` in
+           ``code`` and the position where that token starts.
+        """
+        await self.index.wait()
+        token = COMPLETE_TOKEN.search(code[:cursor_pos]).group(0)
+        if '.' in token:
+            qualifier, partial = token.rsplit('.', 1)
+            names = self.members(qualifier)
+        else:
+            partial = token
+            names   = set(self.session.names) | set(self.index.simple) | set(SCALA_KEYWORDS)
+            names  |= {name.split('.', 1)[0] for name in self.index.packages}
+        matches = sorted(name for name in names if name.startswith(partial))
+        return matches, cursor_pos - len(partial)
+
+    async def inspect(self, code, cursor_pos):
+        """Return a plain text description of the name at ``cursor_pos`` in
+           ``code``, or ``None`` if it is unknown.
+        """
+        await self.index.wait()
+        token = COMPLETE_TOKEN.search(code[:cursor_pos]).group(0)
+        token = (token + INSPECT_TOKEN.match(code, cursor_pos).group(0)).strip('.')
+        if token == '':
+            return None
+        if token in self.session.names:
+            kind, type_name = self.session.names[token]
+            if kind == 'val':
+                return 'val {}: {}'.format(token, type_name)
+            return '{} {}{}'.format(kind, token, type_name or '')
+        lines = []
+        if '.' in token:
+            qualifier, name = token.rsplit('.', 1)
+            for scope in self.scopes(qualifier):
+                for sig in scope.get(name, []):
+                    lines.append('{} {}{}'.format('def' if sig.startswith('(') else 'val', name, sig))
+        for full_name in self.index.resolve(token):
+            symbol = self.index.symbols[full_name]
+            lines.append('{} {}'.format(' '.join(symbol['kinds']), full_name))
+            for name, sigs in sorted(symbol['members'].items()):
+                lines.extend('  {}{}'.format(name, sig) for sig in sigs)
+        if len(lines) == 0 and token in self.index.packages:
+            lines.append('package {}'.format(token))
+        return '\n'.join(lines) if len(lines) > 0 else None
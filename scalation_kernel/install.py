@@ -1,26 +1,53 @@
 import argparse
 import json
 import os
+import shlex
 import sys
 
 from jupyter_client.kernelspec import KernelSpecManager
 from IPython.utils.tempdir import TemporaryDirectory
 
+from .profiles import PROFILE_DEFAULT, get_profile, load_profiles
+
 kernel_json = {
     "argv": [sys.executable, "-m", "scalation_kernel", "-f", "{connection_file}"],
     "display_name": "ScalaTion",
     "language": "scala",
 }
 
-def install_my_kernel_spec(user=True, prefix=None):
+def install_my_kernel_spec(user=True, prefix=None, name='scalation', display_name=None, env=None):
+    spec = dict(kernel_json, display_name=display_name or kernel_json['display_name'])
+    if env:
+        spec['env'] = env # e.g., the JVM tuning profile (see profiles.py)
     with TemporaryDirectory() as td:
         os.chmod(td, 0o755) # Starts off as 700, not user readable
         with open(os.path.join(td, 'kernel.json'), 'w') as f:
-            json.dump(kernel_json, f, sort_keys=True)
+            json.dump(spec, f, sort_keys=True)
         # TODO: Copy any resources
 
         print('Installing Jupyter kernel spec')
-        KernelSpecManager().install_kernel_spec(td, 'scalation', user=user, replace=True, prefix=prefix)
+        KernelSpecManager().install_kernel_spec(td, name, user=user, replace=True, prefix=prefix)
+
+def profile_env(profile=None, heap=None, java_options=None, profiles=None):
+    """Return the environment that selects the JVM tuning profile
+       ``profile`` and overrides its heap size and JVM options. Raise
+       ``ValueError`` if there is no such profile.
+    """
+    env = {}
+    if profile != None:
+        env['SCALATION_KERNEL_PROFILE'] = profile
+    if heap != None:
+        env['SCALATION_KERNEL_HEAP'] = heap
+    if java_options:
+        env['SCALATION_KERNEL_JAVA_OPTIONS'] = ' '.join(shlex.quote(option) for option in java_options)
+    if profiles != None:
+        env['SCALATION_KERNEL_PROFILES'] = os.path.abspath(os.path.expanduser(profiles))
+    get_profile(env=env)
+    return env
+
+def list_profiles(profiles=None):
+    for name, profile in sorted(load_profiles(profiles or os.environ.get('SCALATION_KERNEL_PROFILES')).items()):
+        print('{:12} {}'.format(name, profile.get('description', '')))
 
 def _is_root():
     try:
@@ -37,14 +64,37 @@ def main(argv=None):
     ap.add_argument('--prefix',
         help="Install to the given prefix. "
              "Kernelspec will be installed in {PREFIX}/share/jupyter/kernels/")
+    ap.add_argument('--profile',
+        help="JVM tuning profile (heap, GC, JIT and compiler options, extra jars) "
+             "for the REPL. See --list-profiles. Defaults to $SCALATION_KERNEL_PROFILE "
+             "when the kernel starts, or else " + PROFILE_DEFAULT)
+    ap.add_argument('--heap',
+        help="Maximum heap size of the REPL's JVM (e.g. 8g), overriding the profile's")
+    ap.add_argument('--java-option', action='append', default=[], metavar='OPTION',
+        help="Extra JVM option for the REPL (e.g. --java-option=-XX:+UseZGC). Can be repeated")
+    ap.add_argument('--profiles', metavar='FILE',
+        help="JSON file of extra profiles, mapping their names to their settings")
+    ap.add_argument('--list-profiles', action='store_true',
+        help="List the profiles and exit")
+    ap.add_argument('--name',
+        help="Name of the kernel spec. Defaults to scalation, or scalation-PROFILE "
+             "with a profile, so that several can be installed side by side")
     args = ap.parse_args(argv)
 
+    if args.list_profiles:
+        return list_profiles(args.profiles)
     if args.sys_prefix:
         args.prefix = sys.prefix
     if not args.prefix and not _is_root():
         args.user = True
 
-    install_my_kernel_spec(user=args.user, prefix=args.prefix)
+    try:
+        env = profile_env(args.profile, args.heap, args.java_option, args.profiles)
+    except (OSError, ValueError) as e:
+        ap.error(str(e))
+    name         = args.name or ('scalation-' + args.profile if args.profile else 'scalation')
+    display_name = 'ScalaTion ({})'.format(args.profile) if args.profile else None
+    install_my_kernel_spec(user=args.user, prefix=args.prefix, name=name, display_name=display_name, env=env)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,176 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""Interactive plots for the ``::plotv``, ``::plotm`` and ``::plot3d`` kernel
+commands (i.e., with ``--interactive``).
+
+An interactive plot is sent as a Vega-Lite specification instead of a PNG.
+Frontends that support it (e.g., JupyterLab) draw it in the browser, where it
+can be panned and zoomed without asking the kernel or the REPL for more data.
+
+A long series is sent at several levels of detail (tiers). Tier 0 covers the
+whole series with about ``--max-points`` points, and each further tier has
+``PLOT_LOD_FACTOR`` times as many points as the one before, up to the whole
+series or ``PLOT_LOD_POINTS`` points. For the visible range of x, the
+specification picks the finest tier that has about ``--max-points`` points in
+that range and only draws those points, so the browser draws about the same
+number of points at every zoom level. Tiers keep the minimum and maximum of
+each bucket of points, which preserves the envelope of the series. The data is
+inlined as CSV, which is several times smaller than the equivalent JSON.
+"""
+
+import os
+
+PLOT_LOD_FACTOR  = 8                      # growth in points from one tier to the next
+PLOT_LOD_POINTS  = int(os.environ.get('SCALATION_KERNEL_LOD_POINTS', 250000))  # per series
+PLOT_GRID        = 200                    # maximum cells per axis of a heat map
+PLOT_SIZE        = (640, 360)             # width and height, in pixels
+VEGA_LITE_MIME   = 'application/vnd.vegalite.v5+json'
+VEGA_LITE_SCHEMA = 'https://vega.github.io/schema/vega-lite/v5.json'
+
+def envelope(y, n):
+    """Return the indices, in order, of at most ``n`` points of ``y`` that
+       keep the minimum and maximum of each of ``n / 2`` equal buckets.
+    """
+    import numpy as np
+    size = len(y)
+    if n >= size or n < 2:
+        return np.arange(size)
+    width   = -(-size // (n // 2))
+    count   = -(-size // width)
+    buckets = np.full(count * width, np.nan)
+    buckets[:size] = y
+    buckets = buckets.reshape(count, width)
+    missing = np.isnan(buckets)                         # padding and NaNs
+    start   = width * np.arange(count)
+    low     = start + np.where(missing, np.inf, buckets).argmin(axis=1)
+    high    = start + np.where(missing, -np.inf, buckets).argmax(axis=1)
+    return np.unique(np.concatenate([low, high]))
+
+def lod_tiers(y, points, limit=PLOT_LOD_POINTS):
+    """Return the levels of detail of the series ``y`` as a list of arrays of
+       indices, from the coarsest (about ``points`` points) to the finest
+       (all of ``y`` or about ``limit`` points).
+    """
+    import numpy as np
+    tiers, n = [], max(points, 2)
+    limit    = max(limit, n)
+    while n < len(y) and n < limit:
+        tiers.append(envelope(y, n))
+        n *= PLOT_LOD_FACTOR
+    tiers.append(np.arange(len(y)) if len(y) <= limit else envelope(y, limit))
+    return tiers
+
+def csv_values(header, columns, fmt):
+    """Return ``columns`` (NumPy arrays of the same length) as CSV text with
+       the given ``header`` and row format ``fmt`` (e.g., ``'%d,%.7g'``).
+    """
+    import numpy as np
+    rows = map(tuple, np.column_stack(columns).tolist()) if len(columns[0]) > 0 else []
+    return '\n'.join([header] + list(map(fmt.__mod__, rows))) + '\n'
+
+def new_spec(args, data, fmt):
+    """Return a Vega-Lite specification with the common arguments applied,
+       whose data is the CSV text ``data`` with number columns ``fmt``.
+    """
+    spec = { '$schema': VEGA_LITE_SCHEMA,
+             'width':   PLOT_SIZE[0],
+             'height':  PLOT_SIZE[1],
+             'data':    {'values': data, 'format': {'type': 'csv', 'parse': fmt}} }
+    if args.title != None:
+        spec['title'] = args.title
+    return spec
+
+def series_spec(args, series, mark, points):
+    """Return the Vega-Lite specification of a plot of ``series``, a list of
+       ``(label, x, y)`` triples, with the given ``mark`` (e.g., ``'line'``),
+       where ``x`` is increasing, that draws about ``points`` points per
+       series. Each series is sent at several levels of detail and the one
+       to draw is picked as the plot is zoomed.
+    """
+    import numpy as np
+    columns = [[], [], [], []]                          # tier, series, x, y
+    for s, (label, x, y) in enumerate(series):
+        for t, index in enumerate(lod_tiers(y, points)):
+            for column, values in zip(columns, [np.full(len(index), t), np.full(len(index), s), x[index], y[index]]):
+                column.append(values)
+    columns = [np.concatenate(column) if len(column) > 0 else np.empty(0) for column in columns]
+    tiers   = int(columns[0].max()) if len(columns[0]) > 0 else 0
+    x0, x1  = (float(columns[2].min()), float(columns[2].max())) if len(columns[2]) > 0 else (0.0, 1.0)
+    full    = (x1 - x0) or 1.0
+    lo      = '(zoom.x ? zoom.x[0] : {})'.format(x0)
+    hi      = '(zoom.x ? zoom.x[1] : {})'.format(x1)
+    span    = '({} - {})'.format(hi, lo)
+    tier    = 'clamp(floor(log({} / max({}, 1e-300)) / log({})), 0, {})'.format(full, span, PLOT_LOD_FACTOR, tiers)
+    visible = 'datum.t == {0} && datum.x >= {1} - {3} / 2 && datum.x <= {2} + {3} / 2'.format(tier, lo, hi, span)
+    data    = csv_values('t,s,x,y', columns, '%d,%d,%.10g,%.7g')
+    spec    = new_spec(args, data, {'t': 'number', 's': 'number', 'x': 'number', 'y': 'number'})
+    spec['params']    = [ {'name': 'labels', 'value': [label for label, x, y in series]},
+                          {'name': 'zoom', 'select': {'type': 'interval', 'encodings': ['x']}, 'bind': 'scales'} ]
+    spec['transform'] = [ {'filter': visible},
+                          {'calculate': 'labels[datum.s]', 'as': 'series'} ]
+    spec['mark']      = {'type': mark, 'clip': True, 'tooltip': True}
+    spec['encoding']  = { 'x':     { 'field': 'x', 'type': 'quantitative', 'title': args.xlabel or 'index',
+                                     'scale': {'domain': [x0, x1]} },
+                          'y':     { 'field': 'y', 'type': 'quantitative', 'title': args.ylabel,
+                                     'scale': {'zero': False} },
+                          'color': {'field': 'series', 'type': 'nominal', 'title': None,
+                                    'legend': None if len(series) == 1 else {}} }
+    return spec
+
+def cell_edges(x, step):
+    """Return the edges of the cells of a heat map along coordinates ``x``
+       when every ``step`` coordinates are merged into one cell.
+    """
+    import numpy as np
+    x    = np.asarray(x, dtype=float)
+    last = x[-1] + (x[-1] - x[0]) / max(len(x) - 1, 1) if len(x) > 1 else x[-1] + 1
+    return np.append(x[::step], last)
+
+def block_means(z, rows, cols):
+    """Return the means of the ``rows`` by ``cols`` blocks of the matrix ``z``
+       (the last blocks may be smaller).
+    """
+    import numpy as np
+    import warnings
+    r, c   = -(-z.shape[0] // rows), -(-z.shape[1] // cols)
+    padded = np.full((r * rows, c * cols), np.nan)
+    padded[:z.shape[0], :z.shape[1]] = z
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # blocks of only NaNs
+        return np.nanmean(padded.reshape(r, rows, c, cols), axis=(1, 3))
+
+def heatmap_spec(args, x, y, z):
+    """Return the Vega-Lite specification of a heat map of the matrix ``z``
+       over the grid given by the vectors ``x`` (columns) and ``y`` (rows).
+       A large matrix is reduced to at most ``PLOT_GRID`` cells per axis.
+    """
+    import numpy as np
+    z          = np.asarray(z, dtype=float).reshape(len(y), len(x))
+    rows, cols = -(-len(y) // PLOT_GRID) or 1, -(-len(x) // PLOT_GRID) or 1
+    if z.size > 0:
+        means, xs, ys = block_means(z, rows, cols), cell_edges(x, cols), cell_edges(y, rows)
+    else:
+        means, xs, ys = np.empty((0, 0)), np.empty(1), np.empty(1)
+    i, j       = np.meshgrid(np.arange(means.shape[0]), np.arange(means.shape[1]), indexing='ij')
+    i, j       = i.ravel(), j.ravel()
+    data = csv_values('x,x2,y,y2,z', [xs[j], xs[j + 1], ys[i], ys[i + 1], means.ravel()],
+                      '%.10g,%.10g,%.10g,%.10g,%.7g')
+    spec = new_spec(args, data, {'x': 'number', 'x2': 'number', 'y': 'number', 'y2': 'number', 'z': 'number'})
+    spec['params']   = [{'name': 'zoom', 'select': {'type': 'interval', 'encodings': ['x', 'y']}, 'bind': 'scales'}]
+    spec['mark']     = {'type': 'rect', 'clip': True, 'tooltip': True}
+    spec['encoding'] = { 'x':     {'field': 'x', 'type': 'quantitative', 'title': args.xlabel or 'x'},
+                         'x2':    {'field': 'x2'},
+                         'y':     {'field': 'y', 'type': 'quantitative', 'title': args.ylabel or 'y'},
+                         'y2':    {'field': 'y2'},
+                         'color': {'field': 'z', 'type': 'quantitative', 'title': 'z',
+                                   'scale': {'scheme': 'viridis'}} }
+    return spec
+
+def interactive_bundle(spec):
+    """Return the MIME bundle of an interactive plot with specification
+       ``spec``, along with a text fallback for frontends without Vega-Lite.
+    """
+    return {VEGA_LITE_MIME: spec, 'text/plain': '<Figure (interactive)>'}
@@ -5,12 +5,31 @@
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 
 from ipykernel.kernelbase import Kernel
+from .arguments import *
+from .bridge import *
+from .cache import *
+from .completion import *
+from .parallel import *
+from .plotting import *
+from .profiles import *
+from .restore import *
 from .templates import *
-from math import ceil
+from .tracing import *
+from .transfer import *
 
+import asyncio
+import base64
+import contextvars
+import functools
+import json
 import os
 import pexpect
 import re
+import signal
+import sys
+import threading
+import time
+import uuid
 
 SCALATION_KERNEL_VERSION = '1.1.x'
 SCALATION_KERNEL_AUTHORS = 'Michael E. Cotterell, John A. Miller'
@@ -19,48 +38,189 @@ SCALATION_KERNEL_LICENSE = 'MIT'
 SCALATION_VERSION = '1.4'
 SCALATION_JARS    = os.environ['SCALATION_JARS']
 
+try:
+    SCALA_PROFILE = get_profile()            # JVM tuning profile
+except (OSError, ValueError) as e:
+    print('{}; using the {} profile instead'.format(e, PROFILE_DEFAULT), file=sys.stderr)
+    SCALA_PROFILE = get_profile(PROFILE_DEFAULT, {})
+
 SCALA_EXEC        = 'scala'                  # scala executable
 SCALA_PROMPT_MAIN = 'scala> '                # main prompt
 SCALA_PROMPT_CONT = '     \| '               # continue prompt
 SCALA_PROMPT      = [SCALA_PROMPT_MAIN,
                      SCALA_PROMPT_CONT]
+SCALA_CLASSPATH   = profile_classpath(SCALATION_JARS, SCALA_PROFILE)
+SCALA_TUNING      = scala_options(SCALA_PROFILE)  # heap, gc, jit, ...
 SCALA_OPTIONS     = ['-Dscala.color',        # disable color
-                     '-cp', SCALATION_JARS]  # add jars
+                     '-cp', SCALA_CLASSPATH] + SCALA_TUNING  # add jars
+SCALA_DIMENSIONS  = (24, 4096)               # terminal rows and (wide) columns
+SCALA_PROMPTS     = re.compile('^(?:{}|{})+'.format(re.escape(SCALA_PROMPT_MAIN), SCALA_PROMPT_CONT))
+SCALA_STARTUP     = os.environ.get('SCALATION_KERNEL_STARTUP')
+SCALA_TIMEOUT     = float(os.environ.get('SCALATION_KERNEL_TIMEOUT', 0)) or None
+SCALA_REPLAY      = os.environ.get('SCALATION_KERNEL_REPLAY', '1') != '0'
+SCALA_TRACE       = os.environ.get('SCALATION_KERNEL_TRACE')  # chrome trace written at shutdown
+SCALA_INTERRUPT   = 10                       # seconds to recover from an interrupt
+SCALA_ERROR       = re.compile(r'^(<\w+>:\d+: |\s*)error: ')
+SCALA_DEFINITION  = re.compile(r'^((abstract|case|final|implicit|sealed)\s+)*(import|def|class|object|trait|type)\b')
+SCALA_PASTE       = ':paste'                 # enter paste mode
+SCALA_VERSION     = 'println(util.Properties.versionNumberString)'  # e.g., 2.12.8
+SCALA_PASTE_ENTER = '// Entering paste mode (ctrl-D to finish)'
+SCALA_PASTE_EXIT  = '// Exiting paste mode, now interpreting.'
 
 HTML_PREFIX = '<scalation_kernel>:html:'
 JSON_PREFIX = '<scalation_kernel>:json:'
 TEXT_PREFIX = '<scalation_kernel>:text:'
 IMAG_PREFIX = '<scalation_kernel>:imag:'  # images
+MIME_PREFIX = '<scalation_kernel>:mime:'  # display protocol
+DISP_PREFIX = [HTML_PREFIX, JSON_PREFIX, IMAG_PREFIX]
+FRAM_PREFIX = '<scalation_kernel>:'       # begin/end sentinels
+
+STREAM_NEWLINE  = '\r\n'                   # pty line ending
+STREAM_INTERVAL = 0.1                     # seconds between stream flushes
+STREAM_LINES    = 1000                    # lines buffered before a flush
+
+RELATION_LIMIT = 100                      # rows per ::relation page
+RELATION_CHUNK = 10000                    # rows per ::relation fetch
+
+SHELL_CONCURRENT = {'complete_request',   # shell messages that never wait
+                    'inspect_request',    # for a running cell (they do not
+                    'kernel_info_request'}  # use the REPL)
+
+CMD_PLOTV    = '::plotv'
+CMD_PLOTM    = '::plotm'
+CMD_PLOTF    = '::plotf'
+CMD_PLOT3D   = '::plot3d'
+CMD_DEBUG    = '::debug'
+CMD_BATCH    = '::batch'
+CMD_TIMEOUT  = '::timeout'
+CMD_TIMING   = '::timing'
+CMD_STATS    = '::stats'
+CMD_TRACE    = '::trace'
+CMD_CACHE    = '::cache'
+CMD_PARALLEL = '::parallel'
+CMD_EXPORT   = '::export'
+CMD_IMPORT   = '::import'
+CMD_RESTORE  = '::restore'
+CMD_RESOURCE = '::resources'
+CMD_PREFIX   = '::'
+CMD_PRETTYR  = '::relation'
+
+def new_frame():
+    """Return a pair of unique begin and end sentinel markers."""
+    token = uuid.uuid4().hex
+    return FRAM_PREFIX + 'begin:' + token, FRAM_PREFIX + 'end:' + token
+
+def frame_line(marker):
+    """Return a line of Scala code that prints ``marker``. The marker is split
+       in two in the code, so an echo of the code never matches the marker.
+    """
+    head, tail = marker[:len(FRAM_PREFIX)], marker[len(FRAM_PREFIX):]
+    return 'println("{}" + "{}")'.format(head, tail)
+
+def unframe(output, echoed):
+    """Return the lines of framed ``output`` without prompts, echoes of the
+       lines in ``echoed`` (in order) and leading or trailing blank lines.
+    """
+    echoed, lines = list(echoed), []
+    for line in output.splitlines():
+        line = SCALA_PROMPTS.sub('', line)
+        if len(echoed) > 0 and line == echoed[0]:
+            echoed.pop(0)
+        elif line.strip() != '' or len(lines) > 0:
+            lines.append(line)
+    while len(lines) > 0 and lines[-1].strip() == '':
+        lines.pop()
+    return lines
+
+def definition_lines(code_lines):
+    """Return the lines of ``code_lines`` that belong to top-level imports and
+       definitions (e.g., ``def``, ``class`` and ``object``), which are cheap
+       and safe to evaluate again in a new REPL. A top-level line is one that
+       does not start with whitespace or a closing bracket; the lines that
+       follow it belong to it.
+    """
+    lines, keep = [], False
+    for line in code_lines:
+        if line != '' and not line[0].isspace() and line[0] not in ')]}':
+            keep = SCALA_DEFINITION.match(line) != None
+        if keep:
+            lines.append(line)
+    return lines
+
+def is_definition_block(code_lines):
+    """Return whether or not the block ``code_lines`` only holds imports,
+       definitions (at least one) and comments at the top level, i.e., whether
+       or not it can be compiled on its own as the body of an object.
+    """
+    tops = [line for line in code_lines if line != '' and not line[0].isspace() and line[0] not in ')]}']
+    tops = [line for line in tops if not line.startswith(('//', '/*', '*'))]
+    return (all(SCALA_DEFINITION.match(line) != None for line in tops)
+            and any(not line.startswith('import ') for line in tops))
+
+@functools.lru_cache(maxsize=None)
+def relation_parser():
+    """Return the argument parser for ``::relation``."""
+    parser = CommandArgumentParser(prog=CMD_PRETTYR, add_help=False)
+    parser.add_argument('relation', help='a ScalaTion relation')
+    parser.add_argument('--limit', type=int, default=RELATION_LIMIT, help='number of rows to show')
+    parser.add_argument('--offset', type=int, default=0, help='index of the first row to show')
+    parser.add_argument('--columns', help='comma-separated names of the columns to show')
+    parser.add_argument('--dataresource', action='store_true', help='also send the page as a data resource')
+    return parser
 
-CMD_PLOTV   = '::plotv'
-CMD_PLOTM   = '::plotm'
-CMD_PLOTF   = '::plotf'
-CMD_PLOT3D  = '::plot3d'
-CMD_DEBUG   = '::debug'
-CMD_PRETTYR = '::relation'
+class StreamState(object):
+    """The state of the REPL's output while it is being streamed to the
+    notebook (see ``ScalaTionKernel.do_stream``).
+    """
+
+    def __init__(self, echoed=()):
+        """Construct the state, ignoring echoes of the lines in ``echoed``."""
+        self.echoed   = list(echoed)                  # echoes to ignore
+        self.pending  = []                            # lines not yet sent
+        self.blank    = 0                             # blank lines held back
+        self.display  = None                          # prefixed output?
+        self.mime     = None                          # display protocol header
+        self.payloads = []                            # display protocol payloads
+        self.flushed  = time.monotonic()
 
 class ScalaTionKernel(Kernel):
     """A Scala+ScalaTion kernel for Jupyter. It uses the system or container's 
     Scala installation for the underlying REPL. This implementation uses 
-    ipykernel and pexpect to allow the kernel to easily interact with the REPL.
+    ipykernel and pexpect to allow the kernel to easily interact with the REPL,
+    or, with the bridge engine (see ``BridgeREPL``), an interpreter server.
     """
 
-    debug_mode = False
+    debug_mode    = False
+    batch_mode    = True
+    timing_mode   = False
+    helper_loaded = None
+    scala_version = ''                       # read when the REPL starts
+    repl_error    = False
+    deadline      = None
+    jobs          = None                     # execution queue
+    jobs_loop     = None                     # event loop that runs the queue
+    jobs_task     = None                     # task that runs the queue
+    job           = None                     # task of the running job
+    sigint        = True                     # cancel the running job on SIGINT
+    sessions      = True                     # compile definitions and save the session (see ::restore)
     implementation = 'scalation_kernel'
     implementation_version = '1.1.x'
     language = 'scala'
-    language_info = {
-        'name': 'scala',
-        'mimetype': 'text/x-scala-source',
-        'file_extension': '.scala'
-    }
+
+    @property
+    def language_info(self):
+        """Return the language info, including the Scala version."""
+        return { 'name': 'scala',
+                 'version': self.language_version,
+                 'mimetype': 'text/x-scala-source',
+                 'file_extension': '.scala' }
 
     @property
     def language_version(self):
-        """Return the Scala version that the kernel is interacting with."""
-        version_code = 'println(util.Properties.versionString.replaceFirst("version ", ""))'
-        version = do_quick(version_code)
-        return str(version)
+        """Return the Scala version that the kernel is interacting with, which
+           is read when the REPL starts (see ``read_version``).
+        """
+        return self.scala_version
 
     @property
     def banner(self):
@@ -74,8 +234,257 @@ class ScalaTionKernel(Kernel):
     def __init__(self, **kwargs):
         """Construct the kernel."""
         Kernel.__init__(self, **kwargs)
-        self.child = pexpect.spawnu(SCALA_EXEC, SCALA_OPTIONS) # start scala
-        self.child.expect(SCALA_PROMPT)                        # wait for prompt
+        self.bulk        = BulkChannel()                             # bulk data side channel
+        self.data_cache  = DataCache()                               # fetched data
+        self.renderer    = RenderPool()                              # figure rendering
+        self.renders     = []                                        # figures being rendered
+        self.workers     = []                                        # worker REPLs
+        self.preamble    = []                                        # imports and definitions
+        self.segments    = []                                        # the preamble, by block
+        self.definitions = DefinitionCache(SCALA_CLASSPATH)          # compiled definitions
+        self.required    = set()                                     # keys of jars on the classpath
+        self.compiling   = None                                      # compilation worker
+        self.uncompiled  = []                                        # definitions to compile
+        self.compile_at  = 0                                         # when the session is idle
+        self.names       = SessionNames()                            # names defined so far
+        self.symbols     = SymbolIndex(SCALA_CLASSPATH)              # loaded on first use
+        self.completer   = Completer(self.symbols, self.names)
+        self.tracer      = Tracer()                                  # timing instrumentation
+        self.start_repl()
+
+    def start_repl(self):
+        """Start the Scala REPL, or acquire a warm one from the pool, and wait
+           for its prompt. The ``ScalaTionKernelIO`` helper is loaded right
+           away, so that Scala code can use its display protocol.
+        """
+        self.child, self.helper_loaded = self.spawn_repl()
+        self.scala_version = self.read_version(self.child)
+
+    def read_version(self, child):
+        """Return the Scala version of the REPL ``child`` (e.g., ``2.12.8``),
+           or an empty string if it cannot be read. Like ``paste_file``, this
+           blocks, so it is only used while a REPL is being started.
+        """
+        try:
+            if isinstance(child, BridgeREPL):
+                result, output = child.execute(SCALA_VERSION)
+                lines = output.splitlines()
+            else:
+                begin, end = new_frame()
+                end_line   = frame_line(end)
+                child.send('\n'.join([frame_line(begin), SCALA_VERSION, end_line]) + '\n')
+                child.expect_exact(begin, timeout=SCALA_INTERRUPT)
+                child.expect_exact(end, timeout=SCALA_INTERRUPT)
+                lines = unframe(child.before, [SCALA_VERSION, end_line])
+                child.expect_exact(SCALA_PROMPT_MAIN, timeout=SCALA_INTERRUPT)
+        except (EOFError, pexpect.ExceptionPexpect):
+            return ''
+        lines = [line.strip() for line in lines if line.strip() != '']
+        return lines[0] if len(lines) == 1 and not SCALA_ERROR.match(lines[0]) else ''
+
+    def spawn_repl(self):
+        """Start a Scala REPL, or acquire a warm one from the pool, wait for
+           its prompt and load the helper and the startup script into it.
+           Return the REPL and whether or not the helper was loaded.
+        """
+        from .pool import acquire_repl
+        if BRIDGE_ENGINE == 'bridge':
+            try:
+                return self.spawn_bridge()
+            except (OSError, EOFError, ValueError) as e:
+                print('could not start {} ({}); using the Scala REPL instead'.format(BRIDGE_NAME, e), file=sys.stderr)
+        helper_loaded = False
+        pooled = acquire_repl([SCALA_EXEC] + SCALA_OPTIONS,       # warm scala from the pool,
+                              SCALA_STARTUP)                       # with the same startup?
+        if pooled != None:
+            child, reply  = pooled
+            helper_loaded = reply['helper_loaded']
+        else:
+            child = pexpect.spawnu(SCALA_EXEC, SCALA_OPTIONS,      # start scala
+                                   echo=False, dimensions=SCALA_DIMENSIONS)
+        child.delaybeforesend = None                               # no sleep per send
+        child.delayafterread  = None                               # no sleep per read
+        if pooled == None:
+            child.expect(SCALA_PROMPT)                             # wait for prompt
+        if not helper_loaded:                                      # load helper
+            helper_loaded = HELPER_LOADED in self.paste_file(HELPER_SOURCE, child)
+        if pooled == None and SCALA_STARTUP != None:               # run startup script
+            self.paste_file(SCALA_STARTUP, child)
+        return child, helper_loaded
+
+    def spawn_bridge(self):
+        """Start an interpreter server (see ``BridgeREPL``), compiling it first
+           if needed, and load the helper and the startup script into it.
+           Return the server and whether or not the helper was loaded.
+        """
+        java  = ['-J' + option for option in java_options(SCALA_PROFILE)]
+        child = BridgeREPL([SCALA_EXEC] + java + ['-cp', bridge_jar()], SCALA_CLASSPATH, SCALA_PROFILE['scala'])
+        try:
+            helper_loaded = HELPER_LOADED in self.paste_file(HELPER_SOURCE, child)
+            if SCALA_STARTUP != None:
+                self.paste_file(SCALA_STARTUP, child)
+        except BaseException:
+            child.terminate(force=True)
+            raise
+        return child, helper_loaded
+
+    def paste_file(self, path, child=None):
+        """Paste the Scala file at ``path`` into the REPL (or the REPL
+           ``child``) and return its output. This blocks until the REPL returns
+           to its prompt, so it is only used while a REPL is being started.
+        """
+        child = child or self.child
+        if isinstance(child, BridgeREPL):
+            with open(path) as f:
+                return child.execute(f.read())[1]
+        child.sendline('{} {}'.format(SCALA_PASTE, path))
+        child.expect_exact(SCALA_PROMPT_MAIN)
+        return child.before
+
+    async def restart_repl(self):
+        """Kill the Scala REPL and start a new one. If ``SCALA_REPLAY`` is
+           enabled, the imports and definitions that were successfully
+           evaluated by the old REPL are replayed in the new one. The new REPL
+           is started on another thread, so the event loop keeps running.
+        """
+        self.send_debug_response("restarting the REPL")
+        if self.child.isalive():
+            self.child.terminate(force=True)
+        self.names.clear()
+        self.data_cache.clear()
+        await asyncio.get_running_loop().run_in_executor(None, self.start_repl)
+        self.send_debug_response("<code>{}</code> loaded: {}".format(HELPER_NAME, self.helper_loaded))
+        self.required.clear()
+        if SCALA_REPLAY and len(self.segments) > 0:
+            deadline, self.deadline = self.deadline, None
+            await self.replay_segments(self.segments)
+            self.deadline = deadline
+
+    async def reset_repl(self):
+        """Forget everything that was defined in the session (i.e., start a
+           new session) while keeping the REPL's warm JVM. The REPL's state is
+           reset using ``:reset``, after which the helper and the startup
+           script are loaded again, and the kernel's modes, names and caches
+           are reset. If the REPL does not return to its prompt, a new one is
+           started instead.
+        """
+        self.send_debug_response("resetting the REPL")
+        self.stop_workers()
+        self.preamble   = []
+        self.segments   = []
+        self.uncompiled = []
+        self.names.clear()
+        self.data_cache.clear()
+        for mode in ['debug_mode', 'batch_mode', 'timing_mode']:
+            setattr(self, mode, getattr(type(self), mode))
+        loop = asyncio.get_running_loop()
+        try:
+            if isinstance(self.child, BridgeREPL):
+                await self.child.reset(SCALA_INTERRUPT)
+            else:
+                self.child.sendline(':reset')
+                await self.expect_repl([SCALA_PROMPT_MAIN], SCALA_INTERRUPT, exact=True)
+                self.drain_echo()
+            output = await loop.run_in_executor(None, self.paste_file, HELPER_SOURCE)
+            self.helper_loaded = HELPER_LOADED in output
+            if SCALA_STARTUP != None:
+                await loop.run_in_executor(None, self.paste_file, SCALA_STARTUP)
+        except (OSError, EOFError, TimeoutError, pexpect.TIMEOUT, pexpect.EOF):
+            await self.restart_repl()
+
+    async def interrupt_repl(self):
+        """Interrupt the statement that the Scala REPL is running and wait for
+           it to return to the main prompt. If it does not return within
+           ``SCALA_INTERRUPT`` seconds, or if it has exited, it is restarted.
+        """
+        self.send_debug_response("interrupting the REPL")
+        if isinstance(self.child, BridgeREPL):
+            if not await self.child.interrupt(SCALA_INTERRUPT):
+                await self.restart_repl()
+            return
+        try:
+            self.child.sendintr()
+            await self.expect_repl([SCALA_PROMPT_MAIN], SCALA_INTERRUPT, exact=True)
+            self.drain_echo()
+        except (OSError, pexpect.TIMEOUT, pexpect.EOF):
+            await self.restart_repl()
+
+    async def expect_repl(self, patterns, timeout=None, exact=False, child=None):
+        """Wait until the output of the REPL (or the REPL ``child``) matches
+           one of ``patterns`` (regular expressions or, if ``exact``, strings)
+           and return the index of the pattern that matched, like
+           ``pexpect``'s ``expect``. The output that has already arrived is
+           searched right away; otherwise, the event loop is free to service
+           other messages (e.g., on the control channel) until the REPL's
+           terminal becomes readable. If nothing matches within ``timeout``
+           seconds, the index of ``pexpect.TIMEOUT`` is returned if it is one
+           of the ``patterns``, or it is raised.
+        """
+        child    = child or self.child
+        expect   = child.expect_exact if exact else child.expect
+        patterns = list(patterns)
+        polled   = patterns + [pexpect.TIMEOUT]           # poll without blocking
+        deadline = time.monotonic() + timeout if timeout != None else None
+        loop     = asyncio.get_running_loop()
+        fd       = child.child_fd
+        while True:
+            index = expect(polled, timeout=0)
+            if index < len(patterns):
+                return index
+            wait = deadline - time.monotonic() if deadline != None else None
+            if wait != None and wait <= 0:
+                if pexpect.TIMEOUT in patterns:
+                    return patterns.index(pexpect.TIMEOUT)
+                raise pexpect.TIMEOUT('timed out waiting for the REPL')
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                loop.remove_reader(fd)
+
+    def time_left(self):
+        """Return the number of seconds left before the current cell times out,
+           or ``None`` if it has no timeout.
+        """
+        if self.deadline == None:
+            return None
+        time_left = self.deadline - time.monotonic()
+        if time_left <= 0:
+            raise pexpect.TIMEOUT('execution timed out')
+        return time_left
+
+    def set_timeout(self, timeout_args):
+        """Set the timeout, in seconds, for the rest of the current cell. A
+           timeout of zero (or no timeout) disables it.
+        """
+        timeout = float(timeout_args.strip() or 0)
+        self.deadline = time.monotonic() + timeout if timeout > 0 else None
+
+    async def do_shutdown(self, restart):
+        """Shutdown the kernel, stopping the execution queue and the REPL and
+           removing the bulk data side channel.
+        """
+        if self.jobs_task != None and self.jobs_loop is asyncio.get_running_loop():
+            self.jobs_task.cancel()
+            await asyncio.wait([self.jobs_task])
+        if self.compiling != None:
+            self.compiling.cancel()
+        if self.child.isalive():
+            self.child.terminate(force=True)
+        self.bulk.close()
+        self.renderer.close()
+        self.stop_workers()
+        if SCALA_TRACE != None:
+            self.tracer.write(SCALA_TRACE)
+        return {'status': 'ok', 'restart': restart}
+
+    def send_response(self, *args, **kwargs):
+        """Send a response, timing it as ``iopub.send``."""
+        with self.tracer.span('iopub.send'):
+            return Kernel.send_response(self, *args, **kwargs)
 
     def render_template(self, template_name, template_dict):
         """Render a template using the given dictionary."""
@@ -91,6 +500,38 @@ class ScalaTionKernel(Kernel):
         }
         self.send_response(self.iopub_socket, 'display_data', html)
 
+    def send_display_response(self, data, metadata=None, display_id=None, update=False):
+        """Send a display response with the MIME bundle ``data``. If
+           ``display_id`` is given, the output can be updated later by sending
+           another response with the same ``display_id`` and ``update``.
+        """
+        content = {
+            'data': data,
+            'metadata': metadata or {},
+            'transient': {'display_id': display_id} if display_id else {}
+        }
+        msg_type = 'update_display_data' if update and display_id else 'display_data'
+        self.send_response(self.iopub_socket, msg_type, content)
+
+    def send_mime_response(self, header, payloads):
+        """Send a display response for a MIME bundle that was printed using the
+           display protocol, given its parsed ``header`` and the Base64
+           ``payloads`` for each of its MIME types. Binary images are passed
+           through as Base64; other payloads are decoded as UTF-8 text and, for
+           JSON types, parsed.
+        """
+        data = {}
+        for (mime_type, length), payload in zip(header['data'], payloads):
+            if len(payload) != length:
+                self.send_debug_response("bad <code>{}</code> payload length: {} != {}".format(mime_type, len(payload), length))
+            elif mime_type.startswith('image/') and mime_type != 'image/svg+xml':
+                data[mime_type] = payload
+            else:
+                text = base64.b64decode(payload).decode('utf-8')
+                data[mime_type] = json.loads(text) if mime_type.endswith('json') else text
+        if len(data) > 0:
+            self.send_display_response(data, display_id=header.get('display_id'), update=header.get('update', False))
+
     def send_template_response(self, template_name, template_dict):
         """Send an HTML response using the given template and dictionary."""
         rendered = self.render_template(template_name, template_dict)
@@ -102,325 +543,1164 @@ class ScalaTionKernel(Kernel):
         toggle_debug_mode_dict = {'debug_mode': self.debug_mode }
         self.send_template_response(toggle_debug_mode_template, toggle_debug_mode_dict)
 
-    def do_quick(self, code_line, evaluate = False):
-        """Quickly execute a line using the underlying REPL and, if needed, 
-           evaluate it as Python code.
+    def toggle_batch_mode(self):
+        """Toggle whether Scala code is sent to the REPL one block at a time
+           (the default) or one line at a time.
+        """
+        self.batch_mode = not self.batch_mode
+        toggle_batch_mode_dict = {'batch_mode': self.batch_mode }
+        self.send_template_response(toggle_batch_mode_template, toggle_batch_mode_dict)
+
+    def toggle_timing_mode(self):
+        """Toggle whether or not the kernel sends a breakdown of where the
+           time went after each cell.
+        """
+        self.timing_mode = not self.timing_mode
+        toggle_timing_mode_dict = {'timing_mode': self.timing_mode }
+        self.send_template_response(toggle_timing_mode_template, toggle_timing_mode_dict)
+
+    def send_timing_response(self, total):
+        """Send the breakdown of the timings for the current cell, which took
+           ``total`` seconds.
+        """
+        timing_dict = {'total': total, 'rows': self.tracer.breakdown()}
+        self.send_template_response(timing_template, timing_dict)
+
+    def send_stats_response(self):
+        """Send the histograms of the timings for the whole session."""
+        rows = sorted(self.tracer.stats.items(), key=lambda item: -item[1].total)
+        stats_dict = {'rows': rows, 'sparkline': sparkline}
+        self.send_template_response(stats_template, stats_dict)
+
+    def write_trace(self, trace_args):
+        """Write the recorded spans to a file in the Chrome trace format. The
+           file defaults to ``SCALATION_KERNEL_TRACE``.
+        """
+        path = os.path.expanduser(trace_args.strip() or SCALA_TRACE or '')
+        if path == '':
+            raise ValueError('usage: {} FILE'.format(CMD_TRACE))
+        count = self.tracer.write(path)
+        self.send_response(self.iopub_socket, 'stream', {'name': 'stdout', 'text': 'wrote {} events to {}\n'.format(count, path)})
+
+    def send_cache_response(self, cache_args):
+        """Send a summary of the data cache or, with ``clear``, empty it. If
+           expressions are given after ``clear``, only the data fetched from
+           them is removed.
+        """
+        args = cache_args.split()
+        if len(args) > 0 and args[0] == 'clear':
+            self.data_cache.clear(args[1:] or None)
+        elif len(args) > 0:
+            raise ValueError('usage: {} [clear [EXPRESSION ...]]'.format(CMD_CACHE))
+        cache = self.data_cache
+        cache_dict = { 'rows':      list(reversed(cache.entries.items())),
+                       'size':      cache.size,
+                       'max_bytes': cache.max_bytes,
+                       'hits':      cache.hits,
+                       'misses':    cache.misses }
+        self.send_template_response(cache_template, cache_dict)
+
+    async def do_quick(self, code_line, evaluate = False):
+        """Quickly execute a line (or list of lines) using the underlying REPL
+           and, if needed, evaluate its output as Python code. The lines are
+           sent in one go between a pair of sentinel markers, and exactly the
+           output between the markers is returned.
         """
         self.send_debug_response("<code>do_quick</code> with <code>{}</code>".format(code_line))
-        if isinstance(code_line, list):           # handle code list
-            for line in code_line:                # handle each line in list
-                self.child.sendline(line)         # send each line
-                self.child.expect(SCALA_PROMPT)   # check for prompt
-        else:                                     # handle single line
-            self.child.sendline(code_line)        # send the line
-            self.child.expect(SCALA_PROMPT)       # check for prompt
-        nrows  = ceil(len(code_line) / 80)        # how many times is the input split by pexpect?
-        output = self.child.before                # get entire output
-        lines  = output.splitlines()              # breakup into lines
-        lines  = lines[nrows:-1]                  # ignore input lines and last line
+        code_lines = code_line if isinstance(code_line, list) else [code_line]
+        if isinstance(self.child, BridgeREPL):
+            lines = await self.bridge_output(code_lines)
+        else:
+            begin, end = new_frame()
+            end_line   = frame_line(end)
+            with self.tracer.span('repl.send'):
+                self.child.send('\n'.join([frame_line(begin)] + code_lines + [end_line]) + '\n')
+            with self.tracer.span('repl.expect'):
+                await self.expect_repl([begin], self.time_left(), exact=True)
+                await self.expect_repl([end], self.time_left(), exact=True)
+                lines = unframe(self.child.before, code_lines + [end_line])
+                await self.expect_repl([SCALA_PROMPT_MAIN], self.time_left(), exact=True)
         lines = '\n'.join(lines)                  # rejoin lines
         if evaluate:
             return self.do_ast_eval(lines)
         else:
             return lines
         
-    def send_prettyr_response(self, relation):
-        """Send a response with a prettier version of a ``Relation``."""
-        self.send_debug_response("building a prettier relation for <code>{}</code>".format(relation))
-        prettyr_dict = { 'name':     self.do_quick('println({}.name)'.format(relation)),
-                         'colNames': self.do_quick('println({}.colName.mkString("[\'", "\',\'", "\']"))'.format(relation), True),
-                         'data':     self.do_quick(['println((0 until {0}.rows).map({0}.row(_)'.format(relation), 
-                                                    '.mkString("[\'", "\',\'", "\']"))',
-                                                    '.mkString("[", ",", "]"))'.format(relation)], True) }
-        self.send_template_response(prettyr_template, prettyr_dict)
+    async def do_paste(self, code_lines, quiet=False):
+        """Execute a block of lines as a single unit using the REPL's paste
+           mode and stream its output, unless ``quiet``. Multi-line definitions
+           are compiled together, so they never bounce through the continuation
+           prompt, and the whole block costs one prompt synchronization. The
+           block is framed by sentinel markers.
+        """
+        self.send_debug_response("<code>do_paste</code> with <code>{}</code> lines".format(len(code_lines)))
+        if isinstance(self.child, BridgeREPL):
+            await self.do_bridge(code_lines, quiet)
+            return
+        begin, end = new_frame()
+        end_line   = frame_line(end)
+        with self.tracer.span('repl.send'):
+            self.child.send('\n'.join([frame_line(begin), SCALA_PASTE]) + '\n')
+            await self.expect_repl([begin], self.time_left(), exact=True)
+            await self.expect_repl([SCALA_PASTE_ENTER], self.time_left(), exact=True)
+            for line in code_lines:                     # send the whole block
+                self.child.sendline(line)
+                self.drain_echo()                       # keep the pty from filling up
+                await asyncio.sleep(0)                  # let other messages through
+            self.child.sendcontrol('d')                 # leave paste mode
+            self.child.sendline(end_line)               # then print the end marker
+            await self.expect_repl([SCALA_PASTE_EXIT], self.time_left(), exact=True)
+        await self.do_stream(end, [end_line], quiet)    # wait for interpretation
 
-    def do_ast_eval(self, expression):
-        """Evaluate an expression as Python code."""
-        import ast
+    async def do_stream(self, end=None, echoed=(), quiet=False):
+        """Forward the REPL's output to the notebook as it arrives, until the
+           ``end`` marker is printed (or, if there is none, until the REPL
+           returns to a prompt), and return the index of the pattern that
+           stopped it. Prompts, echoes of the lines in ``echoed`` (in order)
+           and leading or trailing blank lines are ignored. Plain output is
+           sent as ``stream`` messages as soon as it arrives, but at most every
+           ``STREAM_INTERVAL`` seconds or ``STREAM_LINES`` lines, so
+           long-running statements show
+           their progress and their output is never held in memory in full;
+           output with a kernel-specific prefix is collected and sent as a
+           single response once the prompt comes back. Each MIME bundle
+           printed using the display protocol (see ``ScalaTionKernelIO``) is
+           sent as its own display response as soon as it is complete. If
+           ``quiet``, nothing is sent. If the output reports a compilation
+           error, ``repl_error`` is set. If the current cell times out,
+           ``pexpect.TIMEOUT`` is raised.
+        """
+        stops    = [re.escape(end)] if end != None else SCALA_PROMPT
+        patterns = stops + [STREAM_NEWLINE, pexpect.TIMEOUT]
+        state    = StreamState(echoed)
+        tracer   = self.tracer
+        while True:
+            self.time_left()                            # timed out?
+            started = time.perf_counter()
+            index   = await self.expect_repl(patterns, STREAM_INTERVAL)
+            parsing = time.perf_counter()
+            tracer.add('repl.expect', parsing - started)
+            if index < len(stops) or patterns[index] == STREAM_NEWLINE:
+                self.stream_line(state, SCALA_PROMPTS.sub('', self.child.before), quiet)
+                if index < len(stops):                  # done?
+                    tracer.add('output.parse', time.perf_counter() - parsing)
+                    break
+            self.stream_flush(state, quiet)
+            tracer.add('output.parse', time.perf_counter() - parsing)
+        if end != None:                                 # back to the main prompt
+            await self.expect_repl([SCALA_PROMPT_MAIN], self.time_left(), exact=True)
+        if not quiet:
+            self.send_output_response(state.pending)
+        return index
+
+    def stream_line(self, state, line, quiet):
+        """Handle one ``line`` of the REPL's output, without its prompt, while
+           it is being streamed with ``state`` (see ``do_stream``).
+        """
+        if len(state.echoed) > 0 and line == state.echoed[0]:
+            state.echoed.pop(0)                         # echoed input
+        elif state.mime != None:                        # display payload
+            state.payloads.append(line)
+        elif not state.display and line.startswith(MIME_PREFIX):
+            if not quiet and len(state.pending) > 0:
+                self.send_output_response(state.pending)
+            state.pending, state.blank = [], 0
+            state.display = False
+            try:
+                state.mime = json.loads(line[len(MIME_PREFIX):])
+            except ValueError:
+                self.send_debug_response("bad display header: <code>{}</code>".format(line))
+        elif line.strip() == '':                        # blank line
+            state.blank = state.blank + 1 if state.display != None else 0
+        else:
+            if state.display == None:
+                state.display = any(line.startswith(prefix) for prefix in DISP_PREFIX)
+            if SCALA_ERROR.match(line):
+                self.repl_error = True
+            self.names.record(line)
+            state.pending.extend([''] * state.blank + [line])
+            state.blank = 0
+        if state.mime != None and len(state.payloads) == len(state.mime['data']):
+            if not quiet:
+                self.send_mime_response(state.mime, state.payloads)
+            state.mime, state.payloads = None, []
+
+    def stream_flush(self, state, quiet):
+        """Send the plain output that is pending in ``state``, unless it was
+           sent less than ``STREAM_INTERVAL`` seconds ago and is shorter than
+           ``STREAM_LINES`` lines (see ``do_stream``).
+        """
+        if quiet:
+            state.pending = []
+        elif not state.display and len(state.pending) > 0:
+            if len(state.pending) >= STREAM_LINES or time.monotonic() - state.flushed >= STREAM_INTERVAL:
+                self.send_output_response(state.pending)
+                state.pending = []
+                state.flushed = time.monotonic()
+
+    async def do_bridge(self, code_lines, quiet=False, op='eval'):
+        """Evaluate ``code_lines`` using the bridge engine and stream its
+           output, unless ``quiet``, like ``do_stream``: stdout is handled line
+           by line (e.g., for the display protocol) and stderr is sent as it
+           is. If the evaluation fails, ``repl_error`` is set. Return the
+           result of the evaluation (see ``BridgeREPL.evaluate``).
+        """
+        state = StreamState()
+        carry = ['']                                    # incomplete line of stdout
+
+        def on_output(name, text):
+            if name != 'stdout':
+                if not quiet:
+                    self.send_response(self.iopub_socket, 'stream', {'name': 'stderr', 'text': text})
+                return
+            lines    = (carry[0] + text).split('\n')
+            carry[0] = lines.pop()
+            for line in lines:
+                self.stream_line(state, line.rstrip('\r'), quiet)
+            self.stream_flush(state, quiet)
+
+        result = await self.bridge_evaluate(self.child, '\n'.join(code_lines), on_output, op)
+        if carry[0] != '':
+            self.stream_line(state, carry[0], quiet)
+        if result['status'] == 'error':
+            self.repl_error = True
+        if not quiet:
+            self.send_output_response(state.pending)
+        return result
+
+    async def bridge_evaluate(self, child, code, on_output=None, op='eval'):
+        """Evaluate ``code`` using the bridge engine ``child`` (see
+           ``BridgeREPL.evaluate``) within the time left for the current cell.
+           Like the REPL, ``pexpect.TIMEOUT`` is raised if the cell times out
+           and ``pexpect.EOF`` if the connection is lost.
+        """
         try:
-            return ast.literal_eval(expression)
-        except Exception as e:
-            debug_message = "problem calling <code>ast.literal_eval</code> with <code>{}</code>. {}".format(expression, str(e))
-            self.send_debug_response(debug_message)
-            return None
+            with self.tracer.span('repl.expect'):
+                return await asyncio.wait_for(child.evaluate(code, on_output, op), self.time_left())
+        except asyncio.TimeoutError:
+            raise pexpect.TIMEOUT('execution timed out')
+        except EOFError as e:
+            raise pexpect.EOF(str(e))
 
-    def send_plot3d_response(self, plot_args):
+    async def bridge_output(self, code_lines, child=None):
+        """Evaluate ``code_lines`` using the bridge engine (the kernel's or
+           ``child``) and return the lines of its output (stdout and stderr).
+        """
+        output = []
+        await self.bridge_evaluate(child or self.child, '\n'.join(code_lines), lambda name, text: output.append(text))
+        return unframe(''.join(output), [])
 
-        self.send_debug_response("building a plot3d (matrix plot)")
+    def drain_echo(self, child=None):
+        """Discard whatever the REPL (or the REPL ``child``) has echoed so far
+           without blocking.
+        """
+        child = child or self.child
+        try:
+            while True:
+                child.read_nonblocking(child.maxread, timeout=0)
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            pass
 
-        from mpl_toolkits.mplot3d import Axes3D
-        from matplotlib import pyplot
-        pyplot.switch_backend('agg')
-        
-        from io import BytesIO
-        import argparse, ast, base64, shlex
-        import numpy as np
-        
-        parser = argparse.ArgumentParser(add_help=False)
-        parser.add_argument('x')
-        parser.add_argument('y')
-        parser.add_argument('z')
-        parser.add_argument('--title')
-        parser.add_argument('//')
-        parser.add_argument('/*')
-        parser.add_argument('*/')
-        
-        args    = parser.parse_args(shlex.split(plot_args))
-        figfile = BytesIO()
+    async def paste_output(self, code_lines, child):
+        """Execute a block of lines in the REPL ``child`` using paste mode, like
+           ``do_paste``, and return the lines of its output instead of
+           streaming them.
+        """
+        if isinstance(child, BridgeREPL):
+            return await self.bridge_output(code_lines, child)
+        begin, end = new_frame()
+        end_line   = frame_line(end)
+        child.send('\n'.join([frame_line(begin), SCALA_PASTE]) + '\n')
+        await self.expect_repl([begin], self.time_left(), exact=True, child=child)
+        await self.expect_repl([SCALA_PASTE_ENTER], self.time_left(), exact=True, child=child)
+        for line in code_lines:
+            child.sendline(line)
+            self.drain_echo(child)
+            await asyncio.sleep(0)
+        child.sendcontrol('d')
+        child.sendline(end_line)
+        await self.expect_repl([SCALA_PASTE_EXIT], self.time_left(), exact=True, child=child)
+        await self.expect_repl([end], self.time_left(), exact=True, child=child)
+        lines = unframe(child.before, [end_line])
+        await self.expect_repl([SCALA_PROMPT_MAIN], self.time_left(), exact=True, child=child)
+        return lines
 
-        if args.title != None:
-            pyplot.title(args.title)
+    async def start_workers(self, count):
+        """Make sure that at least ``count`` worker REPLs are running and that
+           the ``preamble`` has been evaluated in each of them. New workers are
+           started at the same time, on other threads.
+        """
+        self.workers = [worker for worker in self.workers if worker.child.isalive()]
+        if len(self.workers) < count:
+            loop    = asyncio.get_running_loop()
+            started = [loop.run_in_executor(None, self.spawn_repl) for i in range(count - len(self.workers))]
+            self.send_debug_response("starting {} worker REPLs".format(len(started)))
+            for child, helper_loaded in await asyncio.gather(*started):
+                self.workers.append(Worker(child))
+        for worker in self.workers[:count]:
+            if worker.replayed < len(self.preamble):
+                await self.paste_output(self.preamble[worker.replayed:], worker.child)
+                worker.replayed = len(self.preamble)
+        return self.workers[:count]
 
-        x = self.do_quick('println({}().mkString("[", ",", "]"))'.format(args.x), True)
-#        x = [x] * len(x)
-        x = np.array(x)
-        
-        y = self.do_quick('println({}().mkString("[", ",", "]"))'.format(args.y), True)
- #       y = [y] * len(y)
-        y = np.array(y)
+    def stop_workers(self):
+        """Stop the worker REPLs."""
+        for worker in self.workers:
+            worker.terminate()
+        self.workers = []
 
-        x, y = np.meshgrid(x, y)
-        
-        z = self.do_quick('println({}().map(_.mkString("[", ",", "]")).mkString("[", ",", "]"))'.format(args.z), True)
-        z = np.array(z)
-
-        fig  = pyplot.figure()
-        ax   = fig.gca(projection='3d')
-        surf = ax.plot_surface(x, y, z)
-
-        pyplot.savefig(figfile, format='png')
-        pyplot.clf()
-        figfile.seek(0)        
-        figdata_png = base64.b64encode(figfile.getvalue()).decode('utf-8')
-        self.send_image_response("data:image/png;base64,{}".format(figdata_png))
-        
-    def send_plotm_response(self, plot_args):
-        """Generate a plot with ``matplotlib`` using-specified ScalaTion matrices
-           and options, converts it to PNG format, and sends it back to the
-           notebook as a templated response.
+    async def send_parallel_response(self, sweep_args, code_lines):
+        """Run the block ``code_lines`` once for each combination of the values
+           of the parameters in ``sweep_args`` (see ``parse_sweep``), spread
+           over worker REPLs, and send the output of each run as soon as it
+           is done. The workers are started with the same command as the REPL
+           and have the ``preamble`` replayed into them; they are kept for
+           later sweeps. The values of any ``--collect`` expressions are
+           gathered from each run and sent as a table.
         """
+        args    = parse_sweep(sweep_args)
+        runs    = sweep_runs(args.params)
+        started = time.perf_counter()
+        workers = await self.start_workers(min(args.workers, len(runs)))
 
-        self.send_debug_response("building a plotm (matrix plot)")
+        async def execute(worker, index, run):
+            with self.tracer.span('parallel.run'):
+                lines  = await self.paste_output(run_code(run, code_lines), worker.child)
+                failed = any(SCALA_ERROR.match(line) for line in lines)
+                values = []
+                for expr in args.collect:
+                    value = await self.paste_output(['println({})'.format(expr)], worker.child)
+                    values.append('\n'.join(value))
+            header = '[{}/{}] {}{}\n'.format(index + 1, len(runs), run_label(run), ' (failed)' if failed else '')
+            self.send_response(self.iopub_socket, 'stream', {'name': 'stderr' if failed else 'stdout', 'text': header})
+            self.send_output_response(lines)
+            return run, values, failed
 
-        from matplotlib import pyplot
-        pyplot.switch_backend('agg')
-        
-        from io import BytesIO
-        import argparse, ast, base64, shlex
-        
-        parser = argparse.ArgumentParser(add_help=False)
-        parser.add_argument('matrices', metavar='M', nargs='+')
-        parser.add_argument('--title')
-        parser.add_argument('--xlabel')
-        parser.add_argument('--ylabel')
-        parser.add_argument('--axis')
-        parser.add_argument('--//')
-        parser.add_argument('--/*')
-        parser.add_argument('--*/')
-        
-        args    = parser.parse_args(shlex.split(plot_args))
-        figfile = BytesIO()
+        try:
+            results = await run_sweep(workers, runs, execute)
+        except BaseException:
+            self.stop_workers()                       # in an unknown state
+            raise
+        parallel_dict = { 'params':  [name for name, values in args.params],
+                          'collect': args.collect,
+                          'rows':    results,
+                          'workers': len(workers),
+                          'seconds': time.perf_counter() - started,
+                          'failed':  sum(1 for run, values, failed in results if failed) }
+        self.send_template_response(parallel_template, parallel_dict)
 
-        if args.title != None:
-            pyplot.title(args.title)
+    async def fetch_vector(self, vector):
+        """Return the ScalaTion vector ``vector`` as a NumPy array. The data is
+           moved through the bulk data side channel (or, with the bridge
+           engine, attached to the result) when the helper is available;
+           otherwise, it is printed as text and evaluated. The
+           array is cached until ``vector`` is mentioned by Scala code.
+        """
+        import numpy as np
+        key  = ('vector', vector)
+        data = self.data_cache.get(key)
+        if data is not None:
+            return data
+        if self.helper_loaded and isinstance(self.child, BridgeREPL):
+            result = await self.bridge_evaluate(self.child, '{}.attachDoubles({}())'.format(HELPER_NAME, vector))
+            if result['status'] == 'ok' and len(result['frames']) == 1:
+                with self.tracer.span('transfer.read'):
+                    return self.data_cache.put(key, np.frombuffer(result['frames'][0], dtype='<f8').astype(float))
+        elif self.helper_loaded:
+            path = self.bulk.new_path()
+            size = await self.do_quick('println({}.writeDoubles({}(), {}))'.format(HELPER_NAME, vector, scala_string(path)), True)
+            if isinstance(size, int):
+                with self.tracer.span('transfer.read'):
+                    return self.data_cache.put(key, self.bulk.read(path, (size,)))
+        data = await self.do_quick('println({}().mkString("[", ",", "]"))'.format(vector), True)
+        return self.data_cache.put(key, np.array(data, dtype=float))
 
-        if args.xlabel != None:
-            pyplot.xlabel(args.xlabel)
+    async def fetch_matrix(self, matrix):
+        """Return the ScalaTion matrix ``matrix`` as a 2-D NumPy array."""
+        return (await self.fetch_matrix_slice(matrix))[0]
 
-        if args.ylabel != None:
-            pyplot.ylabel(args.ylabel)
+    async def fetch_matrix_slice(self, matrix, rows=slice(None), cols=slice(None), max_rows=None):
+        """Return the ``rows`` and ``cols`` slices of the ScalaTion matrix
+           ``matrix`` as a 2-D NumPy array, along with the indices of the rows
+           that were kept. If ``max_rows`` is given, the row step is widened so
+           that at most that many rows are returned. The whole slice is moved
+           in one call through the bulk data side channel when the helper is
+           available; otherwise, the matrix is printed as text, evaluated and
+           sliced. The slice is cached until ``matrix`` is mentioned by Scala
+           code.
+        """
+        import numpy as np
+        args  = slice_args(rows) + slice_args(cols) + (max_rows or 0,)
+        key   = ('matrix', matrix) + args
+        found = self.data_cache.get(key)
+        if found is not None:
+            return found
+        if self.helper_loaded:
+            path  = self.bulk.new_path()
+            code  = 'println({}.writeMatrix({}(), {}, {}, {}, {}, {}, {}, {}, {}))'
+            shape = await self.do_quick(code.format(HELPER_NAME, matrix, scala_string(path), *args))
+            shape = shape.split()
+            if len(shape) == 4 and all(dim.isdigit() for dim in shape):
+                nrows, ncols, first, step = (int(dim) for dim in shape)
+                index = first + step * np.arange(nrows)
+                with self.tracer.span('transfer.read'):
+                    return self.data_cache.put(key, (self.bulk.read(path, (nrows, ncols)), index))
+        data  = await self.do_quick('println({}().map(_.mkString("[", ",", "]")).mkString("[", ",", "]"))'.format(matrix), True)
+        data  = np.array(data, dtype=float).reshape(len(data), -1)
+        index = np.arange(data.shape[0])[rows]
+        data  = data[rows, cols]
+        if max_rows and data.shape[0] > max_rows:
+            stride = -(-data.shape[0] // max_rows)
+            data, index = data[::stride], index[::stride]
+        return self.data_cache.put(key, (data, index))
 
-        if args.axis != None:            
-            pyplot.axis(args.axis)
-            
-        for mat in args.matrices:
-            self.send_debug_response("building a plotm for <code>{}</code>".format(mat))
-            dim2 = self.do_quick('println({}.dim2)'.format(mat), True)
-            for col in range(0, dim2):
-                self.send_debug_response("building column <code>{}</code> for <code>{}</code>".format(col, mat))
-                col_data = self.do_quick('println({}.col({})().mkString("[", ",", "]"))'.format(mat, col), True)
-                pyplot.plot(col_data)
-
-        pyplot.savefig(figfile, format='png')
-        pyplot.clf()
-        figfile.seek(0)        
-        figdata_png = base64.b64encode(figfile.getvalue()).decode('utf-8')
-        self.send_image_response("data:image/png;base64,{}".format(figdata_png))
-        
-    def send_plotv_response(self, plot_args):
-        """Generate a plot with ``matplotlib`` using-specified ScalaTion vectors
-           and options, converts it to PNG format, and sends it back to the
-           notebook as a templated response.
+    async def fetch_rows(self, relation, start, stop, cols):
+        """Return rows ``start`` until ``stop`` of the ScalaTion relation
+           ``relation`` as lists of strings, keeping only the columns whose
+           indices are in ``cols``. The rows are moved through the bulk data
+           side channel when the helper is available; otherwise, they are
+           printed as text and evaluated. The rows are cached until
+           ``relation`` is mentioned by Scala code.
+        """
+        key  = ('rows', relation, start, stop, tuple(cols))
+        data = self.data_cache.get(key)
+        if data is not None:
+            return data
+        rows = '({} until {}).map({}.row(_))'.format(start, stop, relation)
+        if self.helper_loaded:
+            path  = self.bulk.new_path()
+            code  = 'println({}.writeRows({}, Array[Int]({}), {}))'
+            nrows = await self.do_quick(code.format(HELPER_NAME, rows, ','.join(str(col) for col in cols), scala_string(path)), True)
+            if isinstance(nrows, int):
+                with self.tracer.span('transfer.read'):
+                    return self.data_cache.put(key, self.bulk.read_rows(path, nrows, len(cols)))
+        data = await self.do_quick('println({}.map(_.mkString("[\'", "\',\'", "\']")).mkString("[", ",", "]"))'.format(rows), True)
+        return self.data_cache.put(key, [[row[col] for col in cols] for row in data or []])
 
-        NOTE:
-            With the current implementation, an ``argparse`` exception may cause
-            the kernel to restart. If this happens, the user must re-evaluate
-            past cells in the notebook. A solution is being considered for the
-            next major release.
+    async def scala_kind(self, name):
+        """Return the kind of the ScalaTion object ``name``: ``'vector'``,
+           ``'matrix'`` or ``'relation'``.
+        """
+        output = await self.do_quick('println({}.getClass.getName)'.format(name))
+        self.check_output(output)
+        for kind, marker in [('relation', 'Relation'), ('matrix', 'Matrix'), ('vector', 'Vector')]:
+            if marker in output:
+                return kind
+        raise ValueError('{} is a {}, not a vector, matrix or relation'.format(name, output.strip()))
 
-        TODO:
-            Current support is minimal. Ideally, we would like to support all or
-            most plot types provided by ``matplotlib``.
+    def check_output(self, output):
+        """Raise ``ValueError`` with the first error in the REPL's ``output``,
+           if it reports one.
         """
+        for line in output.splitlines():
+            if SCALA_ERROR.match(line):
+                raise ValueError(line.strip())
 
-        self.send_debug_response("building a plotv (vector plot)")
+    async def send_export_response(self, export_args):
+        """Export the ScalaTion vector, matrix or relation ``NAME`` to ``FILE``
+           in the NPY (vectors and matrices) or CSV format. The helper writes
+           the file directly, so no data passes through the terminal.
+        """
+        args = parse_command_args(export_parser(), export_args)
+        if not self.helper_loaded:
+            raise ValueError('{} needs the {} helper'.format(CMD_EXPORT, HELPER_NAME))
+        path   = os.path.abspath(os.path.expanduser(args.path))
+        format = exchange_format(path, args.format)
+        kind   = await self.scala_kind(args.name)
+        target = scala_string(path)
+        if format == 'npy' and kind == 'relation':
+            raise ValueError('relations can only be exported as CSV')
+        elif format == 'npy':
+            code = 'println({}.writeNPY({}(), {}))'.format(HELPER_NAME, args.name, target)
+        elif kind == 'vector':
+            code = 'println({}.writeCSV({}().iterator.map(Seq(_)), Seq(), {}))'.format(HELPER_NAME, args.name, target)
+        elif kind == 'matrix':
+            code = 'println({}.writeCSV({}().iterator.map(_.toSeq), Seq(), {}))'.format(HELPER_NAME, args.name, target)
+        else:
+            code = 'println({0}.writeCSV((0 until {1}.rows).iterator.map({1}.row(_)), {1}.colName, {2}))'
+            code = code.format(HELPER_NAME, args.name, target)
+        with self.tracer.span('transfer.export'):
+            output = await self.do_quick(code)
+        self.check_output(output)
+        shape = output.split()
+        size  = ' x '.join(shape) if format == 'npy' else '{} rows'.format(output.strip())
+        text  = 'exported {} {} ({}) to {}\n'.format(kind, args.name, size, path)
+        self.send_response(self.iopub_socket, 'stream', {'name': 'stdout', 'text': text})
 
-        from matplotlib import pyplot
-        pyplot.switch_backend('agg')
-        
-        from io import BytesIO
-        import argparse, ast, base64, shlex
-        import numpy as np        
-        
-        parser = argparse.ArgumentParser(add_help=False)
-        parser.add_argument('vectors', metavar='VectorD', nargs='+', help='a ScalaTion vector')
-        parser.add_argument('--title', help='plot title')
-        parser.add_argument('--xlabel', help='x-axis label')
-        parser.add_argument('--ylabel', help='y-axis label')
-        parser.add_argument('--axis')
-        parser.add_argument('--bar', action='store_false', default=None)
-        parser.add_argument('--xkcd', action='store_false', default=None)
-        parser.add_argument('--scatter', action='store_false', default=None)
-        
-        args    = parser.parse_args(shlex.split(plot_args))
-        figfile = BytesIO()
-
-        if args.title != None:
-            pyplot.title(args.title)
-
-        if args.xlabel != None:
-            pyplot.xlabel(args.xlabel)
-
-        if args.ylabel != None:
-            pyplot.ylabel(args.ylabel)
-
-        if args.axis != None:
-            
-            pyplot.axis(args.axis)
-            
-        for v in args.vectors:
-            y = self.do_quick('println({}().mkString("[", ",", "]"))'.format(v), True)
-            x = np.arange(len(y))
-            vec = self.do_quick('println({}().mkString("[", ",", "]"))'.format(v), True)
-        
-        if args.xkcd != None:
-            with pyplot.xkcd():
-                fig1 = pyplot.figure()
-                pyplot.plot(vec)
-
-        if (args.xkcd != None) & (args.scatter != None):
-            with pyplot.xkcd():
-                fig1 = pyplot.figure()
-                pyplot.scatter(x,y)
-
-        if (args.xkcd != None) & (args.bar != None):
-            with pyplot.xkcd():
-                fig2 = pyplot.figure()
-                pyplot.bar(x,y)
-
-        if args.scatter != None:
-            pyplot.scatter(x,y)
-        if args.bar != None:
-            pyplot.bar(x,y)
+    async def send_import_response(self, import_args):
+        """Import the NPY or CSV file ``FILE`` into the REPL as the ScalaTion
+           vector, matrix or relation ``NAME``. The helper reads the numbers
+           directly from the file (or, if they need to be converted first,
+           from a converted copy in the bulk data side channel), so no data
+           passes through the terminal. ``NAME`` is defined using ``lazy val``
+           and then forced, so the REPL never prints its value.
+        """
+        args = parse_command_args(import_parser(), import_args)
+        if not self.helper_loaded:
+            raise ValueError('{} needs the {} helper'.format(CMD_IMPORT, HELPER_NAME))
+        path   = os.path.abspath(os.path.expanduser(args.path))
+        format = exchange_format(path, args.format)
+        if not os.path.isfile(path):
+            raise ValueError('no such file: {}'.format(path))
+        source = None
+        try:
+            with self.tracer.span('transfer.import'):
+                if format == 'npy':
+                    source, offset, shape = npy_doubles(path, self.bulk.new_path())
+                    kind = args.kind or ('vector' if len(shape) == 1 else 'matrix')
+                else:
+                    kind = args.kind or 'relation'
+                    if kind != 'relation':
+                        source, offset = self.bulk.new_path(), 0
+                        shape = csv_doubles(path, source)
+                if kind == 'vector':
+                    if len(shape) == 2 and 1 not in shape:
+                        raise ValueError('{} holds a {} x {} matrix, not a vector'.format(path, *shape))
+                    size = shape[0] if len(shape) == 1 else shape[0] * shape[1]
+                    code = 'lazy val {} = new scalation.linalgebra.VectorD({}, {}.readDoubles({}, {}L, {}))'
+                    code = code.format(args.name, size, HELPER_NAME, scala_string(source), offset, size)
+                    dims = 'dim'
+                elif kind == 'matrix':
+                    if len(shape) != 2:
+                        raise ValueError('{} holds a vector, not a matrix'.format(path))
+                    code = 'lazy val {} = new scalation.linalgebra.MatrixD({}, {}, {}.readMatrix({}, {}L, {}, {}))'
+                    code = code.format(args.name, shape[0], shape[1], HELPER_NAME, scala_string(source), offset, *shape)
+                    dims = 'dim1'
+                else:
+                    if format != 'csv':
+                        raise ValueError('relations can only be imported from CSV')
+                    domain = args.domain or csv_domain(path)
+                    code   = 'lazy val {} = scalation.columnar_db.Relation({}, {}, 0, {}, ",")'
+                    code   = code.format(args.name, scala_string(path), scala_string(args.name), scala_string(domain))
+                    dims   = 'rows'
+                output = await self.do_quick([code, 'println({}.{})'.format(args.name, dims)])
+        finally:
+            if source != None and source != path and os.path.exists(source):
+                os.remove(source)
+        self.check_output(output)
+        self.data_cache.invalidate(args.name)
+        for line in output.splitlines():
+            self.names.record(line)
+        count = output.splitlines()[-1] if output.strip() != '' else '?'
+        text  = 'imported {} {} ({} {}) from {}\n'.format(kind, args.name, count, 'rows' if kind != 'vector' else 'values', path)
+        self.send_response(self.iopub_socket, 'stream', {'name': 'stdout', 'text': text})
+
+    async def send_prettyr_response(self, prettyr_args):
+        """Send a response with a prettier version of one page of a
+           ``Relation``. Only the requested page is fetched, in chunks of
+           ``RELATION_CHUNK`` rows, and rendered. With ``--dataresource``, the
+           page is also sent as ``application/vnd.dataresource+json`` so that
+           the frontend can render it as a virtualized table.
+        """
+        self.send_debug_response("building a prettier relation for <code>{}</code>".format(prettyr_args))
+
+        args     = parse_command_args(relation_parser(), prettyr_args)
+        relation = args.relation
+        info     = self.data_cache.get(('relation', relation))
+        if info is None:
+            info = await self.do_quick('println(Seq({0}.name, {0}.rows, {0}.colName.mkString("\\t")).mkString("\\n"))'.format(relation))
+            lines = info.split('\n', 2)
+            if any(SCALA_ERROR.match(line) for line in info.splitlines()) or len(lines) < 2 or not lines[1].strip().isdigit():
+                raise ValueError('no relation named {}'.format(relation))
+            info = self.data_cache.put(('relation', relation), info)
+        info     = info.split('\n', 2) + ['']
+        name     = info[0]
+        total    = int(info[1])
+        colNames = info[2].split('\t') if info[2] != '' else []
+
+        if args.columns != None:
+            columns = [col.strip() for col in args.columns.split(',')]
+            unknown = [col for col in columns if col not in colNames]
+            if len(unknown) > 0:
+                raise ValueError('unknown columns in {}: {}'.format(relation, ', '.join(unknown)))
+            cols = [colNames.index(col) for col in columns]
+        else:
+            cols = list(range(len(colNames)))
+
+        offset = min(max(args.offset, 0), total)
+        stop   = min(offset + max(args.limit, 0), total)
+        data   = []
+        for start in range(offset, stop, RELATION_CHUNK):
+            data.extend(await self.fetch_rows(relation, start, min(start + RELATION_CHUNK, stop), cols))
+
+        prettyr_dict = { 'name':     name,
+                         'colNames': [colNames[col] for col in cols],
+                         'data':     data,
+                         'offset':   offset,
+                         'total':    total }
+        rendered = self.render_template(prettyr_template, prettyr_dict)
+        if args.dataresource:
+            fields = prettyr_dict['colNames']
+            self.send_display_response({
+                'text/html': rendered,
+                'application/vnd.dataresource+json': {
+                    'schema': { 'fields': [{'name': field, 'type': 'string'} for field in fields] },
+                    'data':   [dict(zip(fields, row)) for row in data]
+                }
+            })
         else:
-            pyplot.plot(vec)
+            self.send_html_response(rendered)
+
+    def do_ast_eval(self, expression):
+        """Evaluate an expression as Python code."""
+        import ast
+        try:
+            with self.tracer.span('transfer.parse'):
+                return ast.literal_eval(expression)
+        except Exception as e:
+            debug_message = "problem calling <code>ast.literal_eval</code> with <code>{}</code>. {}".format(expression, str(e))
+            self.send_debug_response(debug_message)
+            return None
+
+    def send_figure_response(self, kind, args, arrays):
+        """Render the figure for the plot command ``kind`` from ``args`` and
+           ``arrays`` (see ``render_arrays``) in the render pool and send it as
+           a PNG or, with ``--interactive``, a Vega-Lite plot. A placeholder is
+           displayed right away and updated once the figure is ready, so the
+           rest of the cell keeps running (e.g., sending code to the REPL or
+           rendering other figures) in the meantime. The cell waits for its
+           figures before it finishes.
+        """
+        display_id = uuid.uuid4().hex
+        self.send_display_response({'text/plain': '<Figure (rendering)>'}, display_id=display_id)
+        self.renders.append(asyncio.ensure_future(self.render_figure(kind, args, arrays, display_id)))
+
+    async def render_figure(self, kind, args, arrays, display_id):
+        """Render a figure in the render pool and update the display
+           ``display_id`` with it.
+        """
+        with self.tracer.span('plot.render'):
+            figure = await self.renderer.render(kind, args, arrays)
+        self.send_display_response(figure, display_id=display_id, update=True)
+
+    async def wait_renders(self):
+        """Wait for the figures that the current cell is rendering."""
+        renders, self.renders = self.renders, []
+        await asyncio.gather(*renders)
 
-        pyplot.savefig(figfile, format='png')
-        pyplot.clf()
-        figfile.seek(0)        
-        figdata_png = base64.b64encode(figfile.getvalue()).decode('utf-8')
-        self.send_image_response("data:image/png;base64,{}".format(figdata_png))
+    def cancel_renders(self):
+        """Stop waiting for the figures that the current cell is rendering."""
+        for render in self.renders:
+            render.cancel()
+        self.renders = []
+
+    async def send_plot3d_response(self, plot_args):
+        """Generate a surface plot of a ScalaTion matrix over the grid given by
+           two ScalaTion vectors and send it back to the notebook as a PNG (or,
+           with ``--interactive``, as a heat map that can be zoomed).
+        """
+        self.send_debug_response("building a plot3d (matrix plot)")
+        args = parse_command_args(plot3d_parser(), plot_args)
+        x    = await self.fetch_vector(args.x)
+        y    = await self.fetch_vector(args.y)
+        z    = await self.fetch_matrix(args.z)
+        self.send_figure_response('plot3d', args, [x, y, z])
+
+    async def send_plotm_response(self, plot_args):
+        """Generate a plot of the columns of ScalaTion matrices and send it
+           back to the notebook as a PNG or an interactive plot. Only the
+           requested slice of each matrix is fetched.
+        """
+        self.send_debug_response("building a plotm (matrix plot)")
+        args     = parse_command_args(plotm_parser(), plot_args)
+        matrices = []
+        for mat in args.matrices:
+            self.send_debug_response("building a plotm for <code>{}</code>".format(mat))
+            matrices.append(await self.fetch_matrix_slice(mat, args.rows, args.cols, args.max_points))
+        self.send_figure_response('plotm', args, [array for matrix in matrices for array in matrix])
+
+    async def send_plotv_response(self, plot_args):
+        """Generate a line, scatter or bar plot of ScalaTion vectors and send it
+           back to the notebook as a PNG or an interactive plot. Each vector is
+           fetched exactly once and downsampled to ``--max-points`` points
+           (per level of detail, if interactive) before it is drawn.
+        """
+        self.send_debug_response("building a plotv (vector plot)")
+        args    = parse_command_args(plotv_parser(), plot_args)
+        vectors = [await self.fetch_vector(v) for v in args.vectors]
+        self.send_figure_response('plotv', args, vectors)
 
     def send_json_response(self, json_content):
-        """Send a JSON response."""
-        html = {
-            'data': {
-                'text/json': '{}'.format(json_content)
-            },
-            'metadata': {}
-        }
-        self.send_response(self.iopub_socket, 'display_data', html)
+        """Send a JSON response, or a plain text response if ``json_content``
+           is not valid JSON.
+        """
+        try:
+            data = {'application/json': json.loads(json_content)}
+        except ValueError:
+            data = {}
+        data['text/plain'] = '{}'.format(json_content)
+        self.send_display_response(data)
         
     def send_image_response(self, image_content):
-        """Send an image response."""
-        self.send_html_response('<img src="{}"/>'.format(image_content))
+        """Send an image response. If ``image_content`` is a Base64 data URI,
+           the image is sent as its own MIME type; otherwise, it is sent as the
+           source of an HTML image.
+        """
+        data_uri = re.match(r'data:(image/[\w.+-]+);base64,(.*)$', image_content.strip(), re.S)
+        if data_uri == None:
+            self.send_html_response('<img src="{}"/>'.format(image_content))
+        elif data_uri.group(1) == 'image/svg+xml':
+            self.send_display_response({'image/svg+xml': base64.b64decode(data_uri.group(2)).decode('utf-8')})
+        else:
+            self.send_display_response({data_uri.group(1): data_uri.group(2)})
 
     def send_debug_response(self, debug_message):
         """If ``debug_mode`` is enabled, send a debug response."""
         if self.debug_mode:
-            import datetime, time, inspect, uuid
-            debug_stack = inspect.stack()[1:]
+            import datetime, sys, traceback, uuid
+            debug_stack = traceback.StackSummary.extract(traceback.walk_stack(sys._getframe(1)), lookup_lines=False).format()
             debug_dict  = { 'timestamp': str(datetime.datetime.utcnow()),
                             'stack': debug_stack,
                             'message': debug_message,
                             'uuid': uuid.uuid4() }
             self.send_template_response(debug_template, debug_dict)
                 
-    def do_execute(self, code, silent, store_history=True, user_expressions=None, allow_stdin=False):
-        """Execute user ``code``, one line at a time.
+    def send_output_response(self, lines):
+        """Send REPL output ``lines``, searching for kernel-specific output
+           prefixes and parsing the output appropriately if one is found.
+        """
+        if len(lines) > 0:                        # more than one line in output?
+            if lines[0].startswith(IMAG_PREFIX):
+                lines = '\n'.join(lines) + '\n'   # rejoin lines
+                lines = lines[len(IMAG_PREFIX):]  # strip prefix
+                self.send_image_response(lines)
+            elif lines[0].startswith(HTML_PREFIX):
+                lines = '\n'.join(lines) + '\n'   # rejoin lines
+                lines = lines[len(HTML_PREFIX):]  # strip prefix
+                self.send_html_response(lines)
+            elif lines[0].startswith(JSON_PREFIX):
+                lines = '\n'.join(lines) + '\n'   # rejoin lines
+                lines = lines[len(JSON_PREFIX):]  # strip prefix
+                self.send_json_response(lines)
+            else:
+                lines = '\n'.join(lines) + '\n'   # rejoin lines
+                stream_content = {'name': 'stdout', 'text': '{}'.format(lines)}
+                self.send_response(self.iopub_socket, 'stream', stream_content)
 
-           If a line begins with a kernel-specific command (e.g., ```::plotv```,
-           ```::debug_mode```, etc.), then it is executed immediately; 
-           otherwise, the kefrnel assumes that the line contains Scala code and 
-           sends it to the Scala REPL via the kernel's ``pexepct.spawnu`` 
-           instance. As output is returned, the kernel searches for 
-           kernel-specific output prefixes, and if found, parses the output 
-           appropriately using corresponding templates before sending the 
-           response; otherwise, all of the output it returned as is.
+    async def do_line(self, code_line):
+        """Execute a single line of Scala code and stream its output. Since the
+           line may continue on the next one, it cannot be framed by sentinel
+           markers, so its output ends at the next (main or continue) prompt.
+        """
+        if isinstance(self.child, BridgeREPL):
+            await self.do_bridge([code_line], op='line')
+            return
+        with self.tracer.span('repl.send'):
+            self.child.sendline(code_line)            # send the line
+        await self.do_stream(echoed=[code_line])      # until the next prompt
 
-           TODO:
-               Currently, the ``silent`` parameter does not function as
-               described by ``ipykernel.kernelbase.Kernel``. We intend to fix
-               this in the next minor release (which is 1.2).
+    async def do_block(self, code_lines):
+        """Execute a contiguous block of Scala code lines and send its output.
+           In ``batch_mode`` the block is sent to the REPL as a single unit;
+           otherwise, it is sent one line at a time. Cached data that the block
+           may rebind or modify is invalidated first. If the block evaluates
+           without errors, its imports and definitions are added to the
+           ``preamble``. A block of only imports and definitions is loaded
+           from the compiled definition cache, if it is there, or compiled
+           into it in the background, once it has been evaluated.
         """
+        if all(line.strip() == '' for line in code_lines):
+            return
+        self.repl_error = False
+        self.data_cache.invalidate('\n'.join(code_lines))
+        key = None
+        if RESTORE_ENABLED and self.sessions and is_definition_block(code_lines):
+            key   = self.definitions.key(self.preamble, code_lines)
+            entry = self.definitions.find(key)
+            if entry != None and await self.restore_definitions(entry):
+                self.add_definitions(definition_lines(code_lines), key)
+                return
+        if self.batch_mode:
+            await self.do_paste(code_lines)
+        else:
+            for code_line in code_lines:
+                await self.do_line(code_line)
+        if not self.repl_error:
+            if key != None:
+                self.compile_definitions(key, code_lines)
+            self.add_definitions(definition_lines(code_lines), key)
 
-        if not silent:
-            for code_line in code.splitlines():
+    def add_definitions(self, code_lines, key=None, save=True):
+        """Add the imports and definitions in ``code_lines`` to the
+           ``preamble`` and to the session's ``segments`` (as compiled
+           definitions, if ``key`` is given) and, if ``save``, save the
+           segments as the session's manifest (unless the kernel does not
+           keep ``sessions``).
+        """
+        if len(code_lines) == 0:
+            return
+        self.preamble.extend(code_lines)
+        if key == None and len(self.segments) > 0 and self.segments[-1]['key'] == None:
+            self.segments[-1]['lines'].extend(code_lines)
+        else:
+            self.segments.append({'key': key, 'lines': list(code_lines)})
+        if save and self.sessions:
+            self.definitions.save_session(self.segments)
 
-                self.send_debug_response("executing line: <code>{}</code>".format(code_line))
+    def compile_definitions(self, key, code_lines):
+        """Queue the definitions in ``code_lines``, which were evaluated after
+           the current ``preamble``, to be compiled into the compiled
+           definition cache for ``key``. The queue is compiled in order, in the
+           background, once no definitions have been queued for
+           ``RESTORE_DELAY`` seconds, so each can use the ones compiled before
+           it. If the latest queued definitions define the same names (e.g.,
+           the same cell was edited and run again), they are replaced.
+        """
+        keys  = [segment['key'] for segment in self.segments if segment['key'] != None]
+        names = defined_names(code_lines)
+        if len(names) > 0 and len(self.uncompiled) > 0 and defined_names(self.uncompiled[-1][2]) == names:
+            self.uncompiled.pop()
+        self.uncompiled.append((key, list(self.preamble), code_lines, keys))
+        self.compile_at = time.monotonic() + RESTORE_DELAY
+        if self.compiling == None or self.compiling.done():
+            self.compiling = asyncio.ensure_future(self.compile_queued())
 
-                if code_line.startswith(CMD_DEBUG):
-                    self.toggle_debug_mode()
+    async def compile_queued(self):
+        """Compile the queued definitions (see ``compile_definitions``), one
+           at a time, waiting until the session is idle before each one.
+        """
+        while len(self.uncompiled) > 0:
+            while time.monotonic() < self.compile_at:
+                await asyncio.sleep(self.compile_at - time.monotonic())
+            key, preamble, code_lines, keys = self.uncompiled.pop(0)
+            deps  = [entry for entry in map(self.definitions.find, keys) if entry != None]
+            entry = await self.definitions.compile(key, preamble, code_lines, deps)
+            self.send_debug_response("compiled definitions {}: {}".format(key, entry != None))
 
-                elif code_line.startswith(CMD_PRETTYR):
-                    self.send_prettyr_response(code_line[len(CMD_PRETTYR):].strip())
-                    
-                elif code_line.startswith(CMD_PLOTV):
-                    self.send_plotv_response(code_line[len(CMD_PLOTV):])
+    async def restore_definitions(self, entry, quiet=False):
+        """Load the compiled definitions described by ``entry`` (see
+           ``DefinitionCache.find``) into the REPL by adding its jar, and the
+           jars that it depends on, to the classpath and importing the members
+           of its wrapper object. Unless ``quiet``, the restored names are
+           listed. Return whether or not the definitions were loaded.
+        """
+        keys = [key for key in entry['deps'] + [entry['key']] if key not in self.required]
+        code = [':require {}'.format(self.definitions.path(key)) for key in keys]
+        code = code + ['import {}._'.format(entry['wrapper'])] + entry['imports']
+        with self.tracer.span('restore.load'):
+            output = await self.do_quick(code)
+        if any(SCALA_ERROR.match(line) for line in output.splitlines()):
+            self.send_debug_response("could not restore definitions {}".format(entry['key']))
+            return False
+        self.required.update(keys)
+        for kind, name in entry['names']:
+            self.names.define(name, 'type alias' if kind == 'type' else kind)
+        if not quiet:
+            names = ', '.join('{} {}'.format(kind, name) for kind, name in entry['names'])
+            text  = 'restored {} (compiled)\n'.format(names)
+            self.send_response(self.iopub_socket, 'stream', {'name': 'stdout', 'text': text})
+        return True
+
+    async def replay_segments(self, segments):
+        """Quietly evaluate the imports and definitions in ``segments``, in
+           order, loading compiled definitions from the cache where possible.
+           Return how many segments were loaded from the cache.
+        """
+        loaded, pending = 0, []
+        for segment in segments:
+            entry = self.definitions.find(segment['key']) if segment['key'] != None else None
+            if entry != None and len(pending) > 0:
+                await self.do_paste(pending, quiet=True)
+                pending = []
+            if entry != None and await self.restore_definitions(entry, quiet=True):
+                loaded += 1
+            else:
+                pending.extend(segment['lines'])
+        if len(pending) > 0:
+            await self.do_paste(pending, quiet=True)
+        return loaded
 
-                elif code_line.startswith(CMD_PLOTM):
-                    self.send_plotm_response(code_line[len(CMD_PLOTM):])
+    async def send_resources_response(self, resources_args):
+        """Send the JVM's heap usage, garbage collection and CPU time, along
+           with the resident set sizes of the REPL's process and the kernel's,
+           both as a table and as JSON, so that notebooks run in batch can
+           record them.
+        """
+        if resources_args.strip() != '':
+            raise ValueError('usage: {}'.format(CMD_RESOURCE))
+        if not self.helper_loaded:
+            raise ValueError('{} needs the {} helper'.format(CMD_RESOURCE, HELPER_NAME))
+        output = await self.do_quick('println({}.resources())'.format(HELPER_NAME))
+        self.check_output(output)
+        try:
+            jvm = json.loads(output)
+        except ValueError:
+            raise ValueError('could not read the resources of the REPL: {}'.format(output.strip()))
+        jvm_rss, jvm_peak       = process_memory(self.child.pid)
+        kernel_rss, kernel_peak = process_memory(os.getpid())
+        times = os.times()
+        resources_dict = { 'profile':     SCALA_PROFILE['name'],
+                           'jvm':         jvm,
+                           'jvm_rss':     jvm_rss,
+                           'jvm_peak':    jvm_peak,
+                           'kernel_rss':  kernel_rss,
+                           'kernel_peak': kernel_peak,
+                           'kernel_cpu':  times.user + times.system }
+        html = self.render_template(resources_template, dict(resources_dict, mib=mebibytes))
+        self.send_display_response({'text/html': html, 'application/json': resources_dict})
 
-                elif code_line.startswith(CMD_PLOT3D):
-                    self.send_plot3d_response(code_line[len(CMD_PLOT3D):])
+    async def send_restore_response(self, restore_args):
+        """Restore the imports and definitions of the previous session that
+           ran in the current directory, loading the compiled ones from the
+           cache, or, given ``clear``, empty the compiled definition cache.
+        """
+        args = restore_args.split()
+        if args == ['clear']:
+            count, size = self.definitions.entries()
+            self.definitions.clear()
+            text = 'removed {} compiled definitions ({:.1f} MiB)\n'.format(count, size / 2 ** 20)
+        elif len(args) > 0:
+            raise ValueError('usage: {} [clear]'.format(CMD_RESTORE))
+        elif len(self.segments) > 0:
+            raise ValueError('{} must run before anything is defined in the session'.format(CMD_RESTORE))
+        else:
+            segments = self.definitions.load_session()
+            self.repl_error = False
+            with self.tracer.span('restore.session'):
+                loaded = await self.replay_segments(segments)
+            for segment in segments:
+                self.add_definitions(segment['lines'], segment['key'], save=False)
+            if self.sessions:
+                self.definitions.save_session(self.segments)
+            text = 'restored {} blocks of definitions ({} compiled){}\n'.format(
+                len(segments), loaded, ', with errors' if self.repl_error else '')
+        self.send_response(self.iopub_socket, 'stream', {'name': 'stdout', 'text': text})
 
-                else:
+    def send_error_response(self, ename, evalue):
+        """Send an error response and return the corresponding reply."""
+        error_content = {'ename': ename, 'evalue': evalue, 'traceback': ['{}: {}'.format(ename, evalue)]}
+        self.send_response(self.iopub_socket, 'error', error_content)
+        error_content.update({'status': 'error', 'execution_count': self.execution_count})
+        return error_content
+
+    async def execute_cell(self, code):
+        """Execute the lines of a cell, flushing each block of Scala code to the
+           REPL whenever a kernel-specific command is reached. The lines after
+           ``::parallel`` are its block, rather than code for the REPL.
+        """
+        block = []                                    # pending scala lines
+        lines = code.splitlines()
+        for i, code_line in enumerate(lines):
+
+            if not code_line.startswith(CMD_PREFIX):
+                block.append(code_line)
+                continue
+
+            await self.do_block(block)                # flush pending block
+            block = []
+
+            self.send_debug_response("executing line: <code>{}</code>".format(code_line))
+
+            if code_line.startswith(CMD_DEBUG):
+                self.toggle_debug_mode()
+
+            elif code_line.startswith(CMD_BATCH):
+                self.toggle_batch_mode()
+
+            elif code_line.startswith(CMD_TIMEOUT):
+                self.set_timeout(code_line[len(CMD_TIMEOUT):])
+
+            elif code_line.startswith(CMD_TIMING):
+                self.toggle_timing_mode()
+
+            elif code_line.startswith(CMD_STATS):
+                self.send_stats_response()
+
+            elif code_line.startswith(CMD_TRACE):
+                self.write_trace(code_line[len(CMD_TRACE):])
+
+            elif code_line.startswith(CMD_PARALLEL):
+                await self.send_parallel_response(code_line[len(CMD_PARALLEL):], lines[i + 1:])
+                break                                 # the rest is the sweep's block
+
+            elif code_line.startswith(CMD_EXPORT):
+                await self.send_export_response(code_line[len(CMD_EXPORT):])
+
+            elif code_line.startswith(CMD_IMPORT):
+                await self.send_import_response(code_line[len(CMD_IMPORT):])
+
+            elif code_line.startswith(CMD_RESOURCE):
+                await self.send_resources_response(code_line[len(CMD_RESOURCE):])
+
+            elif code_line.startswith(CMD_RESTORE):
+                await self.send_restore_response(code_line[len(CMD_RESTORE):])
+
+            elif code_line.startswith(CMD_CACHE):
+                self.send_cache_response(code_line[len(CMD_CACHE):])
+
+            elif code_line.startswith(CMD_PRETTYR):
+                await self.send_prettyr_response(code_line[len(CMD_PRETTYR):].strip())
                 
-                    self.child.sendline(code_line)                # send the line
-                    nrows  = ceil(len(code_line) / 80)            # how many times is the input split by pexpect?
-                    prompt = self.child.expect(SCALA_PROMPT)      # check for prompt
-                    if SCALA_PROMPT[prompt] == SCALA_PROMPT_MAIN: # back to the main prompt?
-                        output = self.child.before                # get entire output
-                        lines  = output.splitlines()              # breakup into lines
-                        lines  = lines[nrows:-1]                  # ignore input lines and last line
-                        if len(lines) > 0:                        # more than one line in output?
-                            if lines[0].startswith(IMAG_PREFIX):
-                                lines = '\n'.join(lines) + '\n'   # rejoin lines
-                                lines = lines[len(IMAG_PREFIX):]  # strip prefix
-                                self.send_image_response(lines)
-                            elif lines[0].startswith(HTML_PREFIX):  
-                                lines = '\n'.join(lines) + '\n'   # rejoin lines
-                                lines = lines[len(HTML_PREFIX):]  # strip prefix
-                                self.send_html_response(lines)
-                            elif lines[0].startswith(JSON_PREFIX):                            
-                                lines = '\n'.join(lines) + '\n'   # rejoin lines
-                                lines = lines[len(JSON_PREFIX):]  # strip prefix
-                                self.send_json_response(lines)
-                            else:
-                                lines = '\n'.join(lines) + '\n'   # rejoin lines
-                                stream_content = {'name': 'stdout', 'text': '{}'.format(lines)}
-                                self.send_response(self.iopub_socket, 'stream', stream_content)
-                                        
+            elif code_line.startswith(CMD_PLOTV):
+                await self.send_plotv_response(code_line[len(CMD_PLOTV):])
+
+            elif code_line.startswith(CMD_PLOTM):
+                await self.send_plotm_response(code_line[len(CMD_PLOTM):])
+
+            elif code_line.startswith(CMD_PLOT3D):
+                await self.send_plot3d_response(code_line[len(CMD_PLOT3D):])
+
+            else:
+                block.append(code_line)               # not a kernel command
+
+        await self.do_block(block)                    # flush final block
+        await self.wait_renders()                     # and wait for figures
+
+    async def do_complete(self, code, cursor_pos):
+        """Complete the name before ``cursor_pos`` in ``code`` using the symbol
+           index of ``SCALATION_JARS`` and the names defined in the session.
+           The REPL is not involved, so this never waits for a running cell.
+        """
+        matches, cursor_start = await self.completer.complete(code, cursor_pos)
+        return { 'status': 'ok',
+                 'matches': matches,
+                 'cursor_start': cursor_start,
+                 'cursor_end': cursor_pos,
+                 'metadata': {} }
+
+    async def do_inspect(self, code, cursor_pos, detail_level=0, omit_sections=()):
+        """Describe the name at ``cursor_pos`` in ``code`` using the symbol
+           index of ``SCALATION_JARS`` and the names defined in the session.
+        """
+        text = await self.completer.inspect(code, cursor_pos)
+        return { 'status': 'ok',
+                 'found': text != None,
+                 'data': {'text/plain': text} if text != None else {},
+                 'metadata': {} }
+
+    async def shell_main(self, subshell_id, msg):
+        """Dispatch a shell message. Completion, inspection and kernel info
+           requests (see ``SHELL_CONCURRENT``) never use the REPL, so they are
+           dispatched right away, even while a cell runs, the same way that
+           ipykernel dispatches comm messages. Every other message waits for
+           the running cell, as usual. ipykernel 6 does not call this method,
+           so with it, these requests wait for the running cell too.
+        """
+        if subshell_id == None and self.session != None and self._main_asyncio_lock.locked():
+            try:
+                idents, frames = self.session.feed_identities(msg, copy=False)
+                header = self.session.deserialize(frames, content=False, copy=False)['header']
+            except Exception:
+                header = {}
+            if header.get('msg_type') in SHELL_CONCURRENT:
+                parent = self.get_parent('shell')              # the running cell's
+                ident  = self._get_shell_context_var(self._shell_parent_ident)
+                try:
+                    await asyncio.create_task(self.dispatch_shell(msg, subshell_id=None, concurrent=True),
+                                              context=contextvars.copy_context())
+                finally:
+                    self.set_parent(ident, parent, channel='shell')
+                return
+        await Kernel.shell_main(self, subshell_id, msg)
+
+    async def run_job(self, job):
+        """Run the coroutine function ``job`` on the REPL's execution queue and
+           return its result. Jobs run one at a time, in the order in which
+           they were queued, on the event loop that queued the first job, so
+           the REPL is never used by two jobs at once, even when a job is
+           queued from another thread (e.g., by a subshell). Each job runs in
+           a copy of its caller's context, so its responses go to the caller's
+           parent message.
+        """
+        loop = asyncio.get_running_loop()
+        if self.jobs == None or self.jobs_loop.is_closed():
+            self.jobs_loop = loop
+            self.jobs      = asyncio.Queue()
+            self.jobs_task = loop.create_task(self.run_jobs())
+        queued = self.queue_job(job, contextvars.copy_context())
+        if loop is self.jobs_loop:
+            return await queued
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(queued, self.jobs_loop))
+
+    async def queue_job(self, job, context):
+        """Queue ``job`` to run in ``context`` and wait for its result."""
+        done = asyncio.get_running_loop().create_future()
+        await self.jobs.put((job, context, done))
+        return await done
+
+    async def run_jobs(self):
+        """Run the queued jobs, one at a time, for as long as the kernel runs."""
+        loop = asyncio.get_running_loop()
+        while True:
+            job, context, done = await self.jobs.get()
+            if done.cancelled():                      # caller gave up
+                continue
+            self.job = context.run(loop.create_task, job())
+            await asyncio.wait([self.job])
+            if self.job.cancelled():
+                done.cancel()
+            elif self.job.exception() != None:
+                done.set_exception(self.job.exception())
+            else:
+                done.set_result(self.job.result())
+            self.job = None
+
+    def handle_sigint(self, signum, frame):
+        """Cancel the running job when the kernel is interrupted (i.e., sent
+           ``SIGINT``). The job is cancelled by the event loop, so it stops at
+           its next ``await`` instead of wherever the signal lands.
+        """
+        job = self.job
+        if job != None:
+            self.jobs_loop.call_soon_threadsafe(job.cancel)
+
+    async def execute_job(self, code):
+        """Execute the cell ``code`` as a job and return its reply. While it
+           runs, an interrupt cancels it, which interrupts the REPL.
+        """
+        self.deadline = time.monotonic() + SCALA_TIMEOUT if SCALA_TIMEOUT else None
+        self.tracer.new_cell()
+        started = time.perf_counter()
+        on_main = self.sigint and threading.current_thread() is threading.main_thread()
+        sigint  = signal.signal(signal.SIGINT, self.handle_sigint) if on_main else None
+        try:
+            with self.tracer.span('cell'):
+                await self.execute_cell(code)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            if hasattr(self.job, 'uncancel'):
+                self.job.uncancel()
+            await self.interrupt_repl()
+            return self.send_error_response('KeyboardInterrupt', 'execution interrupted')
+        except pexpect.TIMEOUT:
+            await self.interrupt_repl()
+            return self.send_error_response('TimeoutError', 'execution timed out')
+        except pexpect.EOF:
+            await self.restart_repl()
+            return self.send_error_response('EOFError', 'the Scala REPL exited and was restarted')
+        except Exception as e:
+            return self.send_error_response(type(e).__name__, str(e))
+        finally:
+            self.cancel_renders()
+            if on_main:
+                signal.signal(signal.SIGINT, sigint)
+            self.deadline = None
+            if self.timing_mode:
+                self.send_timing_response(time.perf_counter() - started)
+        return { 'status': 'ok',
+                 'execution_count': self.execution_count,
+                 'payload': [],
+                 'user_expressions': {} }
+
+    async def do_execute(self, code, silent, store_history=True, user_expressions=None, allow_stdin=False):
+        """Execute user ``code`` by queueing it as a job on the REPL's
+           execution queue (see ``run_job``) and return the job's reply. Jobs
+           run one at a time, and waiting for one never blocks the event loop,
+           so other messages (e.g., interrupts, comm messages and, see
+           ``shell_main``, completion requests) are serviced while a cell runs.
+
+           The job (see ``execute_job``) runs the cell one block at a time:
+           kernel commands (e.g., ``::plotv``) are run by the kernel, and
+           contiguous runs of Scala code are sent to the REPL as one block.
+           An interrupt cancels the job and interrupts the REPL, a cell that
+           runs for longer than ``SCALA_TIMEOUT`` (or the ``::timeout``) is
+           stopped the same way, and if the REPL exits, it is restarted. Each
+           of these is reported as an error reply. A ``silent`` request is
+           acknowledged without running the cell.
+        """
+
+        if not silent:
+            return await self.run_job(lambda: self.execute_job(code))
+
         return { 'status': 'ok',
                  'execution_count': self.execution_count,
                  'payload': [],
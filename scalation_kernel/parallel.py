@@ -0,0 +1,122 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""Parameter sweeps for the ``::parallel`` kernel command.
+
+A sweep runs a block of Scala code once for every combination of the values
+of its parameters, e.g.::
+
+    ::parallel alpha=0.1,0.2,0.5 k=1:4 --collect rSq
+
+runs the rest of the cell 9 times, each time with ``alpha`` and ``k`` defined
+as ``val``s, and collects the value of ``rSq`` from each run. The runs are
+spread over a set of worker REPLs, so that they run at the same time.
+"""
+
+import argparse
+import asyncio
+import functools
+import itertools
+import os
+import shlex
+
+from .arguments import CommandArgumentParser
+
+PARALLEL_WORKERS = int(os.environ.get('SCALATION_KERNEL_PARALLEL', min(4, os.cpu_count() or 1)))
+
+class Worker(object):
+    """A worker REPL, along with how many lines of the kernel's preamble (i.e.,
+    its imports and definitions) have been evaluated in it.
+    """
+
+    def __init__(self, child):
+        """Construct the worker for the REPL ``child``."""
+        self.child    = child
+        self.replayed = 0
+
+    def terminate(self):
+        """Stop the worker's REPL."""
+        if self.child.isalive():
+            self.child.terminate(force=True)
+
+def parse_values(text):
+    """Parse the values of a parameter, which are either a comma-separated
+       list of Scala expressions (e.g., ``0.1,0.2`` or ``"a","b"``) or a
+       range of integers given as ``start:stop`` or ``start:stop:step``
+       (where ``stop`` is excluded).
+    """
+    parts = text.split(':')
+    if 2 <= len(parts) <= 3 and all(part.strip().lstrip('-').isdigit() for part in parts):
+        values = range(*(int(part) for part in parts))
+        return [str(value) for value in values]
+    return [value.strip() for value in text.split(',') if value.strip() != '']
+
+def parse_param(text):
+    """Parse a ``name=values`` argument into a ``(name, values)`` pair."""
+    name, sep, values = text.partition('=')
+    if sep == '' or not name.isidentifier():
+        raise argparse.ArgumentTypeError('expected NAME=VALUES, not {}'.format(text))
+    values = parse_values(values)
+    if len(values) == 0:
+        raise argparse.ArgumentTypeError('no values for {}'.format(name))
+    return name, values
+
+@functools.lru_cache(maxsize=None)
+def sweep_parser():
+    """Return the argument parser for ``::parallel``."""
+    parser = CommandArgumentParser(prog='::parallel', add_help=False)
+    parser.add_argument('params', metavar='NAME=VALUES', type=parse_param, nargs='+',
+                        help='a parameter and its values')
+    parser.add_argument('--workers', type=int, default=PARALLEL_WORKERS, help='number of worker REPLs')
+    parser.add_argument('--collect', metavar='EXPR', action='append', default=[],
+                        help='a Scala expression whose value is collected from each run')
+    return parser
+
+def parse_sweep(sweep_args):
+    """Parse the arguments of ``::parallel``."""
+    args = sweep_parser().parse_args(shlex.split(sweep_args, posix=False))
+    if args.workers < 1:
+        raise ValueError('::parallel needs at least one worker')
+    return args
+
+def sweep_runs(params):
+    """Return the runs of a sweep over ``params`` (a list of ``(name,
+       values)`` pairs), as lists of ``(name, value)`` pairs, in order.
+    """
+    names = [name for name, values in params]
+    return [list(zip(names, values)) for values in itertools.product(*(values for name, values in params))]
+
+def run_code(run, code_lines):
+    """Return the lines of Scala code for one ``run`` of ``code_lines``."""
+    return ['val {} = {}'.format(name, value) for name, value in run] + list(code_lines)
+
+def run_label(run):
+    """Return a short label for a ``run``, e.g., ``alpha=0.1, k=1``."""
+    return ', '.join('{}={}'.format(name, value) for name, value in run)
+
+async def run_sweep(workers, runs, execute):
+    """Execute every item of ``runs`` on one of the ``workers``, at most one
+       run per worker at a time, by awaiting ``execute(worker, index, run)``
+       and return the results in the order of ``runs``. A worker takes the
+       next run as soon as it is free. If a run fails, the other runs are
+       cancelled and the error is raised.
+    """
+    pending = asyncio.Queue()
+    for index, run in enumerate(runs):
+        pending.put_nowait((index, run))
+    results = [None] * len(runs)
+
+    async def work(worker):
+        while not pending.empty():
+            index, run = pending.get_nowait()
+            results[index] = await execute(worker, index, run)
+
+    tasks = [asyncio.ensure_future(work(worker)) for worker in workers]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return results
@@ -0,0 +1,319 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""Plotting for the ``::plotv``, ``::plotm`` and ``::plot3d`` kernel commands.
+
+Figures are drawn using the object-oriented ``matplotlib`` API (i.e., a new
+``Figure`` per plot and no global ``pyplot`` state), the backend is set up
+once, on first use, and the argument parsers are built once. Series with more
+points than can be seen in a figure are downsampled before they are drawn.
+
+Figures are rendered by a ``RenderPool`` of worker processes, so rendering
+never holds the kernel's GIL and several figures can be rendered at once. The
+data for a figure is handed to its worker through shared memory. With
+``--interactive``, a figure is rendered as a Vega-Lite specification instead
+of a PNG (see ``interactive``), so it can be zoomed in the browser.
+"""
+
+import argparse
+import asyncio
+import base64
+import functools
+import gc
+import os
+
+from .arguments import CommandArgumentParser
+from .interactive import heatmap_spec, interactive_bundle, series_spec
+from .transfer import parse_slice
+
+PLOT_POINTS      = 10000                  # default maximum points per series
+PLOT_DOWNSAMPLE  = ['lttb', 'minmax', 'none']
+PLOT_INTERACTIVE = os.environ.get('SCALATION_KERNEL_INTERACTIVE', '0') != '0'
+RENDER_WORKERS   = int(os.environ.get('SCALATION_KERNEL_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+
+@functools.lru_cache(maxsize=None)
+def matplotlib_modules():
+    """Import ``matplotlib``, set up its non-interactive backend and return the
+       ``Figure`` class and ``pyplot`` module. This only happens once.
+    """
+    import matplotlib
+    matplotlib.use('agg')
+    from matplotlib.figure import Figure
+    from matplotlib import pyplot
+    return Figure, pyplot
+
+def add_common_arguments(parser):
+    """Add the arguments that are common to every plot command."""
+    parser.add_argument('--title', help='plot title')
+    parser.add_argument('--xlabel', help='x-axis label')
+    parser.add_argument('--ylabel', help='y-axis label')
+    parser.add_argument('--axis', help='axis option (e.g., equal, tight or off)')
+    parser.add_argument('--xkcd', action='store_true', help='draw in the style of xkcd')
+    parser.add_argument('--interactive', action=argparse.BooleanOptionalAction, default=PLOT_INTERACTIVE,
+                        help='draw a plot that can be zoomed in the browser')
+
+@functools.lru_cache(maxsize=None)
+def plotv_parser():
+    """Return the argument parser for ``::plotv``."""
+    parser = CommandArgumentParser(prog='::plotv', add_help=False)
+    parser.add_argument('vectors', metavar='VectorD', nargs='+', help='a ScalaTion vector')
+    add_common_arguments(parser)
+    parser.add_argument('--bar', action='store_true', help='draw a bar graph')
+    parser.add_argument('--scatter', action='store_true', help='draw a scatter plot')
+    parser.add_argument('--max-points', type=int, default=PLOT_POINTS, help='maximum number of points per vector')
+    parser.add_argument('--downsample', choices=PLOT_DOWNSAMPLE, default='lttb', help='downsampling method')
+    return parser
+
+@functools.lru_cache(maxsize=None)
+def plotm_parser():
+    """Return the argument parser for ``::plotm``."""
+    parser = CommandArgumentParser(prog='::plotm', add_help=False)
+    parser.add_argument('matrices', metavar='M', nargs='+', help='a ScalaTion matrix')
+    add_common_arguments(parser)
+    parser.add_argument('--rows', type=parse_slice, default=slice(None), help='rows to plot, as start:stop:step')
+    parser.add_argument('--cols', type=parse_slice, default=slice(None), help='columns to plot, as start:stop:step')
+    parser.add_argument('--max-points', type=int, help='maximum number of points per column')
+    return parser
+
+@functools.lru_cache(maxsize=None)
+def plot3d_parser():
+    """Return the argument parser for ``::plot3d``."""
+    parser = CommandArgumentParser(prog='::plot3d', add_help=False)
+    parser.add_argument('x', help='a ScalaTion vector of x-coordinates')
+    parser.add_argument('y', help='a ScalaTion vector of y-coordinates')
+    parser.add_argument('z', help='a ScalaTion matrix of heights')
+    add_common_arguments(parser)
+    return parser
+
+def lttb(x, y, n):
+    """Downsample the series ``(x, y)`` to ``n`` points using the
+       Largest-Triangle-Three-Buckets algorithm, which keeps the points that
+       contribute most to the shape of a line plot.
+    """
+    import numpy as np
+    size = len(y)
+    if n >= size or n < 3:
+        return x, y
+    edges = np.linspace(1, size - 1, n - 1).astype(int)  # n - 2 inner buckets
+    index = np.empty(n, dtype=int)
+    index[0], index[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start, stop = edges[i], edges[i + 1]
+        nstop = edges[i + 2] if i + 2 < len(edges) else size
+        avg_x = x[stop:nstop].mean()
+        avg_y = y[stop:nstop].mean()
+        area  = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a     = start + int(np.argmax(area))
+        index[i + 1] = a
+    return x[index], y[index]
+
+def minmax(x, y, n):
+    """Downsample the series ``(x, y)`` to at most ``n`` points by keeping the
+       minimum and maximum of each of ``n / 2`` buckets, which preserves the
+       envelope of the series.
+    """
+    import numpy as np
+    size = len(y)
+    if n >= size or n < 2:
+        return x, y
+    edges = np.linspace(0, size, n // 2 + 1).astype(int)
+    index = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            bucket = y[start:stop]
+            index.extend(sorted({start + int(np.argmin(bucket)), start + int(np.argmax(bucket))}))
+    return x[index], y[index]
+
+def downsample(x, y, n, method='lttb'):
+    """Downsample the series ``(x, y)`` to about ``n`` points using ``method``
+       (one of ``PLOT_DOWNSAMPLE``).
+    """
+    if method == 'lttb':
+        return lttb(x, y, n)
+    if method == 'minmax':
+        return minmax(x, y, n)
+    return x, y
+
+def new_figure(args, projection=None):
+    """Return a new figure, and its axes, with the common arguments applied."""
+    Figure, pyplot = matplotlib_modules()
+    fig = Figure()
+    ax  = fig.add_subplot(projection=projection)
+    if args.title != None:
+        ax.set_title(args.title)
+    if args.xlabel != None:
+        ax.set_xlabel(args.xlabel)
+    if args.ylabel != None:
+        ax.set_ylabel(args.ylabel)
+    if args.axis != None:
+        ax.axis(args.axis)
+    return fig, ax
+
+def figure_png(fig):
+    """Return the figure ``fig`` rendered as PNG bytes."""
+    from io import BytesIO
+    figfile = BytesIO()
+    fig.savefig(figfile, format='png')
+    return figfile.getvalue()
+
+def xkcd_style(args):
+    """Return a context manager for the xkcd style, if it was requested."""
+    import contextlib
+    if args.xkcd:
+        Figure, pyplot = matplotlib_modules()
+        return pyplot.xkcd()
+    return contextlib.nullcontext()
+
+def render_plotv(args, vectors):
+    """Render ``::plotv`` for the given list of ``vectors`` (NumPy arrays) as
+       PNG bytes or, if ``--interactive``, a Vega-Lite specification.
+    """
+    import numpy as np
+    if args.interactive:
+        mark   = 'point' if args.scatter else 'bar' if args.bar else 'line'
+        series = [(name, np.arange(len(y)), y) for name, y in zip(args.vectors, vectors)]
+        return series_spec(args, series, mark, args.max_points)
+    with xkcd_style(args):
+        fig, ax = new_figure(args)
+        for y in vectors:
+            x    = np.arange(len(y))
+            x, y = downsample(x, y, args.max_points, args.downsample)
+            if args.scatter:
+                ax.scatter(x, y)
+            elif args.bar:
+                ax.bar(x, y)
+            else:
+                ax.plot(x, y)
+        return figure_png(fig)
+
+def render_plotm(args, matrices):
+    """Render ``::plotm`` for the given list of ``(data, index)`` pairs, where
+       ``data`` is a 2-D NumPy array and ``index`` holds its row indices, as
+       PNG bytes or, if ``--interactive``, a Vega-Lite specification.
+    """
+    if args.interactive:
+        series = [('{}:{}'.format(name, j), index, data[:, j])
+                  for name, (data, index) in zip(args.matrices, matrices) for j in range(data.shape[1])]
+        return series_spec(args, series, 'line', args.max_points or PLOT_POINTS)
+    with xkcd_style(args):
+        fig, ax = new_figure(args)
+        for data, index in matrices:
+            if data.size > 0:
+                ax.plot(index, data)
+        return figure_png(fig)
+
+def render_plot3d(args, x, y, z):
+    """Render ``::plot3d`` for the vectors ``x`` and ``y`` and the matrix ``z``
+       (NumPy arrays) as PNG bytes or, if ``--interactive``, a Vega-Lite
+       specification of a heat map.
+    """
+    import numpy as np
+    if args.interactive:
+        return heatmap_spec(args, x, y, z)
+    import mpl_toolkits.mplot3d           # registers the 3d projection
+    with xkcd_style(args):
+        fig, ax = new_figure(args, projection='3d')
+        x, y    = np.meshgrid(x, y)
+        ax.plot_surface(x, y, z)
+        return figure_png(fig)
+
+def render_arrays(kind, args, arrays):
+    """Render the figure for the plot command ``kind`` (``'plotv'``,
+       ``'plotm'`` or ``'plot3d'``) as a MIME bundle, given its parsed
+       ``args`` and a flat list of its NumPy ``arrays``: the vectors for
+       ``plotv``, alternating data and row indices for ``plotm``, and ``x``,
+       ``y`` and ``z`` for ``plot3d``.
+    """
+    if kind == 'plotv':
+        figure = render_plotv(args, arrays)
+    elif kind == 'plotm':
+        figure = render_plotm(args, list(zip(arrays[0::2], arrays[1::2])))
+    elif kind == 'plot3d':
+        figure = render_plot3d(args, *arrays)
+    else:
+        raise ValueError('unknown plot: {}'.format(kind))
+    if args.interactive:
+        return interactive_bundle(figure)
+    return {'image/png': base64.b64encode(figure).decode('ascii'), 'text/plain': '<Figure>'}
+
+def share_arrays(arrays):
+    """Copy ``arrays`` into a new block of shared memory and return the block
+       and the ``(offset, shape, dtype)`` layout of the arrays within it.
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+    arrays = [np.asarray(array) for array in arrays]
+    layout, size = [], 0
+    for array in arrays:
+        layout.append((size, array.shape, array.dtype.str))
+        size += -(-array.nbytes // 8) * 8              # keep every array aligned
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for (offset, shape, dtype), array in zip(layout, arrays):
+        np.ndarray(shape, dtype, buffer=block.buf, offset=offset)[...] = array
+    return block, layout
+
+def render_shared(kind, args, name, layout):
+    """Render a figure, like ``render_arrays``, from arrays in the block of
+       shared memory called ``name`` with the given ``layout``. This runs in
+       a worker process.
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        arrays = [np.ndarray(shape, dtype, buffer=block.buf, offset=offset) for offset, shape, dtype in layout]
+        return render_arrays(kind, args, arrays)
+    finally:
+        arrays = None
+        gc.collect()                                    # drop the figure's views of the block
+        try:
+            block.close()
+        except BufferError:
+            pass
+
+class RenderPool(object):
+    """A pool of ``workers`` processes that render figures. The processes are
+    started on first use. With no workers, figures are rendered in the
+    kernel's process instead.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS):
+        """Construct the pool."""
+        self.workers  = workers
+        self.executor = None
+
+    def start(self):
+        """Return the pool's executor, starting it if needed."""
+        if self.executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=matplotlib_modules)
+        return self.executor
+
+    async def render(self, kind, args, arrays):
+        """Render a figure, like ``render_arrays``, in a worker process and
+           return its MIME bundle.
+        """
+        if self.workers <= 0:
+            return render_arrays(kind, args, arrays)
+        from concurrent.futures.process import BrokenProcessPool
+        block, layout = share_arrays(arrays)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.start(), render_shared, kind, args, block.name, layout)
+        except BrokenProcessPool:
+            self.executor = None                        # start over next time
+            raise
+        finally:
+            block.close()
+            block.unlink()
+
+    def close(self):
+        """Stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,296 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""A pool of pre-started Scala REPLs for ScalaTion Kernel.
+
+Starting the JVM and warming up the Scala compiler takes many seconds, which is
+paid every time a notebook is opened or restarted. The pool daemon keeps a
+number of warm REPLs (with the ``ScalaTionKernelIO`` helper and an optional
+startup script already loaded) and hands one to each new kernel by passing the
+REPL's pseudo-terminal over a Unix socket. Run it with::
+
+    python3 -m scalation_kernel.pool --size 4
+
+A kernel uses the pool automatically whenever the pool's socket exists;
+otherwise, it starts its own REPL as usual.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import termios
+import threading
+import time
+
+import pexpect
+from pexpect import fdpexpect
+
+from .transfer import HELPER_LOADED, HELPER_SOURCE
+
+POOL_SOCKET       = 'scalation_kernel_pool.sock'
+POOL_SIZE         = 2                     # warm REPLs to keep ready
+POOL_IDLE_TIMEOUT = 3600                  # seconds before an unused pool is evicted
+POOL_TIMEOUT      = 5                     # seconds to wait for the daemon
+POOL_WARM_TIMEOUT = 300                   # seconds to wait for a REPL to warm up
+
+def default_socket_path():
+    """Return the path of the pool's Unix socket, which may be set using the
+       ``SCALATION_KERNEL_POOL`` environment variable.
+    """
+    if 'SCALATION_KERNEL_POOL' in os.environ:
+        return os.environ['SCALATION_KERNEL_POOL']
+    from jupyter_core.paths import jupyter_runtime_dir
+    return os.path.join(jupyter_runtime_dir(), POOL_SOCKET)
+
+class PooledREPL(fdpexpect.fdspawn):
+    """A REPL that was started by the pool daemon and handed to this process.
+    It supports the parts of the ``pexpect.spawn`` interface that the kernel
+    uses, even though this process is not the REPL's parent.
+    """
+
+    def __init__(self, fd, pid, **kwargs):
+        """Construct the REPL from the pseudo-terminal ``fd`` of process ``pid``."""
+        fdpexpect.fdspawn.__init__(self, fd, **kwargs)
+        self.pid = pid
+
+    def sendcontrol(self, char):
+        """Send the control character for ``char`` (e.g., ``'d'`` for Ctrl-D)."""
+        return self.send(chr(ord(char.lower()) - ord('a') + 1))
+
+    def sendintr(self):
+        """Send Ctrl-C, which the terminal turns into ``SIGINT``."""
+        self.sendcontrol('c')
+
+    def isalive(self):
+        """Return whether or not the REPL's process is still running."""
+        try:
+            os.kill(self.pid, 0)
+        except OSError:
+            return False
+        return fdpexpect.fdspawn.isalive(self)
+
+    def terminate(self, force=False):
+        """Terminate the REPL's process and close its pseudo-terminal."""
+        try:
+            os.kill(self.pid, signal.SIGKILL if force else signal.SIGTERM)
+        except OSError:
+            pass
+        self.close()
+        return True
+
+def startup_key(startup):
+    """Return the absolute path of the ``startup`` script, if any, so that
+       the daemon and the kernels compare the same paths.
+    """
+    return os.path.abspath(os.path.expanduser(startup)) if startup else None
+
+def acquire_repl(command, startup=None, path=None, timeout=POOL_TIMEOUT):
+    """Acquire a warm REPL started with ``command`` (a list) and warmed up
+       with the ``startup`` script (or none) from the pool daemon listening at
+       ``path``. Return a ``(repl, reply)`` pair, where ``reply`` is the
+       daemon's reply, or ``None`` if no such warm REPL is available.
+    """
+    path = path or default_socket_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            request = {'command': command, 'startup': startup_key(startup)}
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            msg, fds, flags, addr = socket.recv_fds(sock, 4096, 1)
+    except (OSError, ValueError):
+        return None
+    if len(fds) == 0:
+        return None
+    reply = json.loads(msg.decode('utf-8'))
+    repl  = PooledREPL(fds[0], reply['pid'], encoding='utf-8')
+    return repl, reply
+
+class WarmREPL(object):
+    """A REPL, started and warmed up by the pool daemon, with a controlling
+    pseudo-terminal that can be handed to a kernel.
+    """
+
+    def __init__(self, command, dimensions, startup=None, helper=True):
+        """Start the REPL using ``command`` on a terminal with the given
+           ``dimensions`` and echo disabled, then load the helper and the
+           ``startup`` script, if given.
+        """
+        master, slave = os.openpty()
+        fcntl.ioctl(master, termios.TIOCSWINSZ, struct.pack('HHHH', dimensions[0], dimensions[1], 0, 0))
+        attrs = termios.tcgetattr(slave)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+        self.process = subprocess.Popen(command, stdin=slave, stdout=slave, stderr=slave,
+                                        start_new_session=True, close_fds=True,
+                                        preexec_fn=lambda: fcntl.ioctl(0, termios.TIOCSCTTY, 0))
+        os.close(slave)
+        self.child   = fdpexpect.fdspawn(master, encoding='utf-8', timeout=POOL_WARM_TIMEOUT)
+        self.created = time.monotonic()
+        self.child.expect('scala> ')
+        self.helper_loaded = False
+        if helper:
+            self.helper_loaded = HELPER_LOADED in self.paste(HELPER_SOURCE)
+        if startup:
+            self.paste(startup)
+
+    def paste(self, path):
+        """Paste the Scala file at ``path`` into the REPL and return its output."""
+        self.child.sendline(':paste {}'.format(path))
+        self.child.expect('scala> ')
+        return self.child.before
+
+    def handoff(self, conn):
+        """Send the REPL's pseudo-terminal over the connection ``conn`` and
+           close this process's copy of it.
+        """
+        reply = {'pid': self.process.pid, 'helper_loaded': self.helper_loaded}
+        socket.send_fds(conn, [json.dumps(reply).encode('utf-8')], [self.child.child_fd])
+        self.child.close()
+
+    def terminate(self):
+        """Terminate the REPL."""
+        self.process.terminate()
+        self.child.close()
+
+class REPLPool(object):
+    """The pool daemon, which keeps ``size`` warm REPLs started with
+    ``command`` ready to hand to new kernels. If no REPL is acquired for
+    ``idle_timeout`` seconds, the warm REPLs are evicted until the next
+    request arrives.
+    """
+
+    def __init__(self, command, dimensions, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, startup=None, helper=True):
+        """Construct the pool."""
+        self.command      = command
+        self.dimensions   = dimensions
+        self.size         = size
+        self.idle_timeout = idle_timeout
+        self.startup      = startup
+        self.helper       = helper
+        self.ready        = []            # warm REPLs
+        self.handed       = []            # processes handed to kernels
+        self.warming      = 0             # REPLs being warmed up
+        self.dormant      = False         # evicted for being idle?
+        self.acquired     = time.monotonic()
+        self.lock         = threading.Lock()
+
+    def warm(self):
+        """Start and warm up a new REPL, then add it to the pool."""
+        try:
+            repl = WarmREPL(self.command, self.dimensions, self.startup, self.helper)
+        except (OSError, pexpect.ExceptionPexpect) as e:
+            print('failed to warm up a REPL: {}'.format(e), file=sys.stderr)
+            time.sleep(POOL_TIMEOUT)
+            repl = None
+        with self.lock:
+            self.warming -= 1
+            if repl is not None:
+                self.ready.append(repl)
+
+    def maintain(self):
+        """Reap handed-off REPLs that have exited, evict idle REPLs and start
+           new REPLs as needed. This runs forever.
+        """
+        while True:
+            with self.lock:
+                self.handed = [process for process in self.handed if process.poll() is None]
+                if not self.dormant and time.monotonic() - self.acquired > self.idle_timeout:
+                    for repl in self.ready:
+                        repl.terminate()
+                    self.ready   = []
+                    self.dormant = True
+                missing = 0 if self.dormant else self.size - len(self.ready) - self.warming
+                self.warming += max(missing, 0)
+            for i in range(missing):
+                threading.Thread(target=self.warm, daemon=True).start()
+            time.sleep(1)
+
+    def acquire(self, command, startup=None):
+        """Remove and return a warm REPL started with ``command`` and warmed up
+           with the ``startup`` script (see ``startup_key``), or ``None`` if
+           there is none.
+        """
+        with self.lock:
+            self.acquired = time.monotonic()
+            self.dormant  = False
+            if command != self.command or startup != startup_key(self.startup) or len(self.ready) == 0:
+                return None
+            repl = self.ready.pop(0)
+            self.handed.append(repl.process)
+            return repl
+
+    def serve(self, path):
+        """Accept requests on the Unix socket at ``path`` forever."""
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask  = os.umask(0o077)          # only this user may connect, but
+        try:                              # the REPLs keep the user's umask
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        threading.Thread(target=self.maintain, daemon=True).start()
+        print('serving {} warm REPL(s) on {}'.format(self.size, path), file=sys.stderr)
+        try:
+            while True:
+                conn, addr = server.accept()
+                with conn:
+                    self.handle(conn)
+        finally:
+            server.close()
+            os.remove(path)
+            for repl in self.ready:
+                repl.terminate()
+
+    def handle(self, conn):
+        """Handle a single request on the connection ``conn``."""
+        try:
+            conn.settimeout(POOL_TIMEOUT)
+            request = json.loads(conn.makefile('r', encoding='utf-8').readline())
+            repl    = self.acquire(request['command'], request.get('startup'))
+            if repl is None:
+                conn.sendall(json.dumps({'pid': None}).encode('utf-8'))
+            else:
+                repl.handoff(conn)
+        except (OSError, ValueError, KeyError) as e:
+            print('failed to handle a request: {}'.format(e), file=sys.stderr)
+
+def main(argv=None):
+    from .kernel import SCALA_DIMENSIONS, SCALA_EXEC, SCALA_OPTIONS
+    ap = argparse.ArgumentParser(description='Keep warm Scala REPLs ready for ScalaTion Kernel.')
+    ap.add_argument('--size', type=int, default=POOL_SIZE,
+        help="Number of warm REPLs to keep ready.")
+    ap.add_argument('--idle-timeout', type=float, default=POOL_IDLE_TIMEOUT,
+        help="Seconds without a request before the warm REPLs are evicted.")
+    ap.add_argument('--socket', default=None,
+        help="Path of the Unix socket. Defaults to $SCALATION_KERNEL_POOL or "
+             "the Jupyter runtime directory.")
+    ap.add_argument('--startup', default=os.environ.get('SCALATION_KERNEL_STARTUP'),
+        help="Scala file (e.g., with ScalaTion imports) to paste into each REPL "
+             "while it is warming up. Defaults to $SCALATION_KERNEL_STARTUP.")
+    ap.add_argument('--no-helper', action='store_true',
+        help="Do not preload the ScalaTionKernelIO helper.")
+    args = ap.parse_args(argv)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    pool = REPLPool([SCALA_EXEC] + SCALA_OPTIONS, SCALA_DIMENSIONS, args.size,
+                    args.idle_timeout, args.startup, not args.no_helper)
+    try:
+        pool.serve(args.socket or default_socket_path())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""JVM tuning profiles for the Scala REPL, and the resource usage of the
+kernel's processes (see the ``::resources`` kernel command).
+
+A profile sets the REPL's maximum heap size (``heap``), its garbage collector
+(``gc``), other JVM options (``java``, e.g., for the JIT compiler), options for
+the Scala compiler (``scala``) and jars to add to the classpath
+(``classpath``). The kernel uses the profile named by the
+``SCALATION_KERNEL_PROFILE`` environment variable, which ``install.py
+--profile`` records in the kernel spec, and ``SCALATION_KERNEL_HEAP`` and
+``SCALATION_KERNEL_JAVA_OPTIONS`` override its heap size and add JVM options.
+More profiles can be defined in a JSON file, named by the
+``SCALATION_KERNEL_PROFILES`` environment variable, that maps their names to
+their settings.
+"""
+
+import json
+import os
+import resource
+import shlex
+
+PROFILE_DEFAULT = 'default'
+PROFILE_FIELDS  = { 'description': '', 'heap': None, 'gc': None, 'java': [], 'scala': [], 'classpath': [] }
+PROFILE_GCS     = { 'serial':   '-XX:+UseSerialGC',
+                    'parallel': '-XX:+UseParallelGC',
+                    'g1':       '-XX:+UseG1GC',
+                    'z':        '-XX:+UseZGC' }
+PROFILES        = { 'default':    { 'description': "the JVM's own defaults" },
+                    'small':      { 'description': 'classes and small data: 1 GiB heap, fast startup',
+                                    'heap': '1g', 'gc': 'serial',
+                                    'java': ['-XX:TieredStopAtLevel=1', '-Xshare:auto'] },
+                    'large':      { 'description': 'big matrices: 8 GiB heap, G1 collector',
+                                    'heap': '8g', 'gc': 'g1',
+                                    'java': ['-Xss16m', '-XX:+UseStringDeduplication'] },
+                    'throughput': { 'description': 'long-running models: 16 GiB pre-touched heap, parallel collector',
+                                    'heap': '16g', 'gc': 'parallel',
+                                    'java': ['-Xms16g', '-Xss16m', '-XX:+AlwaysPreTouch'] } }
+
+def load_profiles(path=None):
+    """Return the built-in profiles, along with those defined in the JSON file
+       at ``path``, if any.
+    """
+    profiles = dict(PROFILES)
+    if path:
+        with open(os.path.expanduser(path)) as f:
+            profiles.update(json.load(f))
+    return profiles
+
+def get_profile(name=None, env=None):
+    """Return the settings of the profile ``name`` (by default, the one named
+       by ``SCALATION_KERNEL_PROFILE``) with the overrides in the environment
+       ``env`` applied. Raise ``ValueError`` if there is no such profile.
+    """
+    env      = os.environ if env == None else env
+    name     = name or env.get('SCALATION_KERNEL_PROFILE') or PROFILE_DEFAULT
+    profiles = load_profiles(env.get('SCALATION_KERNEL_PROFILES'))
+    if name not in profiles:
+        raise ValueError('unknown profile {} (expected one of {})'.format(name, ', '.join(sorted(profiles))))
+    profile = dict(PROFILE_FIELDS, **profiles[name])
+    profile['name'] = name
+    if env.get('SCALATION_KERNEL_HEAP'):
+        profile['heap'] = env['SCALATION_KERNEL_HEAP']
+    if env.get('SCALATION_KERNEL_JAVA_OPTIONS'):
+        profile['java'] = list(profile['java']) + shlex.split(env['SCALATION_KERNEL_JAVA_OPTIONS'])
+    if profile['gc'] != None and profile['gc'] not in PROFILE_GCS:
+        raise ValueError('unknown garbage collector {} (expected one of {})'.format(profile['gc'], ', '.join(PROFILE_GCS)))
+    return profile
+
+def java_options(profile):
+    """Return the JVM options of ``profile``."""
+    options = ['-Xmx' + profile['heap']] if profile['heap'] != None else []
+    options = options + ([PROFILE_GCS[profile['gc']]] if profile['gc'] != None else [])
+    return options + list(profile['java'])
+
+def scala_options(profile):
+    """Return the options of ``profile`` for the ``scala`` command, which
+       passes the JVM options (prefixed with ``-J``) to the JVM.
+    """
+    return ['-J' + option for option in java_options(profile)] + list(profile['scala'])
+
+def profile_classpath(classpath, profile):
+    """Return ``classpath`` with the jars of ``profile`` added to it."""
+    entries = [classpath] + [os.path.expanduser(path) for path in profile['classpath']]
+    return os.pathsep.join(entry for entry in entries if entry != '')
+
+def process_memory(pid):
+    """Return the resident set size of the process ``pid`` and its peak, in
+       bytes, or ``None`` for each one that is not known (e.g., on systems
+       without ``/proc``).
+    """
+    sizes = {}
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                key, sep, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    sizes[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    if pid == os.getpid() and 'VmHWM' not in sizes:
+        sizes['VmHWM'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return sizes.get('VmRSS'), sizes.get('VmHWM')
+
+def mebibytes(size):
+    """Return ``size`` (in bytes) in MiB, as text, or ``'n/a'`` if it is not
+       known (i.e., ``None`` or negative).
+    """
+    return 'n/a' if size == None or size < 0 else '%.1f' % (size / 2 ** 20)
@@ -0,0 +1,243 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""A cache of compiled definitions, so that definitions are not compiled
+again every time a session is restarted.
+
+When compilation is enabled (``SCALATION_KERNEL_RESTORE=1``) and a block of
+Scala code that only holds imports and definitions (e.g., ``def``, ``class``
+and ``object``) is evaluated successfully, it is also compiled in the
+background, using ``scalac``, into a jar in the cache, as the body of a
+wrapper object. Every compilation runs a JVM of its own, so compilations only
+start once the session has been idle for a few seconds, and only a few (see
+``RESTORE_JOBS``) run at once across all of the kernels that share the cache. The jar is keyed by a hash of the block, of the
+imports and definitions that came before it in the session and of the jars in
+``SCALATION_JARS``. When the same block is evaluated again in the same context
+(e.g., after the kernel is restarted and the notebook is run again), the jar
+is added to the REPL's classpath (``:require``) and the wrapper's members are
+imported, which is much faster than compiling the block again.
+
+The imports and definitions of each session are also recorded in a manifest,
+keyed by the working directory and the classpath, so that ``::restore`` can
+bring back all of the definitions of the previous session at once.
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from .completion import classpath_entries, default_cache_dir
+
+RESTORE_VERSION = 1                       # bump when the cache format changes
+RESTORE_ENABLED = os.environ.get('SCALATION_KERNEL_RESTORE', '0') != '0'
+RESTORE_SCALAC  = os.environ.get('SCALATION_KERNEL_SCALAC', 'scalac')
+RESTORE_DELAY   = float(os.environ.get('SCALATION_KERNEL_RESTORE_DELAY', 5))  # idle seconds before compiling
+RESTORE_JOBS    = int(os.environ.get('SCALATION_KERNEL_RESTORE_JOBS', 1))     # compilations at once, per cache
+RESTORE_POLL    = 1                       # seconds between tries for a free compilation slot
+RESTORE_WRAPPER = 'ScalaTionKernelDefs_'  # prefix of the wrapper objects
+RESTORE_NAME    = re.compile(r'^(?:(?:abstract|case|final|implicit|sealed)\s+)*(def|class|object|trait|type)\s+([\w$]+)')
+
+def defined_names(code_lines):
+    """Return the ``(kind, name)`` pairs of the top-level definitions in
+       ``code_lines``, e.g., ``('class', 'Foo')``.
+    """
+    names = []
+    for line in code_lines:
+        match = RESTORE_NAME.match(line)
+        if match != None and match.group(2) not in [name for kind, name in names]:
+            names.append((match.group(1), match.group(2)))
+    return names
+
+def top_level_imports(code_lines):
+    """Return the top-level ``import`` lines of ``code_lines``."""
+    return [line for line in code_lines if line.startswith('import ')]
+
+class DefinitionCache(object):
+    """A directory of compiled definitions, each a jar and a JSON file that
+    describes it (its wrapper object, the jars that it depends on, its imports,
+    its names and its source lines), named by the definitions' key.
+    """
+
+    def __init__(self, classpath, cache_dir=None, scalac=RESTORE_SCALAC):
+        """Construct the cache for definitions compiled against ``classpath``."""
+        self.classpath = classpath
+        self.directory = os.path.join(cache_dir or default_cache_dir(), 'definitions')
+        self.scalac    = scalac
+        self.stamp     = None                                  # of the classpath, computed once
+        self.compiled  = 0
+        self.failed    = 0
+
+    def classpath_stamp(self):
+        """Return a hash of the paths, sizes and modification times of the
+           entries on the classpath, so that definitions are compiled again
+           when the jars change.
+        """
+        if self.stamp == None:
+            stamps = []
+            for entry in classpath_entries(self.classpath):
+                stat = os.stat(entry)
+                stamps.append([entry, stat.st_size, stat.st_mtime_ns])
+            self.stamp = hashlib.sha1(json.dumps([RESTORE_VERSION, stamps]).encode('utf-8')).hexdigest()
+        return self.stamp
+
+    def key(self, preamble, code_lines):
+        """Return the key of the definitions in ``code_lines`` when they are
+           evaluated after the imports and definitions in ``preamble``.
+        """
+        digest = hashlib.sha1(self.classpath_stamp().encode('utf-8'))
+        digest.update('\n'.join(preamble).encode('utf-8') + b'\0')
+        digest.update('\n'.join(code_lines).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key, suffix='.jar'):
+        """Return the path of the jar (or, given ``suffix``, another file) for
+           ``key``.
+        """
+        return os.path.join(self.directory, key + suffix)
+
+    def find(self, key):
+        """Return the description of the compiled definitions for ``key``, or
+           ``None`` if they have not been compiled.
+        """
+        try:
+            with open(self.path(key, '.json'), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if os.path.exists(self.path(key)) else None
+
+    def source(self, wrapper, deps, preamble, code_lines):
+        """Return the Scala source that wraps ``code_lines`` in the object
+           ``wrapper``, after the imports of the ``preamble`` and of the
+           members of the wrappers in ``deps``.
+        """
+        imports = top_level_imports(preamble) + ['import {}._'.format(dep['wrapper']) for dep in deps]
+        return '\n'.join(imports + ['object {} {{'.format(wrapper)] + list(code_lines) + ['}', ''])
+
+    @contextlib.asynccontextmanager
+    async def compile_slot(self, jobs=RESTORE_JOBS):
+        """Hold one of the ``jobs`` compilation slots, which are shared by
+           every kernel that uses this cache, waiting until one is free. A
+           slot is a lock file, so it is freed even if its kernel dies.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            for i in range(max(1, jobs)):
+                f = open(os.path.join(self.directory, 'compile-{}.lock'.format(i)), 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    f.close()
+                    continue
+                try:
+                    yield
+                finally:
+                    f.close()                          # which releases the lock
+                return
+            await asyncio.sleep(RESTORE_POLL)
+
+    async def compile(self, key, preamble, code_lines, deps):
+        """Compile the definitions in ``code_lines`` for ``key`` into a jar,
+           given the imports and definitions in ``preamble`` and the compiled
+           definitions ``deps`` (descriptions, like those returned by ``find``)
+           that came before it. Return the description of the compiled
+           definitions, or ``None`` if they could not be compiled.
+        """
+        wrapper   = RESTORE_WRAPPER + key[:16]
+        workdir   = tempfile.mkdtemp(prefix='scalation_kernel_')
+        source    = os.path.join(workdir, wrapper + '.scala')
+        jar       = os.path.join(workdir, wrapper + '.jar')
+        classpath = os.pathsep.join([self.classpath] + [self.path(dep['key']) for dep in deps])
+        try:
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write(self.source(wrapper, deps, preamble, code_lines))
+            async with self.compile_slot():
+                process = await asyncio.create_subprocess_exec(self.scalac, '-nowarn', '-classpath', classpath,
+                                                               '-d', jar, source, stdout=asyncio.subprocess.DEVNULL,
+                                                               stderr=asyncio.subprocess.DEVNULL)
+                try:
+                    status = await process.wait()
+                except asyncio.CancelledError:
+                    process.kill()
+                    raise
+            if status != 0 or not os.path.exists(jar):
+                self.failed += 1
+                return None
+            entry = { 'key':     key,
+                      'wrapper': wrapper,
+                      'deps':    [dep['key'] for dep in deps],
+                      'imports': top_level_imports(code_lines),
+                      'names':   defined_names(code_lines),
+                      'lines':   list(code_lines) }
+            os.makedirs(self.directory, exist_ok=True)
+            os.replace(jar, self.path(key))
+            with open(self.path(key, '.json.tmp'), 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(self.path(key, '.json.tmp'), self.path(key, '.json'))
+            self.compiled += 1
+            return entry
+        except OSError:                                        # e.g., no scalac
+            self.failed += 1
+            return None
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def session_path(self, cwd=None):
+        """Return the path of the manifest of the session that runs in the
+           directory ``cwd`` (by default, the current one).
+        """
+        name = hashlib.sha1('{}\0{}'.format(cwd or os.getcwd(), self.classpath).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'session-{}.json'.format(name))
+
+    def save_session(self, segments):
+        """Save the ``segments`` of the current session (see ``load_session``)
+           as its manifest.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.session_path()
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(segments, f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def load_session(self):
+        """Return the segments of the previous session's manifest, which are
+           lists of lines (imports and definitions to evaluate) and keys (of
+           compiled definitions), in order.
+        """
+        try:
+            with open(self.session_path(), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def entries(self):
+        """Return the number of compiled definitions and their total size in
+           bytes.
+        """
+        count, size = 0, 0
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.jar'):
+                    count += 1
+                    size  += os.path.getsize(os.path.join(self.directory, name))
+        return count, size
+
+    def clear(self):
+        """Remove every compiled definition (but not the session manifests or
+           the compilation slots).
+        """
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.startswith('session-') and not name.endswith('.lock'):
+                    os.remove(os.path.join(self.directory, name))
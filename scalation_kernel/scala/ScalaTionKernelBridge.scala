@@ -0,0 +1,284 @@
+//::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+// @author  Michael Cotterell
+// @see     LICENSE (MIT style license file).
+//::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+import java.io.{BufferedInputStream, BufferedOutputStream, ByteArrayOutputStream, DataInputStream,
+                DataOutputStream, EOFException, File, OutputStream, OutputStreamWriter, PrintStream, PrintWriter}
+import java.net.{InetAddress, ServerSocket, Socket}
+import java.nio.charset.StandardCharsets
+import java.util.function.Consumer
+
+import scala.collection.mutable.ArrayBuffer
+import scala.tools.nsc.Settings
+import scala.tools.nsc.interpreter.{IMain, Results}
+import scala.util.Try
+
+//::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+/** The `ScalaTionKernelBridge` object is an interpreter server that ScalaTion
+ *  Kernel can use instead of the Scala REPL (see `SCALATION_KERNEL_ENGINE`).
+ *  It listens on a loopback socket, whose port it prints on startup, accepts
+ *  one connection from the kernel and evaluates the code that the kernel
+ *  sends it using the Scala interpreter, without a terminal.
+ *
+ *  Every message is a frame (a 4-byte big-endian length followed by that many
+ *  bytes). A request is one UTF-8 frame holding an operation and an id on its
+ *  first line, followed by the code (if any), e.g., "eval 7\nval x = 1". A
+ *  response is a frame holding a JSON header, followed by as many binary frames
+ *  as its "frames" field says. While code runs, its stdout and stderr are sent
+ *  as "stdout" and "stderr" responses, and it ends with a "result" response
+ *  giving its status, the name and type of its result and the binary payloads
+ *  that the code attached (see `ScalaTionKernelIO.attach`).
+ *
+ *  Operations: "eval" evaluates a block of code; "line" evaluates a line of
+ *  code, holding on to incomplete lines until a later one completes them;
+ *  "interrupt" interrupts the running evaluation; "reset" forgets every
+ *  definition; and "quit" stops the server.
+ */
+object ScalaTionKernelBridge
+{
+    private val READY    = "<scalation_kernel>:bridge:"        // printed with the port
+    private val TOKEN    = "SCALATION_KERNEL_BRIDGE_TOKEN"     // shared secret
+    private val ATTACH   = "scalation.kernel.attach"           // system property
+    private val CHUNK    = 1 << 16                             // bytes buffered per stream
+    private val INTERVAL = 100                                 // milliseconds between flushes
+    private val GRACE    = 2000                                // milliseconds before stopping a thread
+
+    private var socket: Socket           = null
+    private var in:     DataInputStream  = null
+    private var out:    DataOutputStream = null
+    private var intp:   IMain            = null
+    @volatile private var current = -1                         // id of the running evaluation
+    @volatile private var stopped = false                      // running was interrupted
+    private var running: Thread   = null
+    private val pending  = new StringBuilder                   // incomplete lines
+    private val payloads = ArrayBuffer [Array [Byte]] ()       // attached by the running code
+    private val stdout   = new Channel ("stdout")
+    private val stderr   = new Channel ("stderr")
+    private val stdoutPS = new PrintStream (stdout, false, "UTF-8")
+    private val stderrPS = new PrintStream (stderr, false, "UTF-8")
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Start the server, wait for the kernel to connect and serve its requests.
+     *  @param args  the classpath for the interpreter, followed by its options
+     */
+    def main (args: Array [String])
+    {
+        val server = new ServerSocket (0, 1, InetAddress.getLoopbackAddress)
+        println (READY + server.getLocalPort)
+        Console.out.flush ()
+        socket = server.accept ()
+        server.close ()
+        socket.setTcpNoDelay (true)
+        in  = new DataInputStream (new BufferedInputStream (socket.getInputStream))
+        out = new DataOutputStream (new BufferedOutputStream (socket.getOutputStream))
+        if (readText () != sys.env.getOrElse (TOKEN, "")) sys.exit (1)
+
+        System.setOut (stdoutPS)
+        System.setErr (stderrPS)
+        System.getProperties.put (ATTACH, new Consumer [Array [Byte]] {
+            def accept (bytes: Array [Byte]) { payloads.synchronized { payloads += bytes } }
+        })
+        intp = newInterpreter (if (args.length > 0) args(0) else "", args.drop (1).toList)
+        flusher ()
+        serve ()
+    } // main
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Return a new interpreter whose classpath is `classpath`, along with the
+     *  Scala library, and whose own output (e.g., results and errors) goes to
+     *  the stdout of the running evaluation.
+     *  @param classpath  the classpath (e.g., the ScalaTion jars)
+     *  @param options    the compiler options (e.g., "-deprecation")
+     */
+    private def newInterpreter (classpath: String, options: List [String]): IMain =
+    {
+        val library  = Try (new File (classOf [Option [_]].getProtectionDomain.getCodeSource.getLocation.toURI).getPath)
+        val settings = new Settings
+        settings.usejavacp.value = true
+        settings.classpath.value = (classpath.split (File.pathSeparator).filter (_ != "") ++ library.toOption)
+                                   .mkString (File.pathSeparator)
+        settings.processArguments (options, true)
+        val writer = new PrintWriter (new OutputStreamWriter (stdoutPS, StandardCharsets.UTF_8), true)
+        val intp   = new IMain (settings, writer)
+        intp.initializeSynchronous ()
+        intp
+    } // newInterpreter
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Read and handle requests until the kernel disconnects or asks the
+     *  server to quit.
+     */
+    private def serve ()
+    {
+        while (true) {
+            val request = try readText () catch { case _: EOFException => sys.exit (0) }
+            val header  = request.takeWhile (_ != '\n').split (' ')
+            val code    = request.drop (header.mkString (" ").length + 1)
+            val id      = Try (header(1).toInt).getOrElse (-1)
+            header(0) match {
+            case "eval"      => evaluate (id) { interpret (code, false) }
+            case "line"      => evaluate (id) { interpret (code, true) }
+            case "reset"     => evaluate (id) { pending.clear (); intp.reset (); "ok" }
+            case "interrupt" => interrupt ()
+            case "quit"      => sys.exit (0)
+            case op          => send (s"""{"id": $id, "kind": "result", "status": "error", "error": ${quote ("unknown operation " + op)}}""")
+            } // match
+        } // while
+    } // serve
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Interpret `code` (handling `:require` lines like the REPL) and return
+     *  the status of the evaluation.
+     *  @param code  the code to interpret
+     *  @param line  whether `code` is a line that may be incomplete
+     */
+    private def interpret (code: String, line: Boolean): String =
+    {
+        val (requires, rest) = code.split ("\n").partition (_.startsWith (":require "))
+        for (require <- requires) {
+            val path = require.stripPrefix (":require ").trim
+            intp.addUrlsToClassPath (new File (path).toURI.toURL)
+            Console.out.println (s"Added '$path' to classpath.")
+        } // for
+        if (line && pending.nonEmpty) pending.append ('\n')
+        val source = if (line) pending.append (rest.mkString ("\n")).toString else rest.mkString ("\n")
+        if (source.trim.isEmpty) { pending.clear (); return "ok" }
+        intp.interpret (source) match {
+        case Results.Incomplete if line => "incomplete"
+        case Results.Success            => pending.clear (); "ok"
+        case _                          => pending.clear (); "error"
+        } // match
+    } // interpret
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Run `body` for the request `id` on a new thread, with its output sent
+     *  to the kernel, and send its result when it is done.
+     *  @param id    the id of the request
+     *  @param body  the evaluation, which returns its status
+     */
+    private def evaluate (id: Int)(body: => String)
+    {
+        synchronized { current = id; stopped = false }
+        payloads.synchronized { payloads.clear () }
+        running = new Thread (new Runnable {
+            def run ()
+            {
+                val status = try Console.withOut (stdoutPS) { Console.withErr (stderrPS) { body } }
+                             catch { case e: Throwable => if (stopped) "interrupted" else { e.printStackTrace (stderrPS); "error" } }
+                val attached = payloads.synchronized { payloads.toList }
+                val (name, tpe) = if (status != "ok") ("", "") else {
+                    val name = Try (intp.mostRecentVar).getOrElse ("")
+                    (name, Try (intp.typeOfTerm (name).finalResultType.toString).getOrElse (""))
+                } // if
+                ScalaTionKernelBridge.synchronized {
+                    stdoutPS.flush (); stdout.flush ()
+                    stderrPS.flush (); stderr.flush ()
+                    send (s"""{"id": $id, "kind": "result", "status": ${quote (if (stopped) "interrupted" else status)}, """ +
+                          s""""name": ${quote (name)}, "type": ${quote (tpe)}, "frames": ${attached.length}}""", attached)
+                    current = -1
+                } // synchronized
+            } // run
+        }, "scalation-kernel-eval")
+        running.setDaemon (true)
+        running.start ()
+    } // evaluate
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Interrupt the running evaluation, if any, and stop its thread if it is
+     *  still running after a grace period.
+     */
+    private def interrupt ()
+    {
+        val thread = running
+        if (thread == null || ! thread.isAlive) return
+        synchronized { stopped = true; pending.clear () }
+        thread.interrupt ()
+        thread.join (GRACE)
+        if (thread.isAlive) Try (thread.stop ())              // not supported by newer JVMs
+    } // interrupt
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Start a daemon thread that sends the buffered output every `INTERVAL`
+     *  milliseconds, so that long evaluations show their progress.
+     */
+    private def flusher ()
+    {
+        val thread = new Thread (new Runnable {
+            def run ()
+            {
+                while (true) {
+                    Thread.sleep (INTERVAL)
+                    ScalaTionKernelBridge.synchronized {
+                        stdoutPS.flush (); stdout.flush ()
+                        stderrPS.flush (); stderr.flush ()
+                    } // synchronized
+                } // while
+            } // run
+        }, "scalation-kernel-flush")
+        thread.setDaemon (true)
+        thread.start ()
+    } // flusher
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Send a response with the JSON `header` and the binary `frames`.
+     *  @param header  the JSON header of the response
+     *  @param frames  the frames that follow the header
+     */
+    private def send (header: String, frames: Seq [Array [Byte]] = Seq ())
+    {
+        out.synchronized {
+            for (frame <- header.getBytes (StandardCharsets.UTF_8) +: frames) {
+                out.writeInt (frame.length)
+                out.write (frame)
+            } // for
+            out.flush ()
+        } // synchronized
+    } // send
+
+    private def readText (): String =
+    {
+        val bytes = new Array [Byte] (in.readInt ())
+        in.readFully (bytes)
+        new String (bytes, StandardCharsets.UTF_8)
+    } // readText
+
+    private def quote (text: String): String =
+    {
+        "\"" + text.flatMap {
+            case '"'  => "\\\""
+            case '\\' => "\\\\"
+            case c if c < ' ' => f"\\u${c.toInt}%04x"
+            case c    => c.toString
+        } + "\""
+    } // quote
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** The `Channel` class buffers the bytes written to stdout or stderr and
+     *  sends them as responses to the running evaluation when it is flushed or
+     *  its buffer is full.
+     *  @param kind  the kind of the responses (i.e., "stdout" or "stderr")
+     */
+    private class Channel (kind: String) extends OutputStream
+    {
+        private val buffer = new ByteArrayOutputStream
+
+        def write (b: Int) { synchronized { buffer.write (b); if (buffer.size >= CHUNK) flush () } }
+
+        override def write (b: Array [Byte], off: Int, len: Int)
+        {
+            synchronized { buffer.write (b, off, len); if (buffer.size >= CHUNK) flush () }
+        } // write
+
+        override def flush ()
+        {
+            synchronized {
+                if (buffer.size > 0) {
+                    send (s"""{"id": $current, "kind": "$kind", "frames": 1}""", Seq (buffer.toByteArray))
+                    buffer.reset ()
+                } // if
+            } // synchronized
+        } // flush
+    } // Channel
+
+} // ScalaTionKernelBridge
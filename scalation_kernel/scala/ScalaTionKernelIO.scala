@@ -0,0 +1,383 @@
+//::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+// @author  Michael Cotterell
+// @see     LICENSE (MIT style license file).
+//::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+import java.io.{BufferedOutputStream, BufferedWriter, DataOutputStream, FileOutputStream, OutputStreamWriter}
+import java.nio.{ByteBuffer, ByteOrder}
+import java.nio.charset.StandardCharsets
+import java.nio.channels.FileChannel
+import java.nio.file.{Paths, StandardOpenOption}
+import java.util.Base64
+
+//::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+/** The `ScalaTionKernelIO` object is loaded into the REPL by ScalaTion Kernel
+ *  so that bulk data can be handed to the kernel as raw little-endian doubles
+ *  in a local file instead of as decimal text printed through the terminal,
+ *  so that data can be exported to and imported from NPY and CSV files, so
+ *  that Scala code can display rich output (e.g., images) in the notebook, and
+ *  so that the kernel can report the JVM's resource usage.
+ */
+object ScalaTionKernelIO
+{
+    private val CHUNK = 1 << 16                        // doubles per write
+    private val MIME  = "<scalation_kernel>:mime:"     // display protocol prefix
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Display a MIME bundle in the notebook. The bundle is printed as a header
+     *  line, giving the MIME types and the length of each payload, followed by
+     *  one line per payload with its bytes in Base64.
+     *  @param data       the payload for each MIME type (e.g., "image/png")
+     *  @param displayId  the id used to update this output later, if any
+     *  @param update     whether to update the output with id `displayId`
+     */
+    def display (data: Seq [(String, Array [Byte])], displayId: String = "", update: Boolean = false)
+    {
+        val encoded = data.map { case (mime, bytes) => (mime, Base64.getEncoder.encodeToString (bytes)) }
+        val sb      = new StringBuilder (MIME)
+        sb.append ("{\"data\": [")
+        sb.append (encoded.map { case (mime, payload) => s"[${quote (mime)}, ${payload.length}]" }.mkString (", "))
+        sb.append (s"], \"display_id\": ${quote (displayId)}, \"update\": $update}\n")
+        for ((mime, payload) <- encoded) sb.append (payload).append ('\n')
+        Console.out.print (sb)
+        Console.out.flush ()
+    } // display
+
+    def displayPNG (png: Array [Byte], displayId: String = "", update: Boolean = false)
+    {
+        display (Seq ("image/png" -> png), displayId, update)
+    } // displayPNG
+
+    def displaySVG (svg: String, displayId: String = "", update: Boolean = false)
+    {
+        display (Seq ("image/svg+xml" -> utf8 (svg)), displayId, update)
+    } // displaySVG
+
+    def displayHTML (html: String, displayId: String = "", update: Boolean = false)
+    {
+        display (Seq ("text/html" -> utf8 (html)), displayId, update)
+    } // displayHTML
+
+    def displayJSON (json: String, displayId: String = "", update: Boolean = false)
+    {
+        display (Seq ("application/json" -> utf8 (json)), displayId, update)
+    } // displayJSON
+
+    private def utf8 (text: String): Array [Byte] = text.getBytes (StandardCharsets.UTF_8)
+
+    private def quote (text: String): String =
+    {
+        "\"" + text.flatMap {
+            case '"'  => "\\\""
+            case '\\' => "\\\\"
+            case c if c < ' ' => f"\\u${c.toInt}%04x"
+            case c    => c.toString
+        } + "\""
+    } // quote
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Write the array `a` to the file at `path` and return its length.
+     *  @param a     the array to write
+     *  @param path  the path of the file to (over)write
+     */
+    def writeDoubles (a: Array [Double], path: String): Int =
+    {
+        val ch = open (path)
+        try write (ch, a) finally ch.close ()
+        a.length
+    } // writeDoubles
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Attach `bytes` to the result of the running evaluation, as a binary
+     *  payload, and return whether or not it was attached. Payloads are only
+     *  supported by the bridge engine (see `ScalaTionKernelBridge`).
+     *  @param bytes  the payload
+     */
+    def attach (bytes: Array [Byte]): Boolean =
+    {
+        System.getProperties.get ("scalation.kernel.attach") match {
+        case consumer: java.util.function.Consumer [Array [Byte]] @unchecked => consumer.accept (bytes); true
+        case _ => false
+        } // match
+    } // attach
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Attach the array `a`, as raw little-endian doubles, to the result of the
+     *  running evaluation and return its length, or -1 if it was not attached.
+     *  @param a  the array to attach
+     */
+    def attachDoubles (a: Array [Double]): Int =
+    {
+        val buf = ByteBuffer.allocate (8 * a.length).order (ByteOrder.LITTLE_ENDIAN)
+        buf.asDoubleBuffer.put (a)
+        if (attach (buf.array)) a.length else -1
+    } // attachDoubles
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Return the JVM's resource usage as JSON: its heap and non-heap memory
+     *  (in bytes), the collections and time (in milliseconds) of each garbage
+     *  collector, its CPU time (in nanoseconds) and load, and its options. The
+     *  peak heap is the sum of the peaks of the heap's pools, so it is an upper
+     *  bound on the actual peak.
+     */
+    def resources (): String =
+    {
+        import java.lang.management.{ManagementFactory, MemoryType}
+        import scala.collection.JavaConverters._
+        val memory  = ManagementFactory.getMemoryMXBean
+        val heap    = memory.getHeapMemoryUsage
+        val nonHeap = memory.getNonHeapMemoryUsage
+        val peak    = ManagementFactory.getMemoryPoolMXBeans.asScala.filter (_.getType == MemoryType.HEAP)
+                                       .map (_.getPeakUsage.getUsed).sum
+        val gcs     = ManagementFactory.getGarbageCollectorMXBeans.asScala
+                                       .map (gc => s"[${quote (gc.getName)}, ${gc.getCollectionCount}, ${gc.getCollectionTime}]")
+        val runtime = ManagementFactory.getRuntimeMXBean
+        val (cpuTime, cpuLoad) = ManagementFactory.getOperatingSystemMXBean match {
+        case os: com.sun.management.OperatingSystemMXBean => (os.getProcessCpuTime, os.getProcessCpuLoad)
+        case _ => (-1L, -1.0)
+        } // match
+        s"""{"heap_used": ${heap.getUsed}, "heap_committed": ${heap.getCommitted}, "heap_max": ${heap.getMax}, """ +
+        s""""heap_peak": $peak, "non_heap_used": ${nonHeap.getUsed}, "non_heap_committed": ${nonHeap.getCommitted}, """ +
+        s""""gc": [${gcs.mkString (", ")}], "cpu_time": $cpuTime, "cpu_load": ${if (cpuLoad.isNaN) -1.0 else cpuLoad}, """ +
+        s""""processors": ${Runtime.getRuntime.availableProcessors}, "threads": ${ManagementFactory.getThreadMXBean.getThreadCount}, """ +
+        s""""uptime": ${runtime.getUptime}, "arguments": [${runtime.getInputArguments.asScala.map (quote).mkString (", ")}]}"""
+    } // resources
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Write the rows of `a` to the file at `path`, in row-major order, and
+     *  return its shape as "rows cols first step".
+     *  @param a     the array of rows to write
+     *  @param path  the path of the file to (over)write
+     */
+    def writeMatrix (a: Array [Array [Double]], path: String): String =
+    {
+        writeMatrix (a, path, 0, Int.MaxValue, 1, 0, Int.MaxValue, 1, 0)
+    } // writeMatrix
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Write a slice of the rows and columns of `a` to the file at `path`, in
+     *  row-major order, and return its shape as "rows cols first step", where
+     *  "first" and "step" describe the rows that were kept. Negative starts and
+     *  stops count back from the end, as in Python. If `maxRows` is positive,
+     *  the row step is widened so that at most `maxRows` rows are written.
+     *  @param a     the array of rows to write
+     *  @param path  the path of the file to (over)write
+     */
+    def writeMatrix (a: Array [Array [Double]], path: String,
+                     rowStart: Int, rowStop: Int, rowStep: Int,
+                     colStart: Int, colStop: Int, colStep: Int, maxRows: Int): String =
+    {
+        val rows = range (a.length, rowStart, rowStop, rowStep, maxRows)
+        val cols = range (if (a.length == 0) 0 else a(0).length, colStart, colStop, colStep, 0)
+        val ch   = open (path)
+        try {
+            val buf = buffer (cols.length)
+            if (a.length > 0 && cols.step == 1 && cols.length == a(0).length) {
+                for (i <- rows) write (ch, buf, a(i))
+            } else {
+                val row = Array.ofDim [Double] (cols.length)
+                for (i <- rows) {
+                    var k = 0
+                    for (j <- cols) { row(k) = a(i)(j); k += 1 }
+                    write (ch, buf, row)
+                } // for
+            } // if
+        } finally ch.close ()
+        s"${rows.length} ${cols.length} ${if (rows.isEmpty) 0 else rows.start} ${rows.step}"
+    } // writeMatrix
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Write the `cols` columns of the given `rows` to the file at `path` and
+     *  return the number of rows written. Each value is written as a
+     *  big-endian length followed by its UTF-8 string representation. If
+     *  `cols` is empty, then every column is written.
+     *  @param rows  the rows to write
+     *  @param cols  the indices of the columns to write
+     *  @param path  the path of the file to (over)write
+     */
+    def writeRows (rows: Seq [Seq [Any]], cols: Array [Int], path: String): Int =
+    {
+        val out = new DataOutputStream (new BufferedOutputStream (new FileOutputStream (path)))
+        try {
+            for (row <- rows) {
+                val values = if (cols.isEmpty) row else cols.toSeq.map (row(_))
+                for (value <- values) {
+                    val bytes = String.valueOf (value).getBytes (StandardCharsets.UTF_8)
+                    out.writeInt (bytes.length)
+                    out.write (bytes)
+                } // for
+            } // for
+        } finally out.close ()
+        rows.length
+    } // writeRows
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Write the array `a` to the file at `path` in the NPY format (i.e., as a
+     *  1-D array of little-endian doubles) and return its length.
+     *  @param a     the array to write
+     *  @param path  the path of the file to (over)write
+     */
+    def writeNPY (a: Array [Double], path: String): Int =
+    {
+        val ch = open (path)
+        try {
+            writeFully (ch, ByteBuffer.wrap (npyHeader (s"(${a.length},)")))
+            write (ch, a)
+        } finally ch.close ()
+        a.length
+    } // writeNPY
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Write the rows of `a` to the file at `path` in the NPY format (i.e., as
+     *  a 2-D, row-major array of little-endian doubles) and return its shape
+     *  as "rows cols".
+     *  @param a     the array of rows to write
+     *  @param path  the path of the file to (over)write
+     */
+    def writeNPY (a: Array [Array [Double]], path: String): String =
+    {
+        val cols = if (a.length == 0) 0 else a(0).length
+        val ch   = open (path)
+        try {
+            writeFully (ch, ByteBuffer.wrap (npyHeader (s"(${a.length}, $cols)")))
+            val buf = buffer (cols)
+            for (row <- a) write (ch, buf, row)
+        } finally ch.close ()
+        s"${a.length} $cols"
+    } // writeNPY
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Write `rows` to the file at `path` in the CSV format, after a `header`
+     *  line (unless it is empty), and return the number of rows written.
+     *  Values that contain a comma, quote or line break are quoted.
+     *  @param rows    the rows to write
+     *  @param header  the names of the columns
+     *  @param path    the path of the file to (over)write
+     */
+    def writeCSV (rows: Iterator [Seq [Any]], header: Seq [String], path: String): Int =
+    {
+        val out = new BufferedWriter (new OutputStreamWriter (new FileOutputStream (path), StandardCharsets.UTF_8), 1 << 20)
+        var n   = 0
+        try {
+            if (header.nonEmpty) out.write (header.map (csvField).mkString ("", ",", "\n"))
+            for (row <- rows) {
+                out.write (row.map (csvField).mkString ("", ",", "\n"))
+                n += 1
+            } // for
+        } finally out.close ()
+        n
+    } // writeCSV
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Read `n` little-endian doubles from the file at `path`, starting at byte
+     *  `offset`.
+     *  @param path    the path of the file to read
+     *  @param offset  the position of the first double
+     *  @param n       the number of doubles to read
+     */
+    def readDoubles (path: String, offset: Long, n: Int): Array [Double] =
+    {
+        val a  = Array.ofDim [Double] (n)
+        val ch = FileChannel.open (Paths.get (path), StandardOpenOption.READ)
+        try read (ch, buffer (n), offset, a) finally ch.close ()
+        a
+    } // readDoubles
+
+    //::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    /** Read a `rows` by `cols` row-major matrix of little-endian doubles from
+     *  the file at `path`, starting at byte `offset`.
+     *  @param path    the path of the file to read
+     *  @param offset  the position of the first double
+     *  @param rows    the number of rows to read
+     *  @param cols    the number of columns to read
+     */
+    def readMatrix (path: String, offset: Long, rows: Int, cols: Int): Array [Array [Double]] =
+    {
+        val a  = Array.ofDim [Double] (rows, cols)
+        val ch = FileChannel.open (Paths.get (path), StandardOpenOption.READ)
+        try {
+            val buf = buffer (cols)
+            for (i <- 0 until rows) read (ch, buf, offset + 8L * cols * i, a(i))
+        } finally ch.close ()
+        a
+    } // readMatrix
+
+    private def npyHeader (shape: String): Array [Byte] =
+    {
+        val dict = s"{'descr': '<f8', 'fortran_order': False, 'shape': $shape, }"
+        val text = dict + " " * ((64 - (10 + dict.length + 1) % 64) % 64) + "\n"
+        val head = ByteBuffer.allocate (10).order (ByteOrder.LITTLE_ENDIAN)
+        head.put (0x93.toByte).put ("NUMPY".getBytes (StandardCharsets.US_ASCII))
+        head.put (1.toByte).put (0.toByte).putShort (text.length.toShort)
+        head.array ++ text.getBytes (StandardCharsets.US_ASCII)
+    } // npyHeader
+
+    private def csvField (value: Any): String =
+    {
+        val text = String.valueOf (value)
+        if (text.exists (c => c == ',' || c == '"' || c == '\n' || c == '\r')) "\"" + text.replace ("\"", "\"\"") + "\""
+        else text
+    } // csvField
+
+    private def range (n: Int, start: Int, stop: Int, step: Int, max: Int): Range =
+    {
+        val lo = if (start < 0) (start + n) max 0 else start min n
+        val hi = if (stop < 0) (stop + n) max 0 else stop min n
+        val r  = lo until hi by step
+        if (max > 0 && r.length > max) lo until hi by (step * ((r.length + max - 1) / max))
+        else r
+    } // range
+
+    private def open (path: String): FileChannel =
+    {
+        FileChannel.open (Paths.get (path), StandardOpenOption.CREATE,
+                          StandardOpenOption.WRITE, StandardOpenOption.TRUNCATE_EXISTING)
+    } // open
+
+    private def buffer (n: Int): ByteBuffer =
+    {
+        ByteBuffer.allocate (8 * math.min (CHUNK, n max 1)).order (ByteOrder.LITTLE_ENDIAN)
+    } // buffer
+
+    private def write (ch: FileChannel, a: Array [Double]) { write (ch, buffer (a.length), a) }
+
+    private def write (ch: FileChannel, buf: ByteBuffer, a: Array [Double])
+    {
+        val m = buf.capacity / 8
+        var i = 0
+        while (i < a.length) {
+            val n = math.min (m, a.length - i)
+            buf.clear ()
+            buf.asDoubleBuffer.put (a, i, n)
+            buf.limit (8 * n)
+            writeFully (ch, buf)
+            i += n
+        } // while
+    } // write
+
+    private def writeFully (ch: FileChannel, buf: ByteBuffer)
+    {
+        while (buf.hasRemaining) ch.write (buf)
+    } // writeFully
+
+    private def read (ch: FileChannel, buf: ByteBuffer, offset: Long, a: Array [Double])
+    {
+        val m   = buf.capacity / 8
+        var pos = offset
+        var i   = 0
+        while (i < a.length) {
+            val n = math.min (m, a.length - i)
+            buf.clear ()
+            buf.limit (8 * n)
+            while (buf.hasRemaining) {
+                if (ch.read (buf, pos + buf.position) < 0) throw new java.io.EOFException (s"not enough data at $pos")
+            } // while
+            buf.flip ()
+            buf.asDoubleBuffer.get (a, i, n)
+            pos += 8 * n
+            i   += n
+        } // while
+    } // read
+
+} // ScalaTionKernelIO object
+
@@ -18,6 +18,19 @@ To undo this setting, use the <code>::debug_mode</code> command again.
 </p>
 """)
 
+toggle_batch_mode_template = Template("""
+<p>
+% if batch_mode:
+<strong>ScalaTion Kernel <code>batch_mode</code> enabled.</strong>
+Contiguous lines of Scala code will be sent to the REPL as a single block.
+% else:
+<strong>ScalaTion Kernel <code>batch_mode</code> disabled.</strong>
+Scala code will be sent to the REPL one line at a time.
+% endif
+To undo this setting, use the <code>::batch</code> command again.
+</p>
+""")
+
 debug_template = Template("""
 <style>
 #stack-${uuid} {
@@ -45,20 +58,137 @@ $("#toggle-${uuid}").click(function(){
 """)
 
 prettyr_template = Template("""
-<p><strong>Relation: ${name}</strong></p>
+<p><strong>Relation: ${name | h}</strong>
+% if len(data) < total:
+(rows ${offset} to ${offset + len(data) - 1} of ${total})
+% endif
+</p>
 <table>
 <tr>
 % for colName in colNames:
-    <th><code>${colName}</code></th>
+    <th><code>${colName | h}</code></th>
 % endfor
 </tr>
 % for row in data:
 <tr>
     % for item in row:
-    <td><code>${item}</code></td>
+    <td><code>${item | h}</code></td>
     % endfor
 </tr>
 % endfor 
 </table>
 """)
 
+
+toggle_timing_mode_template = Template("""
+<p>
+% if timing_mode:
+<strong>ScalaTion Kernel <code>timing_mode</code> enabled.</strong>
+The kernel will now respond with a breakdown of where the time went after each cell.
+% else:
+<strong>ScalaTion Kernel <code>timing_mode</code> disabled.</strong>
+% endif
+To undo this setting, use the <code>::timing</code> command again.
+</p>
+""")
+
+timing_template = Template("""
+<p><strong>ScalaTion Kernel Timing:</strong> cell took ${'%.1f' % (1000 * total)} ms</p>
+<table>
+<tr><th>timer</th><th>calls</th><th>total (ms)</th><th>% of cell</th></tr>
+% for name, count, seconds in rows:
+<tr>
+    <td><code>${name}</code></td>
+    <td>${count}</td>
+    <td>${'%.2f' % (1000 * seconds)}</td>
+    <td>${'%.1f' % (100 * seconds / total) if total > 0 else '-'}</td>
+</tr>
+% endfor
+</table>
+""")
+
+stats_template = Template("""
+<p><strong>ScalaTion Kernel Stats:</strong> timings for this session (percentiles are bucket upper bounds)</p>
+<table>
+<tr><th>timer</th><th>calls</th><th>total (ms)</th><th>mean (ms)</th><th>p50 (ms)</th><th>p95 (ms)</th><th>max (ms)</th><th>histogram (1 &mu;s &times; 2<sup>k</sup>)</th></tr>
+% for name, histogram in rows:
+<tr>
+    <td><code>${name}</code></td>
+    <td>${histogram.count}</td>
+    <td>${'%.2f' % (1000 * histogram.total)}</td>
+    <td>${'%.3f' % (1000 * histogram.total / histogram.count)}</td>
+    <td>${'%.3f' % (1000 * histogram.percentile(50))}</td>
+    <td>${'%.3f' % (1000 * histogram.percentile(95))}</td>
+    <td>${'%.3f' % (1000 * histogram.max)}</td>
+    <td><code>${sparkline(histogram.buckets)}</code></td>
+</tr>
+% endfor
+</table>
+""")
+
+cache_template = Template("""
+<p><strong>ScalaTion Kernel Cache:</strong> ${len(rows)} entries using
+${'%.1f' % (size / 2 ** 20)} of ${'%.1f' % (max_bytes / 2 ** 20)} MiB,
+${hits} hits and ${misses} misses. Use <code>::cache clear</code> to empty it.</p>
+% if len(rows) > 0:
+<table>
+<tr><th>kind</th><th>expression</th><th>arguments</th><th>size (KiB)</th><th>hits</th></tr>
+% for key, entry in rows:
+<tr>
+    <td>${key[0]}</td>
+    <td><code>${key[1] | h}</code></td>
+    <td><code>${', '.join(str(arg) for arg in key[2:]) | h}</code></td>
+    <td>${'%.1f' % (entry.size / 1024)}</td>
+    <td>${entry.hits}</td>
+</tr>
+% endfor
+</table>
+% endif
+""")
+
+parallel_template = Template("""
+<p><strong>ScalaTion Kernel Parallel:</strong> ${len(rows)} runs on ${workers} workers
+took ${'%.1f' % seconds} s${', {} failed'.format(failed) if failed > 0 else ''}.</p>
+<table>
+<tr>
+% for name in params:
+    <th>${name | h}</th>
+% endfor
+% for expr in collect:
+    <th><code>${expr | h}</code></th>
+% endfor
+</tr>
+% for run, values, error in rows:
+<tr${' style="color: red"' if error else ''}>
+% for name, value in run:
+    <td>${value | h}</td>
+% endfor
+% for value in values:
+    <td>${value | h}</td>
+% endfor
+</tr>
+% endfor
+</table>
+""")
+
+resources_template = Template("""
+<p><strong>ScalaTion Kernel Resources:</strong> the <code>${profile | h}</code> profile,
+${jvm['processors']} processors, up for ${'%.1f' % (jvm['uptime'] / 1000)} s.</p>
+<table>
+<tr><th>memory</th><th>used (MiB)</th><th>peak (MiB)</th><th>committed (MiB)</th><th>max (MiB)</th></tr>
+<tr><td>JVM heap</td><td>${mib(jvm['heap_used'])}</td><td>${mib(jvm['heap_peak'])}</td><td>${mib(jvm['heap_committed'])}</td><td>${mib(jvm['heap_max'])}</td></tr>
+<tr><td>JVM non-heap</td><td>${mib(jvm['non_heap_used'])}</td><td></td><td>${mib(jvm['non_heap_committed'])}</td><td></td></tr>
+<tr><td>JVM process (RSS)</td><td>${mib(jvm_rss)}</td><td>${mib(jvm_peak)}</td><td></td><td></td></tr>
+<tr><td>kernel process (RSS)</td><td>${mib(kernel_rss)}</td><td>${mib(kernel_peak)}</td><td></td><td></td></tr>
+</table>
+<table>
+<tr><th>garbage collector</th><th>collections</th><th>time (s)</th></tr>
+% for name, count, millis in jvm['gc']:
+<tr><td>${name | h}</td><td>${count}</td><td>${'%.3f' % (millis / 1000)}</td></tr>
+% endfor
+</table>
+<p>JVM CPU time ${'%.1f' % (jvm['cpu_time'] / 1e9) if jvm['cpu_time'] >= 0 else 'n/a'} s
+(load ${'%.0f%%' % (100 * jvm['cpu_load']) if jvm['cpu_load'] >= 0 else 'n/a'}, ${jvm['threads']} threads),
+kernel CPU time ${'%.1f' % kernel_cpu} s. JVM options:
+<code>${' '.join(jvm['arguments']) | h}</code></p>
+""")
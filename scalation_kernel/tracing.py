@@ -0,0 +1,161 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+"""Low-overhead timing instrumentation for ScalaTion Kernel.
+
+The kernel times the work it does using a ``Tracer``: the whole ``cell``,
+sending code to the REPL (``repl.send``) and waiting for its output
+(``repl.expect``), parsing that output (``output.parse``), moving data
+(``transfer.read``, ``transfer.parse``, ``transfer.export`` and
+``transfer.import``), rendering figures (``plot.render``), sending messages
+(``iopub.send``), running sweeps (``parallel.run``) and restoring definitions
+(``restore.load`` and ``restore.session``). Each timing costs two calls to ``time.perf_counter`` and
+is added to a breakdown for the current cell and to a histogram for the whole
+session. Coarse timings (i.e., spans) are also kept as events, which can be
+exported in the Chrome trace format (see ``chrome://tracing`` or Perfetto).
+"""
+
+import collections
+import json
+import math
+import os
+import threading
+import time
+
+TRACE_EVENTS  = 100000                    # most recent spans kept for export
+TRACE_BUCKETS = 32                        # histogram buckets (powers of two, from 1 us)
+
+class Histogram(object):
+    """A histogram of durations with power-of-two buckets, starting at one
+    microsecond.
+    """
+
+    __slots__ = ['count', 'total', 'max', 'buckets']
+
+    def __init__(self):
+        """Construct an empty histogram."""
+        self.count   = 0
+        self.total   = 0.0
+        self.max     = 0.0
+        self.buckets = [0] * TRACE_BUCKETS
+
+    def add(self, seconds):
+        """Add a duration of ``seconds`` to the histogram."""
+        self.count += 1
+        self.total += seconds
+        self.max    = max(self.max, seconds)
+        micros      = seconds * 1e6
+        bucket      = int(math.log2(micros)) + 1 if micros >= 1 else 0
+        self.buckets[min(bucket, TRACE_BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        """Return an upper bound, in seconds, on the ``q``-th percentile."""
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count > 0 and seen >= rank:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+class Span(object):
+    """A context manager that times a block of code for a ``Tracer``."""
+
+    __slots__ = ['tracer', 'name', 'start']
+
+    def __init__(self, tracer, name):
+        """Construct the span ``name``."""
+        self.tracer = tracer
+        self.name   = name
+
+    def __enter__(self):
+        """Start timing."""
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop timing and record the span."""
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start)
+
+class Tracer(object):
+    """Collect timings for the current cell and the whole session, and the
+    most recent ``max_events`` spans for export.
+    """
+
+    def __init__(self, max_events=TRACE_EVENTS):
+        """Construct the tracer."""
+        self.origin = time.perf_counter()
+        self.events = collections.deque(maxlen=max_events)   # (name, start, seconds, thread)
+        self.stats  = {}                                     # name -> Histogram
+        self.cell   = {}                                     # name -> [count, seconds]
+
+    def span(self, name):
+        """Return a context manager that times a block of code as ``name``."""
+        return Span(self, name)
+
+    def add(self, name, seconds):
+        """Add a timing of ``seconds`` for ``name`` without keeping an event,
+           which is cheaper for timings that happen once per line of output.
+        """
+        timing = self.cell.get(name)
+        if timing is None:
+            timing = self.cell[name] = [0, 0.0]
+        timing[0] += 1
+        timing[1] += seconds
+        histogram = self.stats.get(name)
+        if histogram is None:
+            histogram = self.stats[name] = Histogram()
+        histogram.add(seconds)
+
+    def record(self, name, start, seconds):
+        """Add a timing for ``name`` that started at ``start`` (in terms of
+           ``time.perf_counter``) and keep it as an event.
+        """
+        self.add(name, seconds)
+        self.events.append((name, start, seconds, threading.get_ident()))
+
+    def new_cell(self):
+        """Start the breakdown for a new cell."""
+        self.cell = {}
+
+    def breakdown(self):
+        """Return the current cell's timings as ``(name, count, seconds)``
+           tuples, from the most to the least time.
+        """
+        rows = [(name, count, seconds) for name, (count, seconds) in self.cell.items()]
+        return sorted(rows, key=lambda row: -row[2])
+
+    def chrome_trace(self):
+        """Return the events in the Chrome trace event format."""
+        pid    = os.getpid()
+        events = [{ 'name': name,
+                    'cat':  name.split('.', 1)[0],
+                    'ph':   'X',
+                    'ts':   (start - self.origin) * 1e6,
+                    'dur':  seconds * 1e6,
+                    'pid':  pid,
+                    'tid':  tid } for name, start, seconds, tid in list(self.events)]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        """Write the events to the file at ``path`` in the Chrome trace event
+           format and return the number of events written.
+        """
+        trace = self.chrome_trace()
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+        return len(trace['traceEvents'])
+
+def sparkline(buckets):
+    """Return the non-empty range of histogram ``buckets`` as a text sparkline,
+       prefixed by the index of its first bucket.
+    """
+    nonzero = [i for i, count in enumerate(buckets) if count > 0]
+    if len(nonzero) == 0:
+        return ''
+    first, last = nonzero[0], nonzero[-1]
+    most  = max(buckets)
+    bars  = ''.join(' ▁▂▃▄▅▆▇█'[0 if count == 0 else 1 + 7 * count // most] for count in buckets[first:last + 1])
+    return 'k={} {}'.format(first, bars)
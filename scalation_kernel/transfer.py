@@ -0,0 +1,220 @@
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# @author  Michael Cotterell
+# @see     LICENSE (MIT style license file).
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+import functools
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+from .arguments import CommandArgumentParser
+
+HELPER_NAME   = 'ScalaTionKernelIO'
+HELPER_SOURCE = os.path.join(os.path.dirname(__file__), 'scala', HELPER_NAME + '.scala')
+HELPER_LOADED = 'defined object {}'.format(HELPER_NAME)
+
+SCALA_INT_MAX = 2147483647
+
+EXCHANGE_FORMATS = ['npy', 'csv']         # file formats for ::export and ::import
+EXCHANGE_CHUNK   = 1 << 16                # rows converted at a time
+
+def scala_string(text):
+    """Return ``text`` as a Scala string literal."""
+    return json.dumps(text)
+
+def parse_slice(text):
+    """Parse a Python-style ``start:stop:step`` string, or a single index,
+       into a ``slice``. Only positive steps are supported.
+    """
+    parts = [int(part) if part.strip() != '' else None for part in text.split(':')]
+    if len(parts) == 1:
+        index = parts[0]
+        return slice(index, index + 1 if index != -1 else None)
+    if len(parts) > 3 or (len(parts) == 3 and parts[2] is not None and parts[2] < 1):
+        raise ValueError('invalid slice: {}'.format(text))
+    return slice(*parts)
+
+def slice_args(index):
+    """Return the ``start, stop, step`` arguments that the helper expects for
+       the slice ``index``.
+    """
+    start = 0 if index.start is None else index.start
+    stop  = SCALA_INT_MAX if index.stop is None else index.stop
+    step  = 1 if index.step is None else index.step
+    return start, stop, step
+
+class BulkChannel(object):
+    """A side channel for moving bulk numeric data out of the Scala REPL. The
+    ``ScalaTionKernelIO`` helper writes raw little-endian doubles to a file in
+    a private temporary directory and the kernel maps that file with NumPy, so
+    no decimal text ever passes through the terminal.
+    """
+
+    def __init__(self):
+        """Construct the channel and its temporary directory."""
+        self.directory = tempfile.mkdtemp(prefix='scalation_kernel_')
+
+    def new_path(self):
+        """Return a fresh file path inside the channel's directory."""
+        return os.path.join(self.directory, '{}.bin'.format(uuid.uuid4().hex))
+
+    def read(self, path, shape):
+        """Map the doubles in the file at ``path`` into a NumPy array of the
+           given ``shape``. The file is removed once it is mapped.
+        """
+        import numpy as np
+        try:
+            if os.path.getsize(path) == 0:
+                return np.zeros(shape, dtype='<f8')
+            return np.memmap(path, dtype='<f8', mode='r', shape=shape)
+        finally:
+            os.remove(path)
+
+    def read_rows(self, path, nrows, ncols):
+        """Read ``nrows`` rows of ``ncols`` length-prefixed UTF-8 strings from
+           the file at ``path``. The file is removed once it is read.
+        """
+        import struct
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        finally:
+            os.remove(path)
+        rows, pos = [], 0
+        for i in range(nrows):
+            row = []
+            for j in range(ncols):
+                size, = struct.unpack_from('>i', data, pos)
+                row.append(data[pos + 4:pos + 4 + size].decode('utf-8'))
+                pos += 4 + size
+            rows.append(row)
+        return rows
+
+    def close(self):
+        """Remove the channel's temporary directory."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+@functools.lru_cache(maxsize=None)
+def export_parser():
+    """Return the argument parser for ``::export``."""
+    parser = CommandArgumentParser(prog='::export', add_help=False)
+    parser.add_argument('name', help='a ScalaTion vector, matrix or relation')
+    parser.add_argument('path', metavar='FILE', help='the file to (over)write')
+    parser.add_argument('--format', choices=EXCHANGE_FORMATS, help='file format (default: by extension)')
+    return parser
+
+@functools.lru_cache(maxsize=None)
+def import_parser():
+    """Return the argument parser for ``::import``."""
+    parser = CommandArgumentParser(prog='::import', add_help=False)
+    parser.add_argument('name', help='the name to define')
+    parser.add_argument('path', metavar='FILE', help='the file to read')
+    parser.add_argument('--format', choices=EXCHANGE_FORMATS, help='file format (default: by extension)')
+    parser.add_argument('--as', dest='kind', choices=['vector', 'matrix', 'relation'],
+                        help='kind of object (default: by the shape of an NPY file; relation for CSV)')
+    parser.add_argument('--domain', help='ScalaTion domain of a relation\'s columns (default: inferred)')
+    return parser
+
+def exchange_format(path, format=None):
+    """Return the file format (one of ``EXCHANGE_FORMATS``) for the file at
+       ``path``, which is ``format`` if given, or else its extension.
+    """
+    format = format or os.path.splitext(path)[1].lstrip('.').lower()
+    if format not in EXCHANGE_FORMATS:
+        raise ValueError('unknown file format: {} (use --format {})'.format(format or path, '|'.join(EXCHANGE_FORMATS)))
+    return format
+
+def read_npy_header(path):
+    """Return the ``(shape, fortran_order, dtype, offset)`` of the NPY file at
+       ``path``, where ``offset`` is the position of its data.
+    """
+    import numpy as np
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        return shape, fortran_order, dtype, f.tell()
+
+def npy_doubles(path, dest):
+    """Make the data of the 1-D or 2-D NPY file at ``path`` available as raw,
+       row-major little-endian doubles and return ``(file, offset, shape)``
+       for them. If the file already holds such data, it is used as is;
+       otherwise, the data is converted, a chunk of rows at a time, into a new
+       file at ``dest``.
+    """
+    import numpy as np
+    shape, fortran_order, dtype, offset = read_npy_header(path)
+    if len(shape) not in (1, 2) or dtype.kind not in 'biuf':
+        raise ValueError('{} holds a {}-D array of {}, not a vector or matrix of numbers'.format(path, len(shape), dtype))
+    if dtype == np.dtype('<f8') and (not fortran_order or len(shape) == 1):
+        return path, offset, shape
+    data = np.load(path, mmap_mode='r')
+    out  = np.lib.format.open_memmap(dest, mode='w+', dtype='<f8', shape=shape)
+    for start in range(0, shape[0], EXCHANGE_CHUNK):
+        out[start:start + EXCHANGE_CHUNK] = data[start:start + EXCHANGE_CHUNK]
+    out.flush()
+    del out
+    return dest, read_npy_header(dest)[3], shape
+
+def csv_doubles(path, dest):
+    """Convert the numeric CSV file at ``path`` into raw, row-major
+       little-endian doubles in a new file at ``dest``, a chunk of rows at a
+       time, and return its ``(rows, cols)``. A first line that is not
+       numeric is taken to be a header and skipped.
+    """
+    import csv
+    import numpy as np
+    rows, cols = 0, None
+    with open(path, newline='') as f, open(dest, 'wb') as out:
+        chunk = []
+        for i, row in enumerate(csv.reader(f)):
+            if len(row) == 0:
+                continue
+            try:
+                values = [float(value) for value in row]
+            except ValueError:
+                if i == 0:
+                    continue                               # header
+                raise ValueError('{}, line {}: not a number in {}'.format(path, i + 1, row))
+            if cols is None:
+                cols = len(values)
+            elif len(values) != cols:
+                raise ValueError('{}, line {}: expected {} values, not {}'.format(path, i + 1, cols, len(values)))
+            chunk.append(values)
+            if len(chunk) == EXCHANGE_CHUNK:
+                out.write(np.asarray(chunk, dtype='<f8').tobytes())
+                rows, chunk = rows + len(chunk), []
+        if len(chunk) > 0:
+            out.write(np.asarray(chunk, dtype='<f8').tobytes())
+            rows += len(chunk)
+    return rows, cols or 0
+
+def csv_domain(path, sample=1000):
+    """Return the ScalaTion domain string (one character per column: ``I``
+       for integers, ``D`` for doubles and ``S`` for strings) of the CSV file
+       at ``path``, whose first line is a header, inferred from its first
+       ``sample`` rows. Empty values are ignored.
+    """
+    import csv
+    def kind(value):
+        for domain, parse in [('I', int), ('D', float)]:
+            try:
+                parse(value)
+                return domain
+            except ValueError:
+                pass
+        return 'S'
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        domain = ['I'] * len(header)                       # widened to D, then S
+        for i, row in zip(range(sample), reader):
+            for j, value in enumerate(row[:len(header)]):
+                if value.strip() != '':
+                    domain[j] = max(domain[j], kind(value.strip()), key='IDS'.index)
+    return ''.join(domain)
@@ -9,6 +9,7 @@ setup(
     name='scalation_kernel',
     version='1.2.1',
     packages=['scalation_kernel'],
+    package_data={'scalation_kernel': ['scala/*.scala']},
     description='ScalaTion kernel for Jupyter',
     long_description=readme,
     author='Michael E. Cotterell',
@@ -27,10 +28,11 @@ setup(
     ],
     install_requires=[
         'jupyter',
-        'ipykernel',
+        'ipykernel>=6',
         'pexpect',
         'mako',
         'matplotlib',
+        'numpy',
     ],
     keywords='jupyter kernel scala scalation',
 )